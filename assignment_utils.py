@@ -0,0 +1,215 @@
+import heapq
+
+import numpy as np
+
+from data_utils import PRIORITY_RANK, priority_rank
+from filter_utils import MID_LEVEL_ONLY_STATUS, is_mid_level_license
+from llm_utils import MATCH_COUNT
+
+# New providers each MD can take in one assignment run, per provider license group
+DEFAULT_CAPACITY = {"mid_level": 3, "other": 2}
+
+# Score points charged for each provider beyond the first assigned to the same MD, so
+# the solver prefers spreading tickets over near-equal MDs to stacking them on one
+SPREAD_PENALTY = 0.5
+
+# Score points it costs to leave a ticket unassigned, per TICKET_PRIORITY level above the
+# lowest, so when capacity runs short the more urgent tickets keep their MDs
+PRIORITY_WEIGHT = 1.0
+
+# Costs are integers (score points x COST_SCALE) so the flow solver stays exact
+COST_SCALE = 100
+
+
+def license_group(license_type):
+    return "mid_level" if is_mid_level_license(license_type) else "other"
+
+def md_capacities(doctors_df, capacity=None, overrides=None):
+    """
+    Returns {group: int array} with each MD's capacity for providers of that license group.
+    "Open - Mid Level Only" MDs have no capacity for other providers. overrides maps an
+    MD email to a {group: capacity} dict for MDs with their own limits.
+    """
+    capacity = {**DEFAULT_CAPACITY, **(capacity or {})}
+    mid_level_only = (doctors_df['ACCEPTING_STATUS'].astype(str).str.strip() == MID_LEVEL_ONLY_STATUS).to_numpy()
+    capacities = {group: np.full(len(doctors_df), limit, dtype=np.int32) for group, limit in capacity.items()}
+    capacities["other"][mid_level_only] = 0
+    for position, email in enumerate(doctors_df['EMAIL'].astype(str).str.lower()):
+        for group, limit in (overrides or {}).get(email, {}).items():
+            capacities[group][position] = 0 if group == "other" and mid_level_only[position] else limit
+    return capacities
+
+
+class MinCostFlow:
+    """
+    Successive shortest paths (Dijkstra with potentials) over a sparse graph with
+    non-negative integer costs. Each augment() pushes one unit from a given source node,
+    so supply can be added one ticket at a time, Hungarian-style: augmenting paths may
+    re-route units pushed earlier, so as long as every source can always reach the sink,
+    the flow after each call is the cheapest one for all the sources augmented so far.
+    """
+
+    def __init__(self, nodes):
+        self.graph = [[] for _ in range(nodes)]
+        self.potential = [0] * nodes
+
+    def add_edge(self, source, target, capacity, cost):
+        # Each edge is [target, capacity, cost, index of the reverse edge]
+        self.graph[source].append([target, capacity, cost, len(self.graph[target])])
+        self.graph[target].append([source, 0, -cost, len(self.graph[source]) - 1])
+        return source, len(self.graph[source]) - 1
+
+    def augment(self, source, sink):
+        """
+        Pushes one unit along the cheapest path from source to sink. Returns the path
+        cost, or None if the sink can't be reached.
+        """
+        potential = self.potential
+        distance = {source: 0}
+        previous = {}
+        done = set()
+        heap = [(0, source)]
+        while heap:
+            dist, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            # Nothing settled later can shorten the path to the sink
+            if node == sink:
+                break
+            for index, (target, capacity, cost, _) in enumerate(self.graph[node]):
+                if capacity <= 0 or target in done:
+                    continue
+                candidate = dist + cost + potential[node] - potential[target]
+                if target not in distance or candidate < distance[target]:
+                    distance[target] = candidate
+                    previous[target] = (node, index)
+                    heapq.heappush(heap, (candidate, target))
+        if sink not in done:
+            return None
+
+        # Only settled nodes move; shifting them by (distance - sink distance) keeps every
+        # residual reduced cost non-negative without touching the rest of the graph
+        reach = distance[sink]
+        for node in done:
+            potential[node] += distance[node] - reach
+
+        total = 0
+        node = sink
+        while node != source:
+            parent, index = previous[node]
+            edge = self.graph[parent][index]
+            edge[1] -= 1
+            self.graph[node][edge[3]][1] += 1
+            total += edge[2]
+            node = parent
+        return total
+
+
+def assign(scorer, providers_df, capacity=None, overrides=None, candidates=25, spread_penalty=SPREAD_PENALTY,
+           priority_weight=PRIORITY_WEIGHT):
+    """
+    Assigns the pending tickets in providers_df to MDs in one global solve, subject to each
+    MD's capacity per license group. The solve assigns as many tickets as capacity allows,
+    and among those solutions maximizes the total MatchScorer score, minus spread_penalty
+    points per extra provider on the same MD and priority_weight points per TICKET_PRIORITY
+    level of each ticket left unassigned. The result doesn't depend on row order.
+
+    Only each provider's top candidates eligible MDs are considered, which keeps the flow
+    graph sparse. Every ticket also has an "unassigned" edge straight to the sink, so each
+    one always carries a unit of flow and a later ticket can take an MD from an earlier one
+    (which moves to another MD or becomes unassigned) whenever that lowers the total cost.
+
+    Returns (assignments, remaining), where assignments[row] is (roster position, score)
+    or None for each provider row, and remaining is {group: int array} of leftover capacity.
+    """
+    doctors_df = scorer.doctors_df
+    capacities = md_capacities(doctors_df, capacity, overrides)
+    groups = list(capacities)
+    provider_groups = [groups.index(license_group(v)) for v in providers_df['PROVIDER_LICENSE_TYPE']]
+    positions, scores = scorer.shortlists(providers_df, k=candidates)
+
+    # Nodes: providers, (MD, group) pairs, MDs, sink
+    n_providers, n_mds = len(providers_df), len(doctors_df)
+    sink = n_providers + n_mds * len(groups) + n_mds
+    group_node = lambda md, group: n_providers + md * len(groups) + group
+    md_node = lambda md: n_providers + n_mds * len(groups) + md
+    solver = MinCostFlow(sink + 1)
+
+    # Leaving a ticket unassigned costs more than any set of assignments could, so the
+    # number of assigned tickets is maximized first
+    slot_cost = lambda slot: int(round(slot * spread_penalty * COST_SCALE))
+    max_slots = max((int(sum(capacities[group][md] for group in groups)) for md in range(n_mds)), default=0)
+    max_cost = 10 * COST_SCALE + slot_cost(max(max_slots - 1, 0))
+    levels = len(PRIORITY_RANK)
+    unassigned = (n_providers + 1) * max_cost + int(round(levels * priority_weight * COST_SCALE)) + 1
+    for row, value in enumerate(providers_df['TICKET_PRIORITY']):
+        urgency = levels - priority_rank(value)
+        solver.add_edge(row, sink, 1, unassigned + int(round(urgency * priority_weight * COST_SCALE)))
+
+    provider_edges = []
+    used_mds = set()
+    for row, (columns, row_scores) in enumerate(zip(positions, scores)):
+        group = provider_groups[row]
+        edges = []
+        for md, score in zip(columns, row_scores):
+            if capacities[groups[group]][md] <= 0:
+                continue
+            # Costs must be non-negative: charge the points missing from a perfect 10
+            edge = solver.add_edge(row, group_node(md, group), 1, int(round((10 - float(score)) * COST_SCALE)))
+            edges.append((edge, md, float(score)))
+            used_mds.add(int(md))
+        provider_edges.append(edges)
+
+    for md in used_mds:
+        for group_index, group in enumerate(groups):
+            if capacities[group][md] > 0:
+                solver.add_edge(group_node(md, group_index), md_node(md), int(capacities[group][md]), 0)
+        total = int(sum(capacities[group][md] for group in groups))
+        # One slot per unit of capacity, each more expensive than the last
+        for slot in range(total):
+            solver.add_edge(md_node(md), sink, 1, slot_cost(slot))
+
+    for row in range(n_providers):
+        solver.augment(row, sink)
+
+    assignments = [None] * n_providers
+    remaining = {group: limits.copy() for group, limits in capacities.items()}
+    for row, edges in enumerate(provider_edges):
+        for (node, index), md, score in edges:
+            if solver.graph[node][index][1] == 0:
+                assignments[row] = (int(md), score)
+                remaining[groups[provider_groups[row]]][md] -= 1
+                break
+    return assignments, remaining
+
+def assignment_matches(scorer, providers_df, assignments, remaining, match_count=MATCH_COUNT, candidates=25):
+    """
+    Turns assignments into per-ticket match lists in the LLM response shape: the assigned
+    MD first, then the ticket's other top candidates that still have capacity left for
+    its license group. capacity_status reports the MD's real status and remaining slots.
+    """
+    doctors_df = scorer.doctors_df
+    positions, scores = scorer.shortlists(providers_df, k=candidates)
+    results = []
+    for row, assigned in enumerate(assignments):
+        group = license_group(providers_df.iloc[row]['PROVIDER_LICENSE_TYPE'])
+        ranked = [assigned] if assigned else []
+        ranked += [
+            (int(md), float(score)) for md, score in zip(positions[row], scores[row])
+            if remaining[group][md] > 0 and (not assigned or md != assigned[0])
+        ]
+        matches = []
+        for position, (md, score) in enumerate(ranked[:match_count]):
+            doctor = doctors_df.iloc[md]
+            slots = int(remaining[group][md])
+            matches.append({
+                "name": str(doctor['FULL_NAME']),
+                "email": str(doctor['EMAIL']),
+                "capacity_status": f"{doctor['ACCEPTING_STATUS']} ({slots} slot{'s' if slots != 1 else ''} left)",
+                "match_score": round(score, 1),
+                "reasoning": "Assigned by the capacity-aware global solve." if assigned and position == 0
+                             else "Alternative with spare capacity after the global solve.",
+            })
+        results.append(matches)
+    return results
@@ -0,0 +1,360 @@
+"""
+Headless batch matcher for every pending "MD Matching" ticket.
+
+Loads TICKETS_QUERY and AVAILABLE_MDS_QUERY once, builds a prompt per ticket with
+create_prompt and fans the LLM calls out over an AsyncOpenAI client with a bounded
+number of concurrent requests and a tokens-per-minute limit. Parsed matches are
+appended to a JSONL results file as each ticket finishes.
+
+Usage:
+    python batch_match.py --concurrency 8 --tokens-per-minute 300000
+    python batch_match.py --tickets-csv tickets.csv --mds-csv mds.csv --base-url http://localhost:8765/v1
+    python batch_match.py --assign --capacity-mid-level 3 --capacity-other 2
+"""
+import argparse
+import asyncio
+import openai
+import orjson
+import os
+import pandas as pd
+import time
+
+from assignment_utils import DEFAULT_CAPACITY, assign, assignment_matches
+from cache_utils import DEFAULT_CACHE_DIR, ResponseCache, make_cache_key
+from client_utils import backoff_delay, is_retryable
+from data_utils import MartLoader, SnowflakeSource, SqliteSource, queue_order
+from filter_utils import MDIndex
+from llm_utils import (
+    DEFAULT_PARAMS,
+    MATCH_COUNT,
+    PRIMARY_MODEL,
+    TokenRateLimiter,
+    build_continuation_prompt,
+    clean_json_response,
+    count_tokens,
+    query_openai_async,
+)
+from metrics_utils import METRICS, configure_logging
+from parse_utils import merge_matches, parse_matches
+from prompt_utils import create_prompt
+from retrieval_utils import BioRetriever
+from scoring_utils import MatchScorer
+from service_utils import normalize_services
+
+DEFAULT_OUTPUT = os.path.join("results", "batch_matches.jsonl")
+
+
+def load_data(tickets_csv=None, mds_csv=None):
+    """
+    Loads the pending tickets and available MDs, either from CSV exports, from the SQLite
+    mart stand-in (MARTS_SQLITE_PATH) or from Snowflake (using the same connection settings
+    as the app). Both mart queries run concurrently.
+    """
+    if tickets_csv and mds_csv:
+        providers_df = pd.read_csv(tickets_csv)
+        doctors_df = pd.read_csv(mds_csv)
+        providers_df.columns = providers_df.columns.str.upper()
+        doctors_df.columns = doctors_df.columns.str.upper()
+        return normalize_services(providers_df), normalize_services(doctors_df)
+
+    if os.getenv("MARTS_SQLITE_PATH"):
+        source = SqliteSource(os.environ["MARTS_SQLITE_PATH"])
+    else:
+        import streamlit as st
+
+        source = SnowflakeSource(st.connection("snowflake"))
+    loader = MartLoader(source, start=False)
+    failed = loader.warm()
+    if failed:
+        raise RuntimeError(f"Failed to load {', '.join(failed)}: {loader.errors}")
+    return loader.get("tickets"), loader.get("mds")
+
+async def match_ticket(client, provider, doctors_df, md_index, semaphore, limiter, cache=None,
+                       model=PRIMARY_MODEL, params=None, scorer=None, retriever=None):
+    """
+    Builds the prompt for one ticket, queries the model and returns a result record.
+    With a scorer, MDs are sent in local score order, and with a retriever only the
+    best-aligned bios are sent, as in the app.
+    """
+    params = {"model": model, **DEFAULT_PARAMS, **(params or {})}
+    record = {
+        "ticket": str(provider["SUBJECT"]),
+        "provider_email": str(provider["PROVIDER_EMAIL"]),
+        "model": model,
+        "matches": None,
+        "dropped": [],
+        "raw_results": None,
+        "duration": 0.0,
+        "cached": False,
+        "prompt_tokens": None,
+        "completion_tokens": 0,
+        "params": params,
+        "error": None,
+    }
+
+    prompt_report = {}
+    prompt, error = create_prompt(
+        doctors_df, provider, md_index=md_index, scorer=scorer, model=model, max_tokens=params["max_tokens"],
+        retriever=retriever, report=prompt_report,
+    )
+    record["prompt_tokens"] = prompt_report.get("total")
+    if error:
+        record["error"] = error
+        return record
+
+    start = time.time()
+    try:
+        raw_response, params, cached = await _query(client, prompt, params, semaphore, limiter, cache)
+        record["cached"] = cached
+        record["model"] = params["model"]
+        record["params"] = params
+        record["raw_results"] = clean_json_response(raw_response)
+        record["completion_tokens"] = 0 if cached else count_tokens(record["raw_results"], params["model"])
+        parsed = parse_matches(record["raw_results"])
+
+        # If the response was cut off, ask only for the missing matches instead of starting over
+        if not parsed["complete"] and not parsed["error"] and len(parsed["matches"]) < MATCH_COUNT:
+            more_response, _, _ = await _query(
+                client, build_continuation_prompt(prompt, parsed["matches"]), params, semaphore, limiter, cache
+            )
+            more = parse_matches(clean_json_response(more_response))
+            parsed["matches"] = merge_matches(parsed["matches"], more["matches"])
+            parsed["dropped"] += more["dropped"]
+    except Exception as e:
+        record["error"] = f"API error: {e}"
+        record["duration"] = round(time.time() - start, 2)
+        return record
+
+    record["duration"] = round(time.time() - start, 2)
+    record["matches"] = parsed["matches"]
+    record["dropped"] = parsed["dropped"]
+    if parsed["error"] and not parsed["matches"]:
+        record["error"] = f"Error parsing JSON response: {parsed['error']}"
+    return record
+
+async def _query(client, prompt, params, semaphore, limiter, cache=None, max_attempts=3):
+    """
+    Returns (raw_response, params, cached), serving from the response cache when possible
+    and retrying rate limits and server errors with exponential backoff.
+    """
+    cache_key = make_cache_key(prompt, **params)
+    cached = cache.get(cache_key) if cache is not None else None
+    METRICS.increment("llm_requests", model=params["model"], cached=cached is not None)
+    if cached is not None:
+        return cached[0], cached[1], True
+
+    prompt_tokens = count_tokens(prompt, params["model"])
+    for attempt in range(max_attempts):
+        try:
+            async with semaphore:
+                await limiter.acquire(prompt_tokens + params["max_tokens"])
+                with METRICS.timer("llm_total", model=params["model"]):
+                    raw_response, params = await query_openai_async(client, prompt, model=params["model"], params=params)
+            break
+        except Exception as e:
+            METRICS.increment("llm_errors", model=params["model"], error=type(e).__name__)
+            if attempt == max_attempts - 1 or not is_retryable(e):
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+    METRICS.increment("prompt_tokens", prompt_tokens, model=params["model"])
+    METRICS.increment("completion_tokens", count_tokens(raw_response, params["model"]), model=params["model"])
+    if cache is not None:
+        cache.set(cache_key, raw_response, params)
+    return raw_response, params, False
+
+async def run_batch(providers_df, doctors_df, client, output_path=DEFAULT_OUTPUT, concurrency=8,
+                    tokens_per_minute=300_000, cache=None, model=PRIMARY_MODEL):
+    """
+    Matches every ticket in providers_df and appends one JSON line per ticket to output_path.
+    Returns the list of result records.
+    """
+    md_index = MDIndex(doctors_df)
+    retriever = BioRetriever(doctors_df)
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = TokenRateLimiter(tokens_per_minute)
+
+    tasks = [
+        match_ticket(client, provider, doctors_df, md_index, semaphore, limiter, cache=cache, model=model,
+                     retriever=retriever)
+        for _, provider in providers_df.iterrows()
+    ]
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    records = []
+    with open(output_path, "ab") as f:
+        for task in asyncio.as_completed(tasks):
+            record = await task
+            record["matched_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            f.write(orjson.dumps(record, default=str) + b"\n")
+            f.flush()
+            records.append(record)
+    return records
+
+def run_local(providers_df, doctors_df, output_path=DEFAULT_OUTPUT, k=MATCH_COUNT):
+    """
+    Scores every ticket against the roster with the local MatchScorer (no LLM calls)
+    and appends one JSON line per ticket to output_path. Returns the result records.
+    """
+    scorer = MatchScorer(doctors_df)
+    start = time.time()
+    with METRICS.timer("local_score"):
+        positions, scores = scorer.shortlists(providers_df, k=k)
+    METRICS.increment("local_tickets", len(providers_df))
+    duration = round(time.time() - start, 2)
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    records = []
+    with open(output_path, "ab") as f:
+        for (_, provider), columns, top_scores in zip(providers_df.iterrows(), positions, scores):
+            matches = [
+                {
+                    "name": str(doctors_df.iloc[column]["FULL_NAME"]),
+                    "email": str(doctors_df.iloc[column]["EMAIL"]),
+                    "capacity_status": str(doctors_df.iloc[column]["ACCEPTING_STATUS"]),
+                    "match_score": round(float(score), 1),
+                    "reasoning": "Local compatibility score",
+                }
+                for column, score in zip(columns, top_scores)
+            ]
+            record = {
+                "ticket": str(provider["SUBJECT"]),
+                "provider_email": str(provider["PROVIDER_EMAIL"]),
+                "model": "local-scorer",
+                "matches": matches,
+                "dropped": [],
+                "raw_results": None,
+                "duration": duration,
+                "cached": False,
+                "error": None if matches else "No eligible medical directors",
+                "matched_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            f.write(orjson.dumps(record, default=str) + b"\n")
+            records.append(record)
+    return records
+
+def run_assign(providers_df, doctors_df, output_path=DEFAULT_OUTPUT, capacity=None, k=MATCH_COUNT):
+    """
+    Assigns every ticket to an MD in one capacity-aware solve over the local scores (no LLM
+    calls) and appends one JSON line per ticket to output_path, most urgent tickets first.
+    The assigned MD comes first in each ticket's matches, followed by alternatives that
+    still have capacity. Returns the result records.
+    """
+    providers_df = queue_order(providers_df)
+    scorer = MatchScorer(doctors_df)
+    start = time.time()
+    with METRICS.timer("assignment_solve"):
+        assignments, remaining = assign(scorer, providers_df, capacity=capacity)
+    METRICS.increment("assignment_tickets", len(providers_df))
+    all_matches = assignment_matches(scorer, providers_df, assignments, remaining, match_count=k)
+    duration = round(time.time() - start, 2)
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    records = []
+    with open(output_path, "ab") as f:
+        for (_, provider), assigned, matches in zip(providers_df.iterrows(), assignments, all_matches):
+            record = {
+                "ticket": str(provider["SUBJECT"]),
+                "provider_email": str(provider["PROVIDER_EMAIL"]),
+                "model": "global-assignment",
+                "matches": matches,
+                "dropped": [],
+                "raw_results": None,
+                "duration": duration,
+                "cached": False,
+                "error": None if assigned else "No eligible medical director with capacity left",
+                "matched_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            f.write(orjson.dumps(record, default=str) + b"\n")
+            records.append(record)
+    return records
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Match every pending MD Matching ticket in one run.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSONL file results are appended to")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum concurrent OpenAI requests")
+    parser.add_argument("--tokens-per-minute", type=int, default=300_000, help="Token budget per minute")
+    parser.add_argument("--model", default=PRIMARY_MODEL)
+    parser.add_argument("--base-url", default=None, help="OpenAI-compatible endpoint, e.g. a local fake server")
+    parser.add_argument("--tickets-csv", default=None, help="Read tickets from a CSV export instead of Snowflake")
+    parser.add_argument("--mds-csv", default=None, help="Read MDs from a CSV export instead of Snowflake")
+    parser.add_argument("--no-cache", action="store_true", help="Skip the on-disk response cache")
+    parser.add_argument("--local", action="store_true", help="Rank MDs with the local scorer instead of the LLM")
+    parser.add_argument("--assign", action="store_true",
+                        help="Assign each ticket an MD in one capacity-aware solve over the local scores")
+    parser.add_argument("--capacity-mid-level", type=int, default=DEFAULT_CAPACITY["mid_level"],
+                        help="New NP/PA providers each MD can take in an --assign run")
+    parser.add_argument("--capacity-other", type=int, default=DEFAULT_CAPACITY["other"],
+                        help="New providers of other license types each MD can take in an --assign run")
+    parser.add_argument("--metrics-file", default=None, help="Write per-stage latency/token metrics (Prometheus text) here")
+    parser.add_argument("--metrics-log", default=None, help="Append the structured per-stage metric lines to this file")
+    args = parser.parse_args(argv)
+
+    if args.metrics_log:
+        configure_logging(path=args.metrics_log)
+    try:
+        run(args)
+    finally:
+        # Every mode (and a failed run) reports the stages it got through
+        for stage, series in METRICS.summary().items():
+            for labels, stats in series.items():
+                print(f"  {stage} {labels}: p50 {stats['p50']:.3f}s, p95 {stats['p95']:.3f}s over {stats['count']} calls")
+        if args.metrics_file:
+            METRICS.write_prometheus(args.metrics_file)
+
+
+def run(args):
+    """
+    Runs the mode selected on the command line (--assign, --local or LLM matching).
+    """
+    providers_df, doctors_df = load_data(args.tickets_csv, args.mds_csv)
+    if args.assign:
+        start = time.time()
+        records = run_assign(providers_df, doctors_df, output_path=args.output,
+                             capacity={"mid_level": args.capacity_mid_level, "other": args.capacity_other})
+        unassigned = [r for r in records if r["error"]]
+        print(f"Assigned {len(records) - len(unassigned)}/{len(records)} tickets in {time.time() - start:.2f}s. "
+              f"Results written to {args.output}")
+        for record in unassigned:
+            print(f"  {record['ticket']}: {record['error']}")
+        return
+    if args.local:
+        start = time.time()
+        records = run_local(providers_df, doctors_df, output_path=args.output)
+        print(f"Scored {len(records)} tickets locally in {time.time() - start:.2f}s. Results written to {args.output}")
+        return
+
+    client = openai.AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY", "not-needed"), base_url=args.base_url, max_retries=0
+    )
+    cache = None if args.no_cache else ResponseCache(os.getenv("LLM_CACHE_DIR", DEFAULT_CACHE_DIR))
+
+    start = time.time()
+    records = asyncio.run(run_batch(
+        providers_df,
+        doctors_df,
+        client,
+        output_path=args.output,
+        concurrency=args.concurrency,
+        tokens_per_minute=args.tokens_per_minute,
+        cache=cache,
+        model=args.model,
+    ))
+
+    failed = [r for r in records if r["error"]]
+    print(f"Matched {len(records) - len(failed)}/{len(records)} tickets in {time.time() - start:.1f}s "
+          f"({sum(r['cached'] for r in records)} from cache). Results written to {args.output}")
+    for record in failed:
+        print(f"  {record['ticket']}: {record['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Synthetic-scale benchmarks for the matching hot path.
+
+Generates synthetic hubspot_md_contacts_mart / hubspot_md_tickets_mart frames at each
+requested size (same size for MDs and tickets), then times:
+
+- normalize: service parsing/bitmasks at data load (normalize_services)
+- md_index: building the hard-constraint index (MDIndex)
+- create_prompt: building the matching prompt for a sample of tickets
+- service_badges: generate_service_badges over every ticket's raw services
+- md_lookup: building MDLookup and resolving 10 LLM matches per sampled ticket
+- parse: parse_matches over fake LLM responses
+- feedback_write: queueing and flushing feedback rows to a CSV stand-in for the sheet
+- llm_roundtrip: LLMClient calls against the deterministic fake OpenAI server
+
+Each scenario reports the median and p95 over --repeats runs. Results can be saved
+with --output and compared to a previous run with --baseline; a scenario slower than
+the baseline by more than --tolerance exits with status 1.
+
+Usage:
+    python benchmark.py --sizes 50,500,5000
+    python benchmark.py --sizes 50,50000 --repeats 3 --output results/benchmark.json
+    python benchmark.py --baseline results/benchmark.json --tolerance 1.3
+"""
+import argparse
+import orjson
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from client_utils import LLMClient
+from fake_openai import fake_matches, start_fake_server
+from feedback_utils import FEEDBACK_COLUMNS, CsvSheetAppender, QueuedFeedbackSink
+from filter_utils import MDIndex
+from lookup_utils import MDLookup
+from metrics_utils import quantile
+from parse_utils import parse_matches
+from prompt_utils import create_prompt
+from service_utils import generate_service_badges, normalize_services
+from synthetic_utils import generate_mds, generate_tickets
+
+DEFAULT_SIZES = [50, 500, 5000]
+SCENARIOS = ["normalize", "md_index", "create_prompt", "service_badges", "md_lookup", "parse",
+             "feedback_write", "llm_roundtrip"]
+
+
+def measure(func, repeats):
+    """
+    Runs func repeats times and returns the wall-clock seconds of each run.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def _garble(match, i):
+    """
+    Perturbs some matches the way the LLM does (case, wrapping, missing email).
+    """
+    if i % 3 == 1:
+        return {**match, "email": f"<{match['email'].upper()}>"}
+    if i % 3 == 2:
+        return {**match, "email": "", "name": match["name"].replace("Dr. ", "")}
+    return match
+
+def build_scenarios(size, sample=20, llm_requests=5, fake_latency=0.05, seed=0):
+    """
+    Generates the synthetic marts for one size and returns {scenario: callable}.
+    """
+    raw_mds, raw_tickets = generate_mds(size, seed), generate_tickets(size, seed)
+    doctors_df, providers_df = normalize_services(raw_mds), normalize_services(raw_tickets)
+    md_index = MDIndex(doctors_df)
+    sample_tickets = [providers_df.iloc[i] for i in range(min(sample, len(providers_df)))]
+
+    prompts = [create_prompt(doctors_df, provider, md_index=md_index)[0] for provider in sample_tickets]
+    prompts = [prompt for prompt in prompts if prompt]
+    responses = [orjson.dumps(fake_matches(prompt)).decode() for prompt in prompts]
+    matches = [
+        [_garble(match, i) for i, match in enumerate(orjson.loads(response)["matches"])]
+        for response in responses
+    ]
+
+    def run_create_prompt():
+        for provider in sample_tickets:
+            create_prompt(doctors_df, provider, md_index=md_index)
+
+    def run_md_lookup():
+        lookup = MDLookup(doctors_df)
+        for ticket_matches in matches:
+            lookup.resolve_all(ticket_matches)
+
+    def run_parse():
+        for response in responses:
+            parse_matches(response)
+
+    def run_service_badges():
+        for services in raw_tickets["PROVIDER_SERVICES"]:
+            generate_service_badges(services)
+
+    def run_feedback_write():
+        with tempfile.TemporaryDirectory() as directory:
+            sink = QueuedFeedbackSink(
+                CsvSheetAppender(os.path.join(directory, "sheet.csv")),
+                os.path.join(directory, "queue.sqlite3"),
+                start=False,
+            )
+            for i in range(min(size, 1000)):
+                sink.submit({column: f"{column} {i}" for column in FEEDBACK_COLUMNS})
+            sink.close()
+
+    scenarios = {
+        "normalize": lambda: normalize_services(raw_mds),
+        "md_index": lambda: MDIndex(doctors_df),
+        "create_prompt": run_create_prompt,
+        "service_badges": run_service_badges,
+        "md_lookup": run_md_lookup,
+        "parse": run_parse,
+        "feedback_write": run_feedback_write,
+    }
+
+    if llm_requests and prompts:
+        server, base_url = start_fake_server(latency=fake_latency, first_token_latency=fake_latency / 2)
+        llm_client = LLMClient("fake", base_url=base_url)
+
+        def run_llm_roundtrip():
+            for i in range(llm_requests):
+                llm_client.complete(prompts[i % len(prompts)])
+
+        scenarios["llm_roundtrip"] = run_llm_roundtrip
+        scenarios["_server"] = server
+    return scenarios
+
+def run(sizes, scenarios=SCENARIOS, repeats=5, sample=20, llm_requests=5, fake_latency=0.05):
+    """
+    Runs every scenario at every size. Returns {size: {scenario: {"median", "p95", "runs"}}}.
+    """
+    results = {}
+    for size in sizes:
+        start = time.perf_counter()
+        available = build_scenarios(size, sample, llm_requests, fake_latency)
+        print(f"Generated {size:,} MDs and tickets in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        server = available.pop("_server", None)
+        results[size] = {}
+        for name in scenarios:
+            if name not in available:
+                continue
+            timings = sorted(measure(available[name], repeats))
+            results[size][name] = {
+                "median": statistics.median(timings),
+                "p95": quantile(timings, 0.95),
+                "runs": len(timings),
+            }
+        if server is not None:
+            server.shutdown()
+    return results
+
+def format_results(results):
+    scenarios = [name for name in SCENARIOS if any(name in by_scenario for by_scenario in results.values())]
+    lines = [f"{'scenario':<16}" + "".join(f"{f'{size:,} median / p95':>28}" for size in results)]
+    for name in scenarios:
+        cells = [
+            f"{by_scenario[name]['median'] * 1000:>12.1f} / {by_scenario[name]['p95'] * 1000:>8.1f} ms"
+            if name in by_scenario else f"{'-':>28}"
+            for by_scenario in results.values()
+        ]
+        lines.append(f"{name:<16}" + "".join(f"{cell:>28}" for cell in cells))
+    return "\n".join(lines)
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a list of regressions: scenarios whose median is more than tolerance x the baseline median.
+    """
+    regressions = []
+    for size, by_scenario in results.items():
+        for name, stats in by_scenario.items():
+            previous = baseline.get(str(size), {}).get(name)
+            if previous and stats["median"] > previous["median"] * tolerance:
+                regressions.append(
+                    f"{name} at {size:,}: {stats['median'] * 1000:.1f} ms vs {previous['median'] * 1000:.1f} ms baseline"
+                )
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the matching hot path on synthetic marts.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="Comma-separated roster/ticket counts (50 to 50000)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--sample", type=int, default=20, help="Tickets used by the per-ticket scenarios")
+    parser.add_argument("--llm-requests", type=int, default=5, help="Fake LLM calls per llm_roundtrip run (0 to skip)")
+    parser.add_argument("--fake-latency", type=float, default=0.05, help="Fake server response latency in seconds")
+    parser.add_argument("--output", default=None, help="Write the results as JSON")
+    parser.add_argument("--baseline", default=None, help="Compare against a previous --output file")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="Allowed slowdown factor vs the baseline")
+    args = parser.parse_args(argv)
+
+    results = run(
+        [int(size) for size in args.sizes.split(",")],
+        scenarios=args.scenarios.split(","),
+        repeats=args.repeats,
+        sample=args.sample,
+        llm_requests=args.llm_requests,
+        fake_latency=args.fake_latency,
+    )
+    print(format_results(results))
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "wb") as f:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+
+    if args.baseline:
+        with open(args.baseline, "rb") as f:
+            regressions = compare(results, orjson.loads(f.read()), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
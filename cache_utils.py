@@ -0,0 +1,139 @@
+import hashlib
+import orjson
+import os
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(".cache", "llm_responses")
+
+
+def make_cache_key(prompt, model, temperature, max_tokens):
+    """
+    Builds a content-addressed key from the prompt text and the model params
+    that affect the completion.
+    """
+    payload = orjson.dumps({
+        "prompt": prompt,
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of LLM responses, one JSON file per key.
+
+    Entries older than max_age_seconds are treated as misses and removed. When the
+    cache grows past max_entries or max_bytes, the least recently used entries are
+    evicted. Hit/miss counters are kept per process and exposed through stats().
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_entries=1000, max_bytes=100 * 1024 * 1024,
+                 max_age_seconds=7 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """
+        Returns the cached (content, params) for a key, or None on a miss.
+        """
+        path = self._path(key)
+        with self._lock:
+            try:
+                with open(path, "rb") as f:
+                    entry = orjson.loads(f.read())
+            except (FileNotFoundError, orjson.JSONDecodeError):
+                self.misses += 1
+                return None
+
+            if self.max_age_seconds and time.time() - entry.get("created", 0) > self.max_age_seconds:
+                self._remove(path)
+                self.misses += 1
+                return None
+
+            # Touch the file so eviction is least-recently-used
+            os.utime(path, None)
+            self.hits += 1
+            return entry["content"], entry["params"]
+
+    def set(self, key, content, params):
+        """
+        Stores a response and evicts old entries if the cache is over its limits.
+        """
+        entry = orjson.dumps({"content": content, "params": params, "created": time.time()})
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with self._lock:
+            with open(tmp_path, "wb") as f:
+                f.write(entry)
+            os.replace(tmp_path, path)
+            self._evict()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            self.evictions += 1
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        entries = []
+        total_bytes = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+        # Oldest first
+        entries.sort()
+        now = time.time()
+        while entries and (
+            len(entries) > self.max_entries
+            or total_bytes > self.max_bytes
+            or (self.max_age_seconds and now - entries[0][0] > self.max_age_seconds)
+        ):
+            _, size, path = entries.pop(0)
+            total_bytes -= size
+            self._remove(path)
+
+    def clear(self):
+        """
+        Removes every cached entry.
+        """
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    self._remove(os.path.join(self.cache_dir, name))
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and current size of the cache.
+        """
+        files = [name for name in os.listdir(self.cache_dir) if name.endswith(".json")]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(files),
+            "bytes": sum(os.path.getsize(os.path.join(self.cache_dir, name)) for name in files),
+        }
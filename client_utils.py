@@ -0,0 +1,311 @@
+import itertools
+import queue
+import random
+import sys
+import threading
+import time
+
+from cache_utils import make_cache_key
+from llm_utils import (
+    DEFAULT_PARAMS, FALLBACK_MODEL, PRIMARY_MODEL, SYSTEM_PROMPT, build_messages, count_tokens, prompt_budget,
+)
+from metrics_utils import METRICS
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class LLMError(Exception):
+    """
+    Raised when no model produced a response. errors maps model -> exception.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"{model}: {error}" for model, error in errors.items()) or "No model available")
+
+
+def get_openai_client(api_key, base_url=None, timeout=120.0):
+    """
+    Returns the process-wide OpenAI client for an API key and endpoint, so every
+    request reuses the same pooled HTTP connections. Retries are handled by
+    LLMClient, so the SDK's own retries are turned off. The SDK is imported on first use,
+    which keeps it off the app's cold start.
+    """
+    key = (api_key, base_url)
+    with _clients_lock:
+        if key not in _clients:
+            import openai
+
+            _clients[key] = openai.OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+        return _clients[key]
+
+def is_retryable(error):
+    """
+    True for rate limits, overloads, timeouts, connection errors and 5xx responses.
+    """
+    # Only check SDK error types if the SDK is loaded; otherwise the error can't be one of them
+    openai = sys.modules.get("openai")
+    if openai is None:
+        return "overloaded_error" in str(error)
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return "overloaded_error" in str(error)
+
+def backoff_delay(attempt, base=0.5, cap=8.0):
+    """
+    Exponential backoff with full jitter for the given (0-based) retry attempt.
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Skips a model after failure_threshold consecutive failures. After reset_timeout
+    seconds one trial request is let through (half-open); success closes the circuit,
+    failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "half-open":
+                # Let a single trial request through
+                self.opened_at = time.monotonic()
+                return True
+            return state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class LLMClient:
+    """
+    Chat completions client shared across the process.
+
+    - One pooled OpenAI client per API key and endpoint, created on the first request
+    - Exponential backoff with jitter on 429/5xx and connection errors
+    - Hedged requests: if the primary model hasn't started responding within
+      hedge_after seconds (or fails), the fallback model is queried too and the
+      first one to respond wins
+    - A circuit breaker per model, so a model that keeps failing is skipped
+    """
+
+    def __init__(self, api_key, base_url=None, primary_model=PRIMARY_MODEL, fallback_model=FALLBACK_MODEL,
+                 hedge_after=20.0, max_attempts=3, failure_threshold=3, reset_timeout=60.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.primary_model = primary_model
+        self.fallback_model = fallback_model
+        self.hedge_after = hedge_after
+        self.max_attempts = max_attempts
+        self.hedge_wins = 0
+        self.breakers = {
+            model: CircuitBreaker(failure_threshold, reset_timeout)
+            for model in (primary_model, fallback_model)
+        }
+
+    @property
+    def client(self):
+        return get_openai_client(self.api_key, self.base_url)
+
+    def _open_stream(self, model, prompt, params):
+        """
+        Opens a streamed completion, retrying with backoff until the response starts.
+        """
+        for attempt in range(self.max_attempts):
+            try:
+                return self.client.chat.completions.create(
+                    messages=build_messages(prompt),
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **{**params, "model": model},
+                )
+            except Exception as e:
+                if attempt == self.max_attempts - 1 or not is_retryable(e):
+                    raise
+                time.sleep(backoff_delay(attempt))
+
+    def _fit_prompt(self, model, prompt, params, prompt_for=None):
+        """
+        Returns the prompt to send to model, or None if it doesn't fit the model's context
+        window. A prompt over the model's budget is rebuilt with prompt_for(model) if given.
+        """
+        budget = prompt_budget(model, params["max_tokens"])
+        if count_tokens(prompt, model) <= budget:
+            return prompt
+        if prompt_for is not None:
+            prompt = prompt_for(model)
+            if prompt is not None and count_tokens(prompt, model) <= budget:
+                return prompt
+        return None
+
+    def complete(self, prompt, params=None, on_delta=None, prompt_for=None):
+        """
+        Returns (content, params) for a prompt, with params["model"] set to the model
+        that actually answered. on_delta is called with each text chunk of the winning
+        response as it streams in. A model whose context window the prompt doesn't fit
+        (e.g. a smaller fallback) is sent prompt_for(model) instead, or skipped if
+        prompt_for isn't given. Raises LLMError if no model responded.
+        """
+        params = {**DEFAULT_PARAMS, **(params or {})}
+        results = queue.Queue()
+        lock = threading.Lock()
+        winner = {}
+        started = time.perf_counter()
+
+        def worker(model, model_prompt):
+            try:
+                stream = self._open_stream(model, model_prompt, params)
+                # A model has responded once its first token arrives, not when headers do
+                chunks = iter(stream)
+                first_chunks = []
+                for chunk in chunks:
+                    first_chunks.append(chunk)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        break
+            except Exception as e:
+                self.breakers[model].record_failure()
+                METRICS.increment("llm_errors", model=model, error=type(e).__name__)
+                results.put(("error", model, e))
+                return
+            with lock:
+                if winner:
+                    # Another model already answered; drop this response
+                    stream.close()
+                    return
+                winner["model"] = model
+            METRICS.observe("llm_first_token", time.perf_counter() - started, model=model)
+            results.put(("ok", model, itertools.chain(first_chunks, chunks)))
+
+        waiting, launched, errors = [self.primary_model, self.fallback_model], [], {}
+
+        def start_next():
+            # A breaker is only asked once its model's request is really about to start, so a
+            # half-open trial isn't used up by a hedge that never fires
+            while waiting:
+                model = waiting.pop(0)
+                model_prompt = self._fit_prompt(model, prompt, params, prompt_for)
+                if model_prompt is None:
+                    errors.setdefault(model, "prompt exceeds context window")
+                    continue
+                if self.breakers[model].allow():
+                    launched.append(model)
+                    threading.Thread(target=worker, args=(model, model_prompt), daemon=True).start()
+                    return True
+                errors.setdefault(model, "circuit open")
+            return False
+
+        if not start_next():
+            raise LLMError(errors)
+        pending = 1
+        while True:
+            timeout = self.hedge_after if waiting else None
+            try:
+                kind, model, payload = results.get(timeout=timeout)
+            except queue.Empty:
+                # Primary is slow to respond; hedge with the fallback
+                if start_next():
+                    pending += 1
+                continue
+
+            if kind == "ok":
+                if model != launched[0]:
+                    self.hedge_wins += 1
+                break
+            errors[model] = payload
+            pending -= 1
+            if start_next():
+                pending += 1
+            elif pending == 0:
+                raise LLMError(errors)
+
+        chunks = []
+        usage = None
+        try:
+            for chunk in payload:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    chunks.append(delta)
+                    if on_delta is not None:
+                        on_delta(delta)
+        except Exception as e:
+            self.breakers[model].record_failure()
+            raise LLMError({model: e}) from e
+
+        self.breakers[model].record_success()
+        content = "".join(chunks).strip()
+        METRICS.observe("llm_total", time.perf_counter() - started, model=model)
+        # Streams only report usage when the endpoint supports include_usage; otherwise count locally
+        if usage is not None:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        else:
+            prompt_tokens = count_tokens(SYSTEM_PROMPT, model) + count_tokens(prompt, model)
+            completion_tokens = count_tokens(content, model)
+        METRICS.increment("prompt_tokens", prompt_tokens, model=model)
+        METRICS.increment("completion_tokens", completion_tokens, model=model)
+        return content, {"model": model, **params}
+
+    def status(self):
+        """
+        Returns the circuit breaker state for each model and how often the fallback won.
+        """
+        return {
+            "circuits": {model: breaker.state for model, breaker in self.breakers.items()},
+            "fallback_wins": self.hedge_wins,
+        }
+
+
+def cached_complete(llm_client, prompt, params=None, cache=None, on_delta=None, prompt_for=None):
+    """
+    Returns (content, params, cached) for a prompt, serving identical prompt + params
+    from the ResponseCache and storing fresh responses in it. On a cache hit, on_delta
+    is called once with the whole cached content. prompt_for is passed to
+    LLMClient.complete to rebuild the prompt for a model with a smaller context window.
+    """
+    params = {"model": llm_client.primary_model, **DEFAULT_PARAMS, **(params or {})}
+    # Keyed on the requested params; the cached params record the model that actually answered
+    key = make_cache_key(prompt, **params)
+    cached = cache.get(key) if cache is not None else None
+    METRICS.increment("llm_requests", model=params["model"], cached=cached is not None)
+    if cached is not None:
+        if on_delta is not None:
+            on_delta(cached[0])
+        return cached[0], cached[1], True
+
+    request_params = {k: v for k, v in params.items() if k != "model"}
+    content, params = llm_client.complete(prompt, params=request_params, on_delta=on_delta, prompt_for=prompt_for)
+    if cache is not None:
+        cache.set(key, content, params)
+    return content, params, False
@@ -0,0 +1,389 @@
+import hashlib
+import numpy as np
+import os
+import pandas as pd
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from filter_utils import MID_LEVEL_ONLY_STATUS
+from metrics_utils import METRICS
+from service_utils import normalize_services
+from sql_queries import AVAILABLE_MDS_DELTA_QUERY, AVAILABLE_MDS_QUERY, TICKETS_DELTA_QUERY, TICKETS_QUERY
+
+PENDING_TICKET_STATUS = "Pending (MD Matching)"
+ACCEPTING_STATUSES = {"Open", MID_LEVEL_ONLY_STATUS}
+
+
+class MartTable:
+    """
+    One cached mart query: the full query, the delta query (rows updated since a
+    watermark), the key columns used to merge deltas and the predicate rows must
+    satisfy to stay in the snapshot.
+    """
+
+    def __init__(self, name, query, delta_query, key, keep):
+        self.name = name
+        self.query = query
+        self.delta_query = delta_query
+        self.key = key
+        self.keep = keep
+
+
+TICKETS_TABLE = MartTable(
+    "tickets", TICKETS_QUERY, TICKETS_DELTA_QUERY, ["SUBJECT", "PROVIDER_EMAIL"],
+    lambda df: df["TICKET_STATUS"] == PENDING_TICKET_STATUS,
+)
+MDS_TABLE = MartTable(
+    "mds", AVAILABLE_MDS_QUERY, AVAILABLE_MDS_DELTA_QUERY, ["EMAIL"],
+    lambda df: df["ACCEPTING_STATUS"].isin(ACCEPTING_STATUSES),
+)
+
+# TICKET_PRIORITY values, most urgent first; anything else ranks after "low"
+PRIORITY_RANK = {"urgent": 0, "high": 1, "medium": 2, "low": 3}
+
+# Where MartLoader keeps the last snapshot of each mart for fast cold starts
+DEFAULT_SNAPSHOT_DIR = os.path.join(".cache", "marts")
+
+
+def priority_rank(value):
+    return PRIORITY_RANK.get(str(value).strip().lower(), len(PRIORITY_RANK))
+
+def queue_order(providers_df):
+    """
+    Returns the tickets most urgent first: by TICKET_PRIORITY, then earliest KICK_OFF_DATE
+    (missing dates last), keeping mart order for ties.
+    """
+    order = pd.DataFrame({
+        "rank": [priority_rank(value) for value in providers_df['TICKET_PRIORITY']],
+        "kick_off": pd.to_datetime(providers_df['KICK_OFF_DATE'], errors="coerce").to_numpy(),
+    })
+    positions = order.sort_values(["rank", "kick_off"], kind="stable", na_position="last").index
+    return providers_df.iloc[positions]
+
+
+class SnowflakeSource:
+    """
+    Runs mart queries through the app's Streamlit Snowflake connection, bypassing its query cache.
+    conn can also be a function returning the connection, called on the first query.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.Lock()
+
+    def query(self, sql, params=None):
+        with self._lock:
+            if callable(self.conn) and not hasattr(self.conn, "query"):
+                self.conn = self.conn()
+        return self.conn.query(sql, ttl=0, params=params)
+
+
+class SqliteSource:
+    """
+    Local stand-in for the Snowflake marts: the same queries run against a SQLite file
+    holding hubspot_md_tickets_mart and hubspot_md_contacts_mart tables.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def query(self, sql, params=None):
+        sql = sql.replace("analytics.dbt.", "")
+        sql = re.sub(r"%\((\w+)\)s", r":\1", sql)
+        with sqlite3.connect(self.path) as db:
+            df = pd.read_sql_query(sql, db, params=params)
+        # Snowflake returns unquoted identifiers upper-cased
+        df.columns = df.columns.str.upper()
+        return df
+
+
+# Mart column names for the aliased query columns, used to build the SQLite stand-in
+TICKETS_MART_COLUMNS = {
+    "PROVIDER_EMAIL": "bird_eats_bug_email",
+    "PROVIDER_LICENSE_TYPE": "license_type",
+    "PROVIDER_EXPERIENCE_LEVEL": "experience_level",
+    "PROVIDER_STATE": "state_medspa_premise",
+    "PROVIDER_MD_LOCATION_PREFERENCE": "md_location_preference_state",
+    "PROVIDER_SERVICES": "services_provided",
+    "PROVIDER_FUTURE_SERVICES": "future_services",
+    "PROVIDER_ADDITIONAL_SERVICES": "additional_service_notes",
+}
+
+
+def write_sqlite_marts(path, tickets_df=None, mds_df=None, updated_at=None):
+    """
+    Writes (or upserts into) the SQLite stand-in for the marts from frames shaped like the
+    query results. Rows are stamped with updated_at (defaults to now, UTC).
+    """
+    updated_at = (updated_at or datetime.now(timezone.utc)).strftime("%Y-%m-%d %H:%M:%S")
+    with sqlite3.connect(path) as db:
+        for table, df, columns, key in [
+            ("hubspot_md_tickets_mart", tickets_df, TICKETS_MART_COLUMNS, ["subject", "bird_eats_bug_email"]),
+            ("hubspot_md_contacts_mart", mds_df, {}, ["email"]),
+        ]:
+            if df is None:
+                continue
+            df = df.rename(columns=lambda c: columns.get(c.upper(), c.lower())).assign(updated_at=updated_at)
+            df = df.astype({c: str for c in df.columns if df[c].dtype == object})
+            exists = db.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone()
+            if exists:
+                conditions = " AND ".join(f"{c} = ?" for c in key)
+                db.executemany(f"DELETE FROM {table} WHERE {conditions}", df[key].astype(str).values.tolist())
+            df.to_sql(table, db, if_exists="append", index=False)
+
+
+def frame_fingerprint(df):
+    """
+    Content hash of a frame's query columns (derived _LIST/_MASK columns excluded),
+    independent of row order. Stable across processes and reloads, so it can version
+    anything computed from the frame.
+    """
+    columns = sorted(column for column in df.columns if not column.endswith(("_LIST", "_MASK")))
+    row_hashes = np.sort(pd.util.hash_pandas_object(df[columns].astype(str), index=False).to_numpy())
+    return hashlib.sha256("|".join(columns).encode() + row_hashes.tobytes()).hexdigest()[:16]
+
+def merge_delta(df, delta, key, keep):
+    """
+    Merges changed rows into a cached frame: rows whose key appears in delta are replaced
+    in place by their new version, new rows are appended, and rows that no longer satisfy
+    keep are dropped.
+    """
+    if delta.empty:
+        return df
+    delta = delta.drop_duplicates(subset=key, keep="last")
+    df_keys = pd.MultiIndex.from_frame(df[key].astype(str))
+    delta_keys = pd.MultiIndex.from_frame(delta[key].astype(str))
+    replaced = df_keys.isin(delta_keys)
+
+    # Updated rows keep the position of the row they replace, new rows go last
+    position = dict(zip(df_keys, range(len(df))))
+    delta_order = [position.get(k, len(df) + i) for i, k in enumerate(delta_keys)]
+    kept = delta[keep(delta).to_numpy()].assign(_order=np.array(delta_order)[keep(delta).to_numpy()])
+    merged = pd.concat([df[~replaced].assign(_order=np.flatnonzero(~replaced)), kept])
+    return merged.sort_values("_order", kind="stable").drop(columns="_order").reset_index(drop=True)
+
+
+class Snapshot:
+    """
+    The last successfully loaded frame for a mart table.
+    """
+
+    def __init__(self, df, version, watermark, loaded_at):
+        self.df = df
+        self.version = version
+        self.fingerprint = frame_fingerprint(df)
+        self.watermark = watermark
+        self.loaded_at = loaded_at
+
+
+class MartLoader:
+    """
+    Stale-while-revalidate loader for the tickets and MD marts.
+
+    warm() loads every table concurrently; after that get() always returns the last
+    snapshot immediately while a background thread refreshes the tables every
+    refresh_interval seconds. Refreshes fetch only rows updated since the previous
+    load (minus overlap seconds to absorb clock skew and late commits) and merge them
+    into the snapshot; every full_refresh_interval seconds, or when a delta query
+    fails, the table is reloaded in full so hard deletes are picked up too. A failed
+    refresh keeps serving the previous snapshot and is reported through status().
+
+    With snapshot_dir set, every new snapshot is also written to disk. On start, tables
+    with a snapshot younger than max_snapshot_age are served from disk right away and
+    reloaded in the background, so a cold start doesn't wait on the warehouse.
+    """
+
+    def __init__(self, source, tables=(TICKETS_TABLE, MDS_TABLE), refresh_interval=300.0,
+                 full_refresh_interval=3600.0, overlap=300.0, transform=normalize_services, snapshot_dir=None,
+                 max_snapshot_age=86400.0, start=True):
+        self.source = source
+        self.tables = {table.name: table for table in tables}
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.overlap = overlap
+        self.transform = transform
+        self.snapshot_dir = snapshot_dir
+        self.max_snapshot_age = max_snapshot_age
+        self.snapshots = {}
+        self.errors = {}
+        self.delta_failures = {}
+        self.last_full = {}
+        self.source_columns = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=len(self.tables))
+        self._thread = None
+        if start:
+            restored = self.restore()
+            if len(restored) < len(self.tables):
+                self.warm()
+            self._thread = threading.Thread(target=self._run, args=(bool(restored),), daemon=True)
+            self._thread.start()
+
+    def _load(self, table, full):
+        snapshot = self.snapshots.get(table.name)
+        started = datetime.now(timezone.utc)
+        if snapshot is not None and not full:
+            since = (snapshot.watermark - timedelta(seconds=self.overlap)).strftime("%Y-%m-%d %H:%M:%S")
+            try:
+                with METRICS.timer("snowflake_load", table=table.name, mode="delta"):
+                    delta = self.source.query(table.delta_query, {"since": since})
+                METRICS.increment("snowflake_rows", len(delta), table=table.name, mode="delta")
+            except Exception:
+                self.delta_failures[table.name] = self.delta_failures.get(table.name, 0) + 1
+            else:
+                df = merge_delta(snapshot.df, self.transform(delta), table.key, table.keep)
+                # Re-fetched overlap rows that didn't change keep the snapshot version
+                version = snapshot.version if df.equals(snapshot.df) else snapshot.version + 1
+                return Snapshot(df, version, started, time.time())
+
+        with METRICS.timer("snowflake_load", table=table.name, mode="full"):
+            raw = self.source.query(table.query)
+        METRICS.increment("snowflake_rows", len(raw), table=table.name, mode="full")
+        self.source_columns[table.name] = list(raw.columns)
+        df = self.transform(raw)
+        self.last_full[table.name] = time.time()
+        version = snapshot.version + 1 if snapshot is not None else 1
+        return Snapshot(df, version, started, time.time())
+
+    def refresh(self, full=False):
+        """
+        Refreshes every table concurrently. Returns the names of tables that failed.
+        """
+        now = time.time()
+        futures = {
+            name: self._executor.submit(
+                self._load, table, full or now - self.last_full.get(name, 0) >= self.full_refresh_interval,
+            )
+            for name, table in self.tables.items()
+        }
+        failed = []
+        for name, future in futures.items():
+            try:
+                snapshot = future.result()
+            except Exception as e:
+                self.errors[name] = str(e)
+                failed.append(name)
+                continue
+            with self._lock:
+                previous = self.snapshots.get(name)
+                self.snapshots[name] = snapshot
+            self.errors.pop(name, None)
+            if self.snapshot_dir and (previous is None or previous.fingerprint != snapshot.fingerprint):
+                try:
+                    self._save(name, snapshot)
+                except Exception as e:
+                    # The in-memory snapshot is still served; only the next cold start is slower
+                    self.errors[name] = f"Snapshot not saved: {e}"
+        return failed
+
+    def warm(self):
+        """
+        Initial concurrent load of every table.
+        """
+        return self.refresh(full=True)
+
+    def _snapshot_path(self, name):
+        return os.path.join(self.snapshot_dir, f"{name}.pkl")
+
+    def _save(self, name, snapshot):
+        # Only the source columns are saved: columns the transform derives (such as service
+        # bitmasks, whose bits depend on this process's vocabulary) are rebuilt on restore
+        columns = [column for column in self.source_columns.get(name, snapshot.df.columns) if column in snapshot.df]
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        path = self._snapshot_path(name)
+        pd.to_pickle(
+            {"df": snapshot.df[columns], "version": snapshot.version, "watermark": snapshot.watermark,
+             "loaded_at": snapshot.loaded_at},
+            path + ".tmp",
+        )
+        os.replace(path + ".tmp", path)
+
+    def restore(self):
+        """
+        Loads the on-disk snapshots that are recent enough. Returns the names of the restored tables.
+        """
+        restored = []
+        for name in self.tables:
+            if not self.snapshot_dir or not os.path.exists(self._snapshot_path(name)):
+                continue
+            try:
+                saved = pd.read_pickle(self._snapshot_path(name))
+            except Exception as e:
+                self.errors[name] = f"Unreadable snapshot: {e}"
+                continue
+            if time.time() - saved["loaded_at"] > self.max_snapshot_age:
+                continue
+            df = self.transform(saved["df"])
+            with self._lock:
+                self.snapshots[name] = Snapshot(df, saved["version"], saved["watermark"], saved["loaded_at"])
+            restored.append(name)
+        return restored
+
+    def _run(self, refresh_now=False):
+        # Snapshots restored from disk are replaced with fresh data straight away
+        if refresh_now:
+            self.refresh()
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh()
+
+    def _latest(self, name):
+        with self._lock:
+            snapshot = self.snapshots.get(name)
+        if snapshot is None:
+            # Retry the warm-up for tables that failed to load the first time
+            self.refresh(full=True)
+            with self._lock:
+                snapshot = self.snapshots.get(name)
+        return snapshot
+
+    def get(self, name):
+        """
+        Returns the latest frame for a table, or None if it has never loaded.
+        """
+        snapshot = self._latest(name)
+        return snapshot.df if snapshot is not None else None
+
+    def current(self, name):
+        """
+        Returns (frame, fingerprint) for a table's latest snapshot, or (None, None) if it has
+        never loaded. Both come from the same snapshot, so a background refresh can't pair
+        one load's frame with another's fingerprint.
+        """
+        snapshot = self._latest(name)
+        return (snapshot.df, snapshot.fingerprint) if snapshot is not None else (None, None)
+
+    def version(self, name):
+        snapshot = self.snapshots.get(name)
+        return snapshot.version if snapshot is not None else 0
+
+    def fingerprint(self, name):
+        """
+        Content hash of a table's current snapshot (None if it has never loaded).
+        """
+        snapshot = self.snapshots.get(name)
+        return snapshot.fingerprint if snapshot is not None else None
+
+    def status(self):
+        status = {}
+        for name in self.tables:
+            status[name] = {"error": self.errors.get(name), "delta_failures": self.delta_failures.get(name, 0)}
+            snapshot = self.snapshots.get(name)
+            if snapshot is not None:
+                status[name].update({
+                    "rows": len(snapshot.df),
+                    "version": snapshot.version,
+                    "fingerprint": snapshot.fingerprint,
+                    "age_seconds": round(time.time() - snapshot.loaded_at, 1),
+                })
+        return status
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,239 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint, for testing the batch
+matcher and client code without calling the real API.
+
+Responses are deterministic: the fake "model" picks up to 10 medical directors
+listed in the prompt and scores them from a hash of the prompt and email.
+
+Latency can be set per model and errors can be injected (a fraction of requests,
+or every request for some models) to exercise retries, hedging and circuit breaking.
+
+Usage:
+    python fake_openai.py --port 8765 --latency 0.5
+    python fake_openai.py --model-latency gpt-4-turbo-preview=30 --error-rate 0.2 --error-status 429
+    python batch_match.py --base-url http://localhost:8765/v1 ...
+"""
+import argparse
+import hashlib
+import orjson
+import random
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# MD rows of the roster table in a prompt: "Name | Email | ..." (the header row has no "@")
+MD_PATTERN = re.compile(r"^(?P<name>[^|\n]+?) \| (?P<email>[^|\s]+@[^|\s]+) \|", re.MULTILINE)
+
+
+def fake_matches(prompt, limit=10):
+    """
+    Builds a deterministic matches payload from the MDs listed in a prompt.
+    """
+    matches = []
+    for found in MD_PATTERN.finditer(prompt):
+        name, email = found.group("name").strip(), found.group("email").strip()
+        digest = hashlib.sha256(f"{prompt}|{email}".encode()).digest()
+        matches.append({
+            "name": name,
+            "email": email,
+            "capacity_status": "Available",
+            "match_score": round(5 + (digest[0] / 255) * 5, 1),
+            "reasoning": f"{name} meets the state licensing requirements and offers the requested services.",
+        })
+    matches.sort(key=lambda m: m["match_score"], reverse=True)
+    return {"matches": matches[:limit]}
+
+def completion_body(model, content, prompt_tokens=0):
+    """
+    Wraps content in a chat.completion response body.
+    """
+    completion_tokens = max(1, len(content) // 4)
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def completion_chunks(model, content, chunk_size=24, prompt_tokens=None):
+    """
+    Splits content into chat.completion.chunk bodies as sent by a streamed response.
+    If prompt_tokens is given (stream_options.include_usage), a final usage chunk is added.
+    """
+    base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+    yield {**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}
+    for i in range(0, len(content), chunk_size):
+        yield {**base, "choices": [{"index": 0, "delta": {"content": content[i:i + chunk_size]}, "finish_reason": None}]}
+    yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    if prompt_tokens is not None:
+        completion_tokens = max(1, len(content) // 4)
+        yield {**base, "choices": [], "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }}
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    Serves POST /v1/chat/completions. With "stream": true the response is sent as
+    server-sent events: the first token is delayed by first_token_latency, then the
+    latency is spread evenly across the chunks.
+    Use make_handler() to configure latency and error injection.
+    """
+    latency = 0.0
+    model_latency = {}
+    first_token_latency = 0.0
+    model_first_token_latency = {}
+    error_rate = 0.0
+    error_status = 503
+    failing_models = frozenset()
+    rng = random.Random(0)
+    rng_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = orjson.dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = orjson.loads(self.rfile.read(length) or b"{}")
+        prompt = "\n".join(m.get("content", "") for m in request.get("messages", []) if m.get("role") == "user")
+
+        content = orjson.dumps(fake_matches(prompt)).decode()
+        model = request.get("model", "")
+        latency = self.model_latency.get(model, self.latency)
+
+        with self.rng_lock:
+            inject_error = self.rng.random() < self.error_rate
+        if inject_error or model in self.failing_models:
+            self._send_json(self.error_status, {"error": {
+                "message": "The server is overloaded (injected by fake_openai)",
+                "type": "overloaded_error" if self.error_status != 429 else "rate_limit_error",
+            }})
+            return
+
+        if request.get("stream"):
+            first_token_latency = self.model_first_token_latency.get(model, self.first_token_latency)
+            include_usage = (request.get("stream_options") or {}).get("include_usage")
+            chunks = completion_chunks(model, content, prompt_tokens=len(prompt) // 4 if include_usage else None)
+            self._send_stream(list(chunks), latency, first_token_latency)
+            return
+
+        if latency:
+            time.sleep(latency)
+        self._send_json(200, completion_body(model, content, prompt_tokens=len(prompt) // 4))
+
+    def _send_stream(self, chunks, latency, first_token_latency=0.0):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        if first_token_latency:
+            time.sleep(first_token_latency)
+        delay = latency / len(chunks) if chunks else 0
+        for chunk in chunks:
+            if delay:
+                time.sleep(delay)
+            self.wfile.write(b"data: " + orjson.dumps(chunk) + b"\n\n")
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def make_handler(latency=0.0, model_latency=None, first_token_latency=0.0, model_first_token_latency=None,
+                 error_rate=0.0, error_status=503, failing_models=(), seed=0):
+    """
+    Returns a FakeOpenAIHandler subclass with the given latency and error injection.
+    """
+    return type("ConfiguredFakeOpenAIHandler", (FakeOpenAIHandler,), {
+        "latency": latency,
+        "model_latency": dict(model_latency or {}),
+        "first_token_latency": first_token_latency,
+        "model_first_token_latency": dict(model_first_token_latency or {}),
+        "error_rate": error_rate,
+        "error_status": error_status,
+        "failing_models": frozenset(failing_models),
+        "rng": random.Random(seed),
+        "rng_lock": threading.Lock(),
+    })
+
+def start_fake_server(host="127.0.0.1", port=0, **options):
+    """
+    Starts the fake server in a background thread and returns (server, base_url).
+    Options are passed to make_handler(). Call server.shutdown() to stop it.
+    """
+    handler = make_handler(**options)
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+def _parse_model_seconds(items):
+    parsed = {}
+    for item in items:
+        model, seconds = item.rsplit("=", 1)
+        parsed[model] = float(seconds)
+    return parsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local fake OpenAI chat completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to generate each response")
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=SECONDS",
+                        help="Latency override for one model (repeatable)")
+    parser.add_argument("--first-token-latency", type=float, default=0.0,
+                        help="Seconds before the first token of a streamed response")
+    parser.add_argument("--model-first-token-latency", action="append", default=[], metavar="MODEL=SECONDS",
+                        help="First-token latency override for one model (repeatable)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status for injected errors")
+    parser.add_argument("--failing-model", action="append", default=[], help="Model that always fails (repeatable)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for error injection")
+    args = parser.parse_args(argv)
+
+    handler = make_handler(
+        latency=args.latency,
+        model_latency=_parse_model_seconds(args.model_latency),
+        first_token_latency=args.first_token_latency,
+        model_first_token_latency=_parse_model_seconds(args.model_first_token_latency),
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        failing_models=args.failing_model,
+        seed=args.seed,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"Fake OpenAI server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
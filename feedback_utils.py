@@ -0,0 +1,221 @@
+import csv
+import orjson
+import os
+import sqlite3
+import threading
+import time
+
+from metrics_utils import METRICS
+
+DEFAULT_QUEUE_PATH = os.path.join(".cache", "feedback_queue.sqlite3")
+
+FEEDBACK_COLUMNS = [
+    "Timestamp",
+    "User",
+    "Provider",
+    "Provider Email",
+    "Provider Data",
+    "AI Model",
+    "Model Params",
+    "Raw Results",
+    "Query Sent At",
+    "Request Duration (s)",
+    "Selected MD(s)",
+    "Feedback",
+]
+
+
+def _cell(value):
+    """
+    Converts a row value to something a sheet cell accepts.
+    """
+    if isinstance(value, bytes):
+        return value.decode()
+    if value is None:
+        return ""
+    if isinstance(value, (int, float, str)):
+        return value
+    return str(value)
+
+
+def open_worksheet(secrets, worksheet=None):
+    """
+    Opens the feedback worksheet through gspread's public API from the gsheets connection
+    secrets: the service account fields plus "spreadsheet" (the sheet's URL or title).
+    Opens the first worksheet unless a worksheet title is given.
+    """
+    import gspread
+
+    credentials = {key: value for key, value in secrets.items() if key not in ("spreadsheet", "worksheet")}
+    spreadsheet = secrets.get("spreadsheet")
+    if not spreadsheet:
+        raise ValueError("The gsheets secrets have no 'spreadsheet' URL or title")
+    client = gspread.service_account_from_dict(credentials)
+    if spreadsheet.startswith(("https://", "http://")):
+        sheet = client.open_by_url(spreadsheet)
+    else:
+        sheet = client.open(spreadsheet)
+    return sheet.worksheet(worksheet) if worksheet is not None else sheet.sheet1
+
+
+class SheetAppender:
+    """
+    Appends rows to the feedback Google Sheet with one batched append per flush,
+    instead of reading and rewriting the whole sheet.
+
+    secrets are the gsheets connection secrets (see open_worksheet) or a function returning
+    them; the sheet is only opened when the first rows are sent, so the Sheets SDK and
+    connection stay off the app's startup path.
+    """
+
+    def __init__(self, secrets, worksheet=None):
+        self.secrets = secrets
+        self.worksheet = worksheet
+        self._worksheet = None
+        self._header = None
+
+    def append_rows(self, rows):
+        if self._worksheet is None:
+            secrets = self.secrets() if callable(self.secrets) else self.secrets
+            self._worksheet = open_worksheet(secrets, self.worksheet)
+            self._header = self._worksheet.row_values(1)
+            if not self._header:
+                self._header = list(FEEDBACK_COLUMNS)
+                self._worksheet.append_row(self._header)
+
+        values = [[_cell(row.get(column, "")) for column in self._header] for row in rows]
+        self._worksheet.append_rows(values, value_input_option="RAW")
+
+
+class CsvSheetAppender:
+    """
+    Local stand-in for the feedback sheet that appends rows to a CSV file.
+    """
+
+    def __init__(self, path, columns=FEEDBACK_COLUMNS):
+        self.path = path
+        self.columns = columns
+
+    def append_rows(self, rows):
+        new_file = not os.path.exists(self.path)
+        with open(self.path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns, extrasaction="ignore")
+            if new_file:
+                writer.writeheader()
+            writer.writerows({column: _cell(row.get(column, "")) for column in self.columns} for row in rows)
+
+
+class QueuedFeedbackSink:
+    """
+    Append-only feedback sink. submit() writes the row to a durable local SQLite queue
+    and returns immediately; a background thread flushes queued rows to the sheet in
+    batched appends, retrying failed batches with exponential backoff. Rows survive
+    restarts and are sent on the next flush.
+    """
+
+    def __init__(self, appender, queue_path=DEFAULT_QUEUE_PATH, batch_size=50, flush_interval=5.0,
+                 max_backoff=300.0, start=True):
+        self.appender = appender
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.sent = 0
+        self.last_error = None
+
+        queue_dir = os.path.dirname(queue_path)
+        if queue_dir:
+            os.makedirs(queue_dir, exist_ok=True)
+        self._db = sqlite3.connect(queue_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS feedback_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created REAL NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0
+            )
+        """)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def submit(self, row):
+        """
+        Queues a feedback row durably and wakes the background flusher.
+        """
+        payload = orjson.dumps({key: _cell(value) for key, value in row.items()}).decode()
+        with self._lock:
+            self._db.execute("INSERT INTO feedback_queue (created, payload) VALUES (?, ?)", (time.time(), payload))
+        self._wake.set()
+
+    def flush(self):
+        """
+        Sends the oldest batch of queued rows to the sheet, keeping submission order.
+        Returns the number of rows sent (0 if nothing is due yet).
+        """
+        with self._lock:
+            batch = self._db.execute(
+                "SELECT id, payload, attempts, next_attempt FROM feedback_queue ORDER BY id LIMIT ?",
+                (self.batch_size,),
+            ).fetchall()
+        if not batch or batch[0][3] > time.time():
+            return 0
+
+        batch = [(row_id, payload, attempts) for row_id, payload, attempts, _ in batch]
+        ids = [row_id for row_id, _, _ in batch]
+        placeholders = ",".join("?" * len(ids))
+        try:
+            with METRICS.timer("sheet_write"):
+                self.appender.append_rows([orjson.loads(payload) for _, payload, _ in batch])
+            METRICS.increment("sheet_rows", len(batch))
+        except Exception as e:
+            self.last_error = str(e)
+            attempts = max(attempts for _, _, attempts in batch) + 1
+            delay = min(self.max_backoff, 2 ** attempts)
+            with self._lock:
+                self._db.execute(
+                    f"UPDATE feedback_queue SET attempts = attempts + 1, next_attempt = ? WHERE id IN ({placeholders})",
+                    [time.time() + delay, *ids],
+                )
+            return 0
+
+        with self._lock:
+            self._db.execute(f"DELETE FROM feedback_queue WHERE id IN ({placeholders})", ids)
+        self.sent += len(ids)
+        self.last_error = None
+        return len(ids)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            while not self._stop.is_set() and self.flush():
+                pass
+
+    def pending(self):
+        """
+        Number of rows waiting to be written to the sheet.
+        """
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM feedback_queue").fetchone()[0]
+
+    def stats(self):
+        return {"pending": self.pending(), "sent": self.sent, "last_error": self.last_error}
+
+    def close(self, flush=True):
+        """
+        Stops the background thread, optionally flushing everything that is due first.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        if flush:
+            while self.flush():
+                pass
+        self._db.close()
@@ -0,0 +1,122 @@
+import pandas as pd
+
+from service_utils import service_mask, service_masks, split_list_field
+
+MID_LEVEL_ONLY_STATUS = "Open - Mid Level Only"
+
+# License types that count as mid-level providers for "Open - Mid Level Only" MDs
+MID_LEVEL_LICENSE_TYPES = {
+    "np",
+    "pa",
+    "pa-c",
+    "nurse practitioner",
+    "physician assistant",
+    "physician associate",
+}
+
+US_STATES = {
+    "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas", "CA": "California",
+    "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware", "DC": "District of Columbia",
+    "FL": "Florida", "GA": "Georgia", "HI": "Hawaii", "ID": "Idaho", "IL": "Illinois",
+    "IN": "Indiana", "IA": "Iowa", "KS": "Kansas", "KY": "Kentucky", "LA": "Louisiana",
+    "ME": "Maine", "MD": "Maryland", "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota",
+    "MS": "Mississippi", "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada",
+    "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York",
+    "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma", "OR": "Oregon",
+    "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina", "SD": "South Dakota",
+    "TN": "Tennessee", "TX": "Texas", "UT": "Utah", "VT": "Vermont", "VA": "Virginia",
+    "WA": "Washington", "WV": "West Virginia", "WI": "Wisconsin", "WY": "Wyoming",
+}
+_STATE_NAMES = {name.lower(): name for name in US_STATES.values()}
+
+
+def normalize_state(value):
+    """
+    Normalizes a state name or two-letter abbreviation to its full name.
+    Returns an empty string for missing values.
+    """
+    if value is None or pd.isna(value):
+        return ""
+    value = str(value).strip()
+    if value.upper() in US_STATES:
+        return US_STATES[value.upper()]
+    return _STATE_NAMES.get(value.lower(), value)
+
+def is_mid_level_license(license_type):
+    """
+    Returns True if the provider license type counts as mid-level (NP/PA).
+    """
+    if license_type is None or pd.isna(license_type):
+        return False
+    return str(license_type).strip().lower() in MID_LEVEL_LICENSE_TYPES
+
+
+class MDIndex:
+    """
+    Precomputed lookups over the available MD roster (AVAILABLE_MDS_QUERY) used to
+    enforce the hard matching constraints before a prompt is built:
+
+    - California providers can only be matched with MDs residing in California
+    - The MD must be licensed in (or reside in) the provider's state
+    - "Open - Mid Level Only" MDs are only offered to mid-level providers
+    - The MD must accept at least one of the provider's current services, compared on
+      the canonical service bitmasks (MDs that don't list accepted services are kept)
+
+    Build it once per roster load and reuse it for every ticket.
+    """
+
+    def __init__(self, doctors_df):
+        self.doctors_df = doctors_df
+        self.all_mds = set(doctors_df.index)
+        self.by_residing_state = {}
+        self.by_licensed_state = {}
+        self.mid_level_only = set()
+        self.labels = doctors_df.index.to_numpy()
+        self.service_masks = service_masks(doctors_df, 'ACCEPTED_SERVICES')
+
+        for idx, doctor in doctors_df.iterrows():
+            residing_state = normalize_state(doctor.get('RESIDING_STATE'))
+            licensed_states = {normalize_state(s) for s in split_list_field(doctor.get('LICENSED_STATES'))}
+            if residing_state:
+                self.by_residing_state.setdefault(residing_state, set()).add(idx)
+                licensed_states.add(residing_state)
+            for state in licensed_states:
+                self.by_licensed_state.setdefault(state, set()).add(idx)
+
+            if str(doctor.get('ACCEPTING_STATUS', '')).strip() == MID_LEVEL_ONLY_STATUS:
+                self.mid_level_only.add(idx)
+
+    def __len__(self):
+        return len(self.all_mds)
+
+    def eligible_ids(self, provider):
+        """
+        Returns the set of roster index labels that satisfy the hard constraints for a provider.
+        """
+        candidates = set(self.all_mds)
+
+        provider_state = normalize_state(provider.get('PROVIDER_STATE'))
+        if provider_state:
+            if provider_state == "California":
+                candidates &= self.by_residing_state.get(provider_state, set())
+            candidates &= self.by_licensed_state.get(provider_state, set())
+
+        if not is_mid_level_license(provider.get('PROVIDER_LICENSE_TYPE')):
+            candidates -= self.mid_level_only
+
+        # Service overlap is a single bitwise AND across the roster
+        provider_services = service_mask(provider, 'PROVIDER_SERVICES')
+        if provider_services:
+            masks = self.service_masks if provider_services < 2 ** 63 else self.service_masks.astype(object)
+            offering = ((masks & provider_services) != 0) | (masks == 0)
+            candidates &= set(self.labels[offering.astype(bool)])
+
+        return candidates
+
+    def eligible_mds(self, provider):
+        """
+        Returns the subset of the roster that satisfies the hard constraints for a provider,
+        in roster order.
+        """
+        candidates = self.eligible_ids(provider)
+        return self.doctors_df[self.doctors_df.index.isin(candidates)]
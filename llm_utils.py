@@ -0,0 +1,168 @@
+import asyncio
+import functools
+import re
+import time
+
+try:
+    import tiktoken
+except ImportError:  # Optional: token counts fall back to the ~4 characters per token estimate
+    tiktoken = None
+
+PRIMARY_MODEL = "gpt-4-turbo-preview"
+FALLBACK_MODEL = "gpt-3.5-turbo"
+
+DEFAULT_PARAMS = {
+    "max_tokens": 4000,
+    "temperature": 0.2,
+}
+
+# Number of matches requested per ticket
+MATCH_COUNT = 10
+
+# Context window (prompt + completion tokens) per model
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4-turbo-preview": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Tokens the chat format adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SYSTEM_PROMPT = """
+    You are a medical staffing expert at Moxie. You help match nurses with medical
+    directors based on their location, experience, services offered, personality traits,
+    and other relevant factors. You always prioritize state licensing requirements (especially
+    for California) and capacity limitations. You always respond in JSON format as specified
+    in the prompts.
+"""
+
+
+def build_messages(prompt):
+    """
+    Builds the chat messages sent to the model for a matching prompt.
+    """
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+def build_continuation_prompt(prompt, matches, total=MATCH_COUNT):
+    """
+    Builds a prompt asking the model for only the matches missing from a truncated
+    response, instead of regenerating the ones already received.
+    """
+    received = "\n".join(f"    - {m['name']} ({m['email']})" for m in matches)
+    remaining = max(total - len(matches), 1)
+    return f"""{prompt}
+
+    Your previous response was cut off. These matches were already received:
+{received}
+
+    Continue with ONLY the next {remaining} best matches, excluding the doctors above. Use the same
+    JSON format and keep each reasoning concise.
+    """
+
+def clean_json_response(response):
+    """
+    Cleans the JSON response from the OpenAI API
+    """
+    if isinstance(response, bytes):
+        response = response.decode()
+    # Remove code fences if present
+    response = re.sub(r"^```(?:json)?|```$", "", response.strip(), flags=re.MULTILINE)
+    # Remove any leading/trailing whitespace again
+    return response.strip()
+
+def estimate_tokens(text):
+    """
+    Rough token estimate (~4 characters per token) used for rate limiting.
+    """
+    return max(1, len(text) // 4)
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text, model=PRIMARY_MODEL):
+    """
+    Counts the tokens in text for a model with tiktoken, or estimates them if tiktoken isn't installed.
+    """
+    if not text:
+        return 0
+    if tiktoken is None:
+        return estimate_tokens(text)
+    return len(_encoding(model).encode(text))
+
+def truncate_tokens(text, budget, model=PRIMARY_MODEL):
+    """
+    Cuts text down to at most budget tokens, at a word boundary, marking the cut with "…".
+    """
+    if budget <= 0:
+        return ""
+    if count_tokens(text, model) <= budget:
+        return text
+    if tiktoken is None:
+        cut = text[:budget * 4 - 1]
+    else:
+        cut = _encoding(model).decode(_encoding(model).encode(text)[:budget - 1])
+    return cut.rsplit(" ", 1)[0].rstrip(" ,;:.") + "…"
+
+def context_window(model=PRIMARY_MODEL):
+    return MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+def prompt_budget(model=PRIMARY_MODEL, max_tokens=DEFAULT_PARAMS["max_tokens"]):
+    """
+    Tokens left for the user prompt once the system prompt, the chat message overhead
+    and the completion (max_tokens) are reserved in the model's context window.
+    """
+    reserved = count_tokens(SYSTEM_PROMPT, model) + 2 * MESSAGE_OVERHEAD_TOKENS + max_tokens
+    return context_window(model) - reserved
+
+
+class TokenRateLimiter:
+    """
+    Async token bucket that limits how many tokens are sent per minute.
+    A request larger than the whole budget is let through once the bucket is full.
+    """
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = tokens_per_minute
+        self.tokens = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens):
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+
+async def query_openai_async(client, prompt, model=PRIMARY_MODEL, params=None):
+    """
+    Calls the chat completions API with an AsyncOpenAI client and returns the raw
+    response text along with the model and parameters used.
+    """
+    params = {"model": model, **DEFAULT_PARAMS, **(params or {})}
+    response = await client.chat.completions.create(
+        messages=build_messages(prompt),
+        **params,
+    )
+    return response.choices[0].message.content.strip(), params
@@ -0,0 +1,114 @@
+import difflib
+import re
+
+import pandas as pd
+
+# Honorifics and credentials the LLM adds to or drops from MD names
+NAME_NOISE = {"dr", "doctor", "md", "do", "np", "pa", "phd", "mph", "facs", "jr", "sr", "ii", "iii"}
+
+
+def normalize_email(value):
+    """
+    Lower-cases an email and strips the wrapping the LLM sometimes adds (mailto:, <>, quotes, trailing dots).
+    """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    value = str(value).strip().lower()
+    value = re.sub(r"^mailto:", "", value)
+    return value.strip("<>\"'`()[] .,;")
+
+def name_tokens(value):
+    """
+    Splits a name into lower-case tokens without honorifics, credentials or punctuation.
+    """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return []
+    tokens = re.sub(r"[^a-z0-9\s-]", " ", str(value).lower()).replace("-", " ").split()
+    return [token for token in tokens if token not in NAME_NOISE]
+
+
+class MDLookup:
+    """
+    Resolves MDs returned by the LLM to rows of the roster snapshot in constant time.
+
+    Built once per roster snapshot. A match is resolved by its normalized email first,
+    then by the email's local part (the LLM sometimes garbles the domain), then by the
+    normalized name, and finally by a fuzzy comparison against the few MDs that share
+    the returned name's surname (or all of its name tokens). A name shared by several
+    MDs doesn't resolve.
+    """
+
+    def __init__(self, doctors_df, min_similarity=0.85):
+        self.doctors_df = doctors_df
+        self.min_similarity = min_similarity
+        self.by_email = {}
+        self.by_local_part = {}
+        self.by_name = {}
+        self.by_name_token = {}
+        self.by_surname = {}
+        self.names = []
+
+        for position, (email, name) in enumerate(zip(doctors_df['EMAIL'], doctors_df['FULL_NAME'])):
+            email = normalize_email(email)
+            tokens = name_tokens(name)
+            self.names.append(" ".join(tokens))
+            if email:
+                self.by_email.setdefault(email, position)
+                self.by_local_part.setdefault(email.split("@")[0], set()).add(position)
+            if tokens:
+                self.by_name.setdefault(" ".join(tokens), set()).add(position)
+                self.by_surname.setdefault(tokens[-1], set()).add(position)
+                for token in tokens:
+                    self.by_name_token.setdefault(token, set()).add(position)
+
+    def position(self, match):
+        """
+        Returns (roster position, how it was resolved) for an LLM match, or (None, None)
+        if it can't be resolved unambiguously.
+        """
+        email = normalize_email(match.get('email'))
+        if email in self.by_email:
+            return self.by_email[email], "email"
+
+        local_part = self.by_local_part.get(email.split("@")[0], set()) if email else set()
+        if len(local_part) == 1:
+            return next(iter(local_part)), "email local part"
+
+        tokens = name_tokens(match.get('name'))
+        name = " ".join(tokens)
+        same_name = self.by_name.get(name, set())
+        if len(same_name) == 1:
+            return next(iter(same_name)), "name"
+        if len(same_name) > 1 or not tokens:
+            return None, None
+
+        # Fuzzy fallback only compares against MDs with the same surname, or with every
+        # token of the returned name (e.g. "Lopez Olivia"); a shared first name isn't enough
+        candidates = set(self.by_surname.get(tokens[-1], set()))
+        candidates |= set.intersection(*(self.by_name_token.get(token, set()) for token in tokens))
+        ordered = " ".join(sorted(tokens))
+        scored = sorted(
+            ((max(difflib.SequenceMatcher(None, name, self.names[position]).ratio(),
+                  difflib.SequenceMatcher(None, ordered, " ".join(sorted(self.names[position].split()))).ratio()),
+              position)
+             for position in candidates),
+            reverse=True,
+        )
+        if scored and scored[0][0] >= self.min_similarity and (len(scored) == 1 or scored[1][0] < scored[0][0]):
+            return scored[0][1], "fuzzy name"
+        return None, None
+
+    def resolve(self, match):
+        """
+        Returns the roster row for an LLM match, or None if it can't be resolved.
+        """
+        position, _ = self.position(match)
+        return self.doctors_df.iloc[position] if position is not None else None
+
+    def resolve_all(self, matches):
+        """
+        Returns ([(match, row), ...], unresolved) for a list of LLM matches, where row is
+        None for matches that couldn't be resolved and unresolved lists those matches.
+        """
+        resolved = [(match, self.resolve(match)) for match in matches]
+        return resolved, [match for match, row in resolved if row is None]
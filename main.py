@@ -1,103 +1,92 @@
-import ast
+import time
+
+# Taken before the other imports so the first run can report how long they took
+SCRIPT_START = time.perf_counter()
+
 import json
-import openai
 import orjson
 import os
 import pandas as pd
-import re
+import sqlite3
 import streamlit as st
-import time
 
-from prompt_utils import create_prompt
-from streamlit_gsheets import GSheetsConnection
-from sql_queries import TICKETS_QUERY, AVAILABLE_MDS_QUERY
+from cache_utils import DEFAULT_CACHE_DIR, ResponseCache
+from client_utils import LLMClient, cached_complete
+from data_utils import DEFAULT_SNAPSHOT_DIR, MartLoader, SnowflakeSource, SqliteSource
+from feedback_utils import DEFAULT_QUEUE_PATH, QueuedFeedbackSink, SheetAppender
+from filter_utils import MDIndex
+from llm_utils import (
+    MATCH_COUNT,
+    PRIMARY_MODEL,
+    build_continuation_prompt,
+    clean_json_response,
+    count_tokens,
+)
+from lookup_utils import MDLookup
+from metrics_utils import (
+    METRICS,
+    configure_logging,
+    log_startup_profile,
+    record_startup,
+    start_metrics_file_writer,
+    start_metrics_server,
+    startup_phase,
+    startup_profile,
+)
+from parse_utils import MatchStreamParser, merge_matches, parse_matches, validate_match
+from prompt_utils import create_prompt, get_eligible_mds
+from render_utils import match_card, provider_details_html, services_value
+from retrieval_utils import BioRetriever
+from scoring_utils import MatchScorer
+from shard_utils import match_sharded
+from snapshot_utils import RosterSnapshot, TicketSnapshot
+from store_utils import DEFAULT_STORE_PATH, MatchStore, provider_version, ticket_key
+
+# Session state written by a match run, shared through the match store and logged with feedback
+MATCH_SESSION_FIELDS = [
+    "last_matches",
+    "prompt_text",
+    "model_params",
+    "raw_results",
+    "provider_data",
+    "query_start",
+    "query_duration",
+]
 
 
 ########################################################
 # Helper functions
 ########################################################
-def clean_json_response(response):
+def display_match_card(match, md_row):
     """
-    Cleans the JSON response from the OpenAI API
+    Displays a single MD match card (used while matches stream in).
     """
-    # Remove code fences if present
-    response = re.sub(r"^```(?:json)?|```$", "", response.strip(), flags=re.MULTILINE)
-    # Remove any leading/trailing whitespace again
-    return response.strip()
+    st.markdown(match_card(match, md_row), unsafe_allow_html=True)
 
-def display_provider_details(provider):
+def display_match_cards(resolved):
     """
-    Displays the provider details nicely formatted
+    Displays a whole result set as one element instead of one per card.
     """
-    subject = str(provider['SUBJECT'])
-    provider_email = str(provider['PROVIDER_EMAIL'])
-    ticket_status = str(provider['TICKET_STATUS'])
-    ticket_priority = str(provider['TICKET_PRIORITY'])
-    kick_off_date = str(provider['KICK_OFF_DATE'])
-    provider_license_type = str(provider['PROVIDER_LICENSE_TYPE']) 
-    provider_experience_level = str(provider['PROVIDER_EXPERIENCE_LEVEL'])
-    provider_state = str(provider['PROVIDER_STATE']) 
-    provider_md_location_preference = get_clean_value(provider['PROVIDER_MD_LOCATION_PREFERENCE'], "")
-    provider_services = get_clean_value(provider['PROVIDER_SERVICES'], "None Specified") 
-    provider_future_services = get_clean_value(provider['PROVIDER_FUTURE_SERVICES'], "")
-    provider_additional_services = get_clean_value(provider["PROVIDER_ADDITIONAL_SERVICES"], "") 
-    
-    # Create service tags
-    services_html = generate_service_badges(provider_services)
-    future_services_html = generate_service_badges(provider_future_services)
-    
-    # Display state info with special style for California
-    state_html = f'<span class="trait-tag state-tag">{provider_state}</span>'
-    
-    # Add California restriction warning if applicable
-    ca_restriction = ""
-    if provider_state == "California":
-        ca_restriction = """
-        <div class="state-restrictions">
-            <strong>California Restriction:</strong> This nurse can only be matched with medical directors in California due to state licensing requirements.
-        </div>
-        """
+    st.markdown("\n".join(match_card(match, md_row) for match, md_row in resolved), unsafe_allow_html=True)
 
-    st.markdown(f"""
-        <div class="nurse-info">
-            <div class="nurse-detail">
-                <h4>{subject}</h4>
-                <p><strong>Ticket Status:</strong> {ticket_status}</p>
-                <p><strong>Ticket Priority:</strong> {ticket_priority}</p>
-                <p><strong>Kick-Off Date:</strong> {kick_off_date}</p>
-                <p><strong>Email:</strong> {provider_email}</p>
-                <p><strong>License:</strong> {provider_license_type}</p>
-                <p><strong>Experience:</strong> {provider_experience_level}</p>
-                <p><strong>State:</strong> {state_html} {ca_restriction or ''}</p>
-                <p><strong>MD Location Preference:</strong> {provider_md_location_preference}</p>
-                <P><p><strong>Services:</strong> {services_html}</P>
-                <p><strong>Future Services:</strong> {future_services_html}</p>
-                <p><strong>Additional Notes:</strong> {provider_additional_services}</p>
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
-
-def generate_service_badges(service_string):
+def display_provider_details(provider):
     """
-    Converts a list-like string or delimited string of services into HTML badge spans.
-    Handles cases where services are passed in as a list string like '["Botox", "Filler"]'
-    or as a comma/semicolon-separated string.
+    Displays the provider details nicely formatted
     """
-    if not service_string or service_string == "None specified":
-        return ""
-
-    try:
-        # Try parsing as a list string (e.g., '["Botox", "Filler"]')
-        services = ast.literal_eval(service_string)
-        if isinstance(services, list):
-            return ' '.join(f'<span class="service-badge">{s.strip()}</span>' for s in services if s)
-    except (ValueError, SyntaxError):
-        pass
-
-    # Fallback: treat as delimited string
-    delimiter = ';' if ';' in service_string else ','
-    services = [s.strip() for s in service_string.split(delimiter)]
-    return ' '.join(f'<span class="service-badge">{s}</span>' for s in services if s)
+    st.markdown(provider_details_html(
+        str(provider['SUBJECT']),
+        str(provider['PROVIDER_EMAIL']),
+        str(provider['TICKET_STATUS']),
+        str(provider['TICKET_PRIORITY']),
+        str(provider['KICK_OFF_DATE']),
+        str(provider['PROVIDER_LICENSE_TYPE']),
+        str(provider['PROVIDER_EXPERIENCE_LEVEL']),
+        str(provider['PROVIDER_STATE']),
+        get_clean_value(provider['PROVIDER_MD_LOCATION_PREFERENCE'], ""),
+        services_value(provider, 'PROVIDER_SERVICES', "None Specified"),
+        services_value(provider, 'PROVIDER_FUTURE_SERVICES', ""),
+        get_clean_value(provider["PROVIDER_ADDITIONAL_SERVICES"], ""),
+    ), unsafe_allow_html=True)
 
 def get_clean_value(value, default="Unknown"):
     """
@@ -108,63 +97,37 @@ def get_clean_value(value, default="Unknown"):
     return str(value).strip()
 
 # Function to call OpenAI API with fallback to GPT-3.5
-def query_openai(prompt, api_key, max_retries=2):
+def query_openai(prompt, llm_client, cache=None, on_match=None, prompt_for=None):
     """Call the OpenAI API and return the raw response text along with
-    the model and parameters used. Falls back to GPT-3.5 if the primary
-    model fails.
+    the model and parameters used. The shared LLMClient retries with backoff,
+    hedges with GPT-3.5 if the primary model is slow or failing, and skips
+    models whose circuit is open. If a ResponseCache is given, identical
+    prompts and params are served from it instead of calling the API. If
+    on_match is given, on_match is called with each match object as soon as
+    it has been streamed. If prompt_for is given, prompt_for(model) rebuilds
+    the prompt for a model whose context window it doesn't fit.
     """
+    # Render each match as soon as its object has been streamed
+    on_delta = None
+    if on_match is not None:
+        parser = MatchStreamParser()
 
-    primary_model = "gpt-4-turbo-preview"
-    fallback_model = "gpt-3.5-turbo"
-    
-    for attempt in range(max_retries):
-        try:
-            # Choose model based on the attempt number
-            current_model = primary_model if attempt == 0 else fallback_model
-
-            params = {
-                "model": current_model,
-                "max_tokens": 4000,
-                "temperature": 0.2,
-            }
-
-            # Initialize the client
-            client = openai.OpenAI(api_key=openai_api_key)
-
-            # Make the API request
-            response = client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": """
-                        You are a medical staffing expert at Moxie. You help match nurses with medical
-                        directors based on their location, experience, services offered, personality traits,
-                        and other relevant factors. You always prioritize state licensing requirements (especially
-                        for California) and capacity limitations. You always respond in JSON format as specified
-                        in the prompts.
-                    """},
-                    {"role": "user", "content": prompt},
-                ],
-                **params,
-            )
-
-            content = response.choices[0].message.content.strip()
+        def on_delta(delta):
+            for match in parser.feed(delta):
+                on_match(match)
 
-            return content, params
-            
-        except Exception as e:
-            error_str = str(e)
-
-            if attempt == 0 and "overloaded_error" in error_str:
-                st.warning("Primary AI model is busy. Trying with a faster model...")
-                time.sleep(1)
-                continue
+    try:
+        content, params, _ = cached_complete(
+            llm_client, prompt, cache=cache, on_delta=on_delta, prompt_for=prompt_for
+        )
+    except Exception as e:
+        st.error(f"API error: {e}")
+        return orjson.dumps({"error": f"API error: {e}"}), {"model": PRIMARY_MODEL}
 
-            elif attempt == max_retries - 1:
-                st.error(f"API error: {error_str}")
-                return orjson.dumps({"error": f"API error: {error_str}"}), {"model": current_model}
+    if params["model"] != PRIMARY_MODEL:
+        st.warning("Primary AI model is busy. Results came from a faster model.")
 
-            else:
-                st.error(f"API error: {error_str}")
-                return orjson.dumps({"error": f"API error: {error_str}"}), {"model": current_model}
+    return content, params
 
 ########################################################
 # Page config
@@ -199,31 +162,94 @@ else:
     st.markdown("<h1 class='main-header'>Moxie Provider-MD Matching System</h1>", unsafe_allow_html=True)
     st.markdown("<div class='powered-by'>Powered by ChatGPT</div>", unsafe_allow_html=True)
     
+    record_startup("imports", time.perf_counter() - SCRIPT_START)
+
     # Get OpenAI API key from environment variable
     openai_api_key = os.getenv("OPENAI_API_KEY", "")
 
-    # Connect to Snowflake
-    conn = st.connection("snowflake")
-
-    # Load and cache data
-    @st.cache_data
-    def load_md_data():
-        try: 
-            doctors_df = conn.query(AVAILABLE_MDS_QUERY, ttl=0)
-            return doctors_df
-        except Exception as e:
-            return None
-
-    @st.cache_data
-    def load_provider_data():
-        try: 
-            providers_df = conn.query(TICKETS_QUERY, ttl=0)
-            return providers_df
-        except Exception as e:
-            return None
-
-    doctors_df = load_md_data()
-    providers_df = load_provider_data()
+    # Tickets and MD roster are loaded once, then refreshed in the background (delta
+    # queries merged into the cached frames) so reruns never wait on Snowflake
+    @st.cache_resource
+    def get_mart_loader():
+        if os.getenv("MARTS_SQLITE_PATH"):
+            source = SqliteSource(os.environ["MARTS_SQLITE_PATH"])
+        else:
+            # Connected on the first query, which a fresh disk snapshot pushes into the background
+            source = SnowflakeSource(lambda: st.connection("snowflake"))
+        return MartLoader(
+            source,
+            refresh_interval=float(os.getenv("MART_REFRESH_SECONDS", 300)),
+            snapshot_dir=os.getenv("MART_SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR),
+        )
+
+    # Compact snapshots are rebuilt only when a refresh changes the mart contents; every
+    # roster-derived index below is keyed on the roster snapshot's content version. Two entries
+    # each keep the current and previous versions, so refreshes don't pile up old indexes
+    @st.cache_resource(max_entries=2)
+    def load_ticket_snapshot(_providers_df, version):
+        return TicketSnapshot(_providers_df, version)
+
+    @st.cache_resource(max_entries=2)
+    def load_roster_snapshot(_doctors_df, version):
+        return RosterSnapshot(_doctors_df, version)
+
+    @st.cache_resource(max_entries=2)
+    def load_md_index(_doctors_df, version):
+        return MDIndex(_doctors_df)
+
+    @st.cache_resource(max_entries=2)
+    def load_match_scorer(_doctors_df, version):
+        return MatchScorer(_doctors_df)
+
+    @st.cache_resource(max_entries=2)
+    def load_md_lookup(_doctors_df, version):
+        return MDLookup(_doctors_df)
+
+    @st.cache_resource(max_entries=2)
+    def load_bio_retriever(_doctors_df, version):
+        return BioRetriever(_doctors_df)
+
+    @st.cache_resource
+    def start_metrics_export():
+        # Structured stage logs go to stderr; Prometheus text is served and/or written if configured
+        configure_logging()
+        if os.getenv("METRICS_PORT"):
+            start_metrics_server(int(os.environ["METRICS_PORT"]))
+        if os.getenv("METRICS_FILE"):
+            start_metrics_file_writer(os.environ["METRICS_FILE"])
+        return METRICS
+
+    @st.cache_resource
+    def get_response_cache():
+        return ResponseCache(os.getenv("LLM_CACHE_DIR", DEFAULT_CACHE_DIR))
+
+    @st.cache_resource
+    def get_match_store():
+        return MatchStore(os.getenv("MATCH_STORE_PATH", DEFAULT_STORE_PATH))
+
+    @st.cache_resource
+    def get_feedback_sink():
+        # The Sheets client (and its SDK) is only created when the first batch is flushed
+        return QueuedFeedbackSink(
+            SheetAppender(lambda: st.secrets["connections"]["gsheets"].to_dict()),
+            os.getenv("FEEDBACK_QUEUE_PATH", DEFAULT_QUEUE_PATH),
+        )
+
+    @st.cache_resource
+    def get_llm_client(api_key):
+        return LLMClient(api_key)
+
+    start_metrics_export()
+    with startup_phase("resources"):
+        response_cache = get_response_cache()
+        llm_client = get_llm_client(openai_api_key) if openai_api_key else None
+        feedback_sink = get_feedback_sink()
+        match_store = get_match_store()
+
+    with startup_phase("mart_load"):
+        mart_loader = get_mart_loader()
+        doctors_df, roster_fingerprint = mart_loader.current("mds")
+        providers_df, tickets_fingerprint = mart_loader.current("tickets")
 
     # Display error if data is not loaded
     if doctors_df is None:
@@ -231,17 +257,59 @@ else:
     if providers_df is None:
         st.error("Failed to load provider data. Contact Sinthuja to troubleshoot.")
 
+    roster = tickets = md_index = scorer = md_lookup = bio_retriever = None
+    with startup_phase("indexes"):
+        if doctors_df is not None:
+            roster = load_roster_snapshot(doctors_df, roster_fingerprint)
+            doctors_df = roster.df
+            md_index = load_md_index(doctors_df, roster.version)
+            scorer = load_match_scorer(doctors_df, roster.version)
+            md_lookup = load_md_lookup(doctors_df, roster.version)
+            bio_retriever = load_bio_retriever(doctors_df, roster.version)
+        if providers_df is not None:
+            tickets = load_ticket_snapshot(providers_df, tickets_fingerprint)
+
+    if os.getenv("STARTUP_PROFILE"):
+        log_startup_profile()
+        with st.sidebar.expander("Startup profile"):
+            st.json(startup_profile())
+
+    # Response cache counters
+    with st.sidebar.expander("LLM response cache"):
+        st.json(response_cache.stats())
+    with st.sidebar.expander("Data freshness"):
+        st.json(mart_loader.status())
+        for name, snapshot in (("tickets", tickets), ("mds", roster)):
+            if snapshot is not None:
+                st.caption(f"{name}: {len(snapshot):,} rows, {snapshot.memory_usage() / 1e6:.1f} MB in memory")
+    with st.sidebar.expander("Stage latency (p50/p95)"):
+        st.json(METRICS.summary())
+    with st.sidebar.expander("Shared match store"):
+        st.json(match_store.stats())
+    with st.sidebar.expander("Feedback queue"):
+        st.json(feedback_sink.stats())
+    if llm_client is not None:
+        with st.sidebar.expander("LLM client status"):
+            st.json(llm_client.status())
+
+    stream_matches = st.sidebar.toggle("Stream matches as they are generated", value=True)
+    shard_roster = st.sidebar.toggle(
+        "Split large rosters into parallel shards",
+        value=False,
+        help="Sends groups of MDs as parallel calls and merges their shortlists. Matches are not streamed.",
+    )
+    candidate_limit = st.sidebar.number_input(
+        "Send only the top N locally scored MDs to the LLM (0 = all eligible)",
+        min_value=0,
+        value=0,
+        step=10,
+    )
+
     # Select a provider to match
     st.markdown("<h3 class='subheader'>Provider Selection</h3><br>", unsafe_allow_html=True)
 
     # Display how many tickets for matching were found
-    st.info(f"Found {len(providers_df)} tickets in pending status.")
-
-    # Create a new column for display: "Subject - Status"
-    providers_df["DISPLAY"] = providers_df["SUBJECT"] + " - " + providers_df["TICKET_STATUS"]
-
-    # Sort by TICKET_STATUS
-    providers_sorted = providers_df.sort_values("TICKET_STATUS", ascending=False)
+    st.info(f"Found {len(tickets)} tickets in pending status.")
 
     # Initialize dict to keep matches for each provider
     if "provider_matches" not in st.session_state:
@@ -250,119 +318,236 @@ else:
     # Display a dropdown with a blank option at the beginning
     selected_provider = st.selectbox(
         "Select a provider to match:",
-        [""] + providers_sorted["DISPLAY"].tolist(),
+        ("",) + tickets.labels,
         key="selected_provider",
     )
 
     # Filter the dataframe only if a provider is selected
-    if selected_provider:
-        provider_data = providers_df[providers_df["DISPLAY"] == selected_provider]
-        provider = provider_data.iloc[0]
+    provider = tickets.provider(selected_provider) if selected_provider else None
+    if provider is not None:
         display_provider_details(provider)
 
+        # Matches already stored for this ticket and roster version (by anyone) are shown right away
+        match_key = (ticket_key(provider), provider_version(provider), roster.version)
+        stored_match = match_store.get(*match_key)
         provider_key = provider["PROVIDER_EMAIL"]
         matches_by_provider = st.session_state["provider_matches"]
-        if provider_key in matches_by_provider:
+        if stored_match is not None:
+            for field in MATCH_SESSION_FIELDS:
+                st.session_state[field] = stored_match.get(field)
+            st.caption(
+                f"Matched by {stored_match['created_by'] or 'another coordinator'} on "
+                f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(stored_match['created']))} with {stored_match['model']}. "
+                "The match is reused until the ticket or the MD roster changes."
+            )
+        elif provider_key in matches_by_provider:
             st.session_state["last_matches"] = matches_by_provider[provider_key]
         else:
             st.session_state.pop("last_matches", None)
     else:
-        provider = None
+        stored_match = None
         st.session_state.pop("last_matches", None)
 
-    service_requirements = st.text_area("Any additional requirements or preferences:", height=100, 
-                                    placeholder="E.g., Looking for a mentor in fillers, prefer someone with teaching experience, etc.")
-
-    if provider is not None and st.button("Find Matching Medical Directors"):
-        if not openai_api_key:
-            st.error("API key is not configured. Please set the OPENAI_API_KEY environment variable.")
-        else:
-            with st.spinner("Finding the best medical director matches..."):
-                prompt, error = create_prompt( 
-                    doctors_df, 
-                    provider,
-                    filters={
-                        "service_requirements": service_requirements
-                    }
-                )
-
-                if error:
-                    st.error(error)
-                else:
-                    query_start = time.time()
-                    raw_response, model_params = query_openai(prompt, openai_api_key)
-                    duration = time.time() - query_start
-
-                    matches = None
-                    cleaned_response = clean_json_response(raw_response)
-                    try:
-                        matches = json.loads(cleaned_response)
-                    except json.JSONDecodeError as e:
-                        st.error(f"Error parsing JSON response here: {str(e)}")
-                        st.text(f"Raw response: {raw_response}")
-                        matches = None
-
-                    # Cache relevant information in session state for logging
-                    st.session_state["last_matches"] = matches
-                    st.session_state["prompt_text"] = prompt
-                    st.session_state["model_params"] = model_params
-                    st.session_state["raw_results"] = cleaned_response
-                    st.session_state["provider_data"] = provider.to_dict()
-                    st.session_state["query_start"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(query_start))
-                    st.session_state["query_duration"] = round(duration, 2)
-
-                    provider_key = provider["PROVIDER_EMAIL"]
-                    st.session_state["provider_matches"][provider_key] = matches
-
-                    provider_key = provider["PROVIDER_EMAIL"]
-                    st.session_state["provider_matches"][provider_key] = matches
-
-                    provider_key = provider["PROVIDER_EMAIL"]
-                    st.session_state["provider_matches"][provider_key] = matches
-
-    if "last_matches" in st.session_state:    
+    def notice(kind, message):
+        """
+        Shows a match run message and keeps it with the result set, since the full rerun
+        that renders the new matches would otherwise clear it.
+        """
+        st.session_state["match_notices"][1].append((kind, message))
+        getattr(st, kind)(message)
+
+    # Typing requirements or toggling the re-run checkbox only reruns this fragment
+    @st.fragment
+    def matching_controls(provider, stored_match, match_key):
+        provider_key = provider["PROVIDER_EMAIL"] if provider is not None else None
+        service_requirements = st.text_area("Any additional requirements or preferences:", height=100, 
+                                        placeholder="E.g., Looking for a mentor in fillers, prefer someone with teaching experience, etc.")
+
+        rerun_stored = stored_match is not None and st.checkbox("Re-run matching for this ticket anyway")
+        if provider is not None and st.button("Find Matching Medical Directors"):
+            if stored_match is not None and not rerun_stored:
+                st.info("This ticket was already matched against the current MD roster; showing the stored matches.")
+            elif not openai_api_key:
+                st.error("API key is not configured. Please set the OPENAI_API_KEY environment variable.")
+            else:
+                st.session_state["match_notices"] = (provider_key, [])
+                with st.spinner("Finding the best medical director matches..."):
+                    prompt_report = {}
+                    if shard_roster:
+                        # Shard prompts are built by match_sharded; only the hard constraints are checked here
+                        prompt = None
+                        _, error = get_eligible_mds(doctors_df, provider, md_index)
+                    else:
+                        prompt, error = create_prompt(
+                            doctors_df,
+                            provider,
+                            filters={
+                                "service_requirements": service_requirements
+                            },
+                            md_index=md_index,
+                            scorer=scorer,
+                            candidate_limit=candidate_limit,
+                            retriever=bio_retriever,
+                            report=prompt_report,
+                        )
+
+                    if error:
+                        st.error(error)
+                    else:
+                        if not shard_roster:
+                            notice("caption",
+                                f"Prompt: {prompt_report['total']:,} tokens ({prompt_report['roster']:,} for "
+                                f"{prompt_report['mds_included']} MDs, {prompt_report['bios_included']} with bios) of {prompt_report['budget']:,} available for "
+                                f"{prompt_report['model']}, with {prompt_report['max_output_tokens']:,} reserved for the response."
+                            )
+                            if prompt_report["mds_dropped"]:
+                                notice(
+                                    "warning",
+                                    f"{prompt_report['mds_dropped']} lower-ranked MD(s) were left out to fit the model's context window."
+                                )
+                        # Show match cards as they stream in, then clear them once the full result is stored
+                        stream_slot = st.empty()
+                        on_match = None
+                        if stream_matches:
+                            stream_box = stream_slot.container()
+
+                            def on_match(match):
+                                match, _ = validate_match(match)
+                                if match is not None:
+                                    with stream_box:
+                                        display_match_card(match, md_lookup.resolve(match))
+
+                        query_start = time.time()
+                        if shard_roster:
+                            shard_prompts = []
+                            raw_response, model_params, shard_error = match_sharded(
+                                llm_client,
+                                doctors_df,
+                                provider,
+                                filters={"service_requirements": service_requirements},
+                                md_index=md_index,
+                                cache=response_cache,
+                                prompts_sent=shard_prompts,
+                            )
+                            # Log exactly what was sent: the single prompt, or every shard prompt in order
+                            prompt = shard_prompts[0] if len(shard_prompts) == 1 else "\n\n".join(
+                                f"----- Prompt {i} of {len(shard_prompts)} -----\n{text}"
+                                for i, text in enumerate(shard_prompts, start=1)
+                            )
+                            if len(shard_prompts) > 1:
+                                notice("caption",
+                                    f"Sent {len(shard_prompts)} sharded prompts, "
+                                    f"{sum(count_tokens(text) for text in shard_prompts):,} tokens in total."
+                                )
+                            if shard_error:
+                                notice("error", f"API error: {shard_error}")
+                                raw_response = orjson.dumps({"error": f"API error: {shard_error}"})
+                                model_params = {"model": PRIMARY_MODEL}
+                        else:
+                            # The prompt is budgeted for the primary model; the fallback gets one rebuilt for its smaller window
+                            def prompt_for(model):
+                                return create_prompt(
+                                    doctors_df,
+                                    provider,
+                                    filters={
+                                        "service_requirements": service_requirements
+                                    },
+                                    md_index=md_index,
+                                    scorer=scorer,
+                                    candidate_limit=candidate_limit,
+                                    retriever=bio_retriever,
+                                    model=model,
+                                )[0]
+
+                            raw_response, model_params = query_openai(
+                                prompt, llm_client, cache=response_cache, on_match=on_match, prompt_for=prompt_for
+                            )
+                        cleaned_response = clean_json_response(raw_response)
+                        parsed = parse_matches(cleaned_response)
+
+                        # If the response was cut off, ask only for the missing matches instead of starting over
+                        # (a merged sharded result has no single prompt to continue)
+                        if (not parsed["complete"] and not parsed["error"] and len(parsed["matches"]) < MATCH_COUNT
+                                and not (shard_roster and len(shard_prompts) > 1)):
+                            st.warning(f"The response was cut off after {len(parsed['matches'])} matches. Requesting the remaining matches...")
+                            more_response, _ = query_openai(
+                                build_continuation_prompt(prompt, parsed["matches"]),
+                                llm_client,
+                                cache=response_cache,
+                                on_match=on_match,
+                            )
+                            more = parse_matches(clean_json_response(more_response))
+                            parsed["matches"] = merge_matches(parsed["matches"], more["matches"])
+                            parsed["dropped"] += more["dropped"]
+                            cleaned_response = json.dumps({"matches": parsed["matches"]})
+
+                        duration = time.time() - query_start
+                        METRICS.observe("match_request", duration, model=model_params.get("model"), sharded=shard_roster)
+                        stream_slot.empty()
+
+                        if parsed["error"] and not parsed["matches"]:
+                            notice("error", f"Error parsing JSON response: {parsed['error']}")
+                            notice("text", f"Raw response: {raw_response}")
+
+                            # Fall back to the local scorer so the coordinator still gets a shortlist
+                            parsed["matches"] = scorer.top_matches(provider)
+                            if parsed["matches"]:
+                                notice("warning", "Showing locally scored matches instead of AI matches.")
+                                model_params = {"model": "local-scorer"}
+                                cleaned_response = json.dumps({"matches": parsed["matches"]})
+                        if parsed["dropped"]:
+                            reasons = "; ".join(d["reason"] for d in parsed["dropped"])
+                            notice("warning", f"Dropped {len(parsed['dropped'])} incomplete or invalid match(es): {reasons}")
+
+                        matches = {"matches": parsed["matches"]} if parsed["matches"] else None
+
+                        # Cache relevant information in session state for logging
+                        st.session_state["last_matches"] = matches
+                        st.session_state["prompt_text"] = prompt
+                        st.session_state["model_params"] = model_params
+                        st.session_state["raw_results"] = cleaned_response
+                        st.session_state["provider_data"] = {
+                            column: value for column, value in provider.to_dict().items()
+                            if not column.endswith(("_LIST", "_MASK"))
+                        }
+                        st.session_state["query_start"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(query_start))
+                        st.session_state["query_duration"] = round(duration, 2)
+
+                        st.session_state["provider_matches"][provider_key] = matches
+
+                        # Share AI matches with every session; local scorer fallbacks are not stored
+                        if matches and model_params.get("model") != "local-scorer":
+                            match_store.put(
+                                *match_key,
+                                {field: st.session_state[field] for field in MATCH_SESSION_FIELDS},
+                                created_by=st.user.email,
+                                model=model_params.get("model"),
+                            )
+
+                        # Render the new result set (cards and feedback form) outside this fragment
+                        if matches:
+                            st.rerun()
+
+    matching_controls(provider, stored_match, match_key if provider is not None else None)
+
+    if st.session_state.get("last_matches") and md_lookup is not None:
         # Display matches
         st.markdown(f"<h3 class='subheader'>Top MD Matches for {provider['SUBJECT']}</h3><br>", unsafe_allow_html=True)
         
+        notices_provider, notices = st.session_state.get("match_notices", (None, []))
+        if notices_provider == provider["PROVIDER_EMAIL"]:
+            for kind, message in notices:
+                getattr(st, kind)(message)
+
         matches = st.session_state["last_matches"]
-        for match in matches.get("matches", []):
-            # Determine score color class
-            score = float(match['match_score'])
-            score_class = "high-score" if score >= 8.0 else "medium-score" if score >= 6.0 else "low-score"
-            
-            # Find the MD in the dataframe to get their traits and state
-            md_email = match['email']
-            md_row = doctors_df[
-                doctors_df.apply(
-                    lambda row: md_email.lower() in row['EMAIL'].lower(), 
-                    axis=1
-                )
-            ].iloc[0] 
-
-            md_traits = get_clean_value(md_row.get('MD_TRAITS', ''), '')
-            md_bio = get_clean_value(md_row.get('MD_BIO', ''), 'No bio provided')
-
-            # Build the match card with traits, bio, and fixed location included
-            st.markdown(
-                f"""<div class="match-card">
-                <div style="display: flex; justify-content: space-between; align-items: center;">
-                    <h4>{match['name']}</h4>
-                    <div class="compatibility-score {score_class}">{match['match_score']}</div>
-                </div>
-                <p><strong>Email:</strong> {md_row['EMAIL']}</p>
-                <p><strong>Capacity:</strong> {match.get('capacity_status', 'Available')}</p>
-                <p><strong>Residing State:</strong> <span class="trait-tag state-tag">{md_row['RESIDING_STATE']}</span></p>
-                <p><strong>Personality Traits:</strong> {md_row['MD_TRAITS']}</p>
-                <div class="match-details">
-                    <p><strong>Personal Bio:</strong> {md_bio}</p>
-                </div>
-                <div class="match-reason">
-                    <p><strong>Why this match works:</strong> {match['reasoning']}</p>
-                </div>
-                </div>""",
-                unsafe_allow_html=True
-            )
-            
+        resolved, unresolved = md_lookup.resolve_all(matches.get("matches", []))
+        if unresolved:
+            names = ", ".join(f"{match['name']} ({match.get('email', '')})" for match in unresolved)
+            st.warning(f"{len(unresolved)} match(es) could not be found in the current MD roster: {names}")
+        with METRICS.timer("render_cards"):
+            display_match_cards(resolved)
+        METRICS.increment("cards_rendered", len(resolved))
+
         # Collect final decision and feedback
         st.markdown(f"<h3 class='subheader'>Matching Feedback</h3><br>", unsafe_allow_html=True)
         st.markdown("""
@@ -370,69 +555,60 @@ else:
             This helps us improve future matches and track performance over time.
         """)
         
-        # Clear form state BEFORE rendering
-        if st.session_state.get("clear_form"):
-            st.session_state["selected_match_names"] = []
-            st.session_state["feedback_text"] = ""
-            st.session_state["clear_form"] = False
-
-        with st.form("final_match_form"):
-            selected_match_names = st.multiselect(
-                "Which MDs will you be reaching out to match with this provider? (leave blank if none)",
-                [match["name"] for match in matches["matches"]],
-                key="selected_match_names"
-            )
+        # Picking MDs and submitting feedback only reruns the form, not the cards above
+        @st.fragment
+        def feedback_form(provider, matches):
+            # Clear form state BEFORE rendering
+            if st.session_state.get("clear_form"):
+                st.session_state["selected_match_names"] = []
+                st.session_state["feedback_text"] = ""
+                st.session_state["clear_form"] = False
+
+            with st.form("final_match_form"):
+                selected_match_names = st.multiselect(
+                    "Which MDs will you be reaching out to match with this provider? (leave blank if none)",
+                    [match["name"] for match in matches["matches"]],
+                    key="selected_match_names"
+                )
 
-            feedback = st.text_area(
-                "Provide any feedback or rationale on how well the matching process went.",
-                placeholder="E.g., Excellent personality alignment. Preferred teaching experience was met.",
-                key="feedback_text"
-            )
+                feedback = st.text_area(
+                    "Provide any feedback or rationale on how well the matching process went.",
+                    placeholder="E.g., Excellent personality alignment. Preferred teaching experience was met.",
+                    key="feedback_text"
+                )
 
-            submit = st.form_submit_button("Submit to Google Sheets")
-
-            if submit:
-                conn_gsheet = st.connection("gsheets", type=GSheetsConnection)
-
-                row = {
-                    "Timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "User": st.user.name,
-                    "Provider": provider["SUBJECT"],
-                    "Provider Email": provider["PROVIDER_EMAIL"],
-                    "Provider Data": orjson.dumps(st.session_state.get("provider_data", {})),
-                    "AI Model": st.session_state.get("model_params", {}).get("model", ""),
-                    "Model Params": orjson.dumps(st.session_state.get("model_params", {})),
-                    "Raw Results": st.session_state.get("raw_results", ""),
-                    "Query Sent At": st.session_state.get("query_start", ""),
-                    "Request Duration (s)": st.session_state.get("query_duration", ""),
-                    "Selected MD(s)": (
-                        orjson.dumps(selected_match_names)
-                        if selected_match_names
-                        else "None"
-                    ),
-                    "Feedback": feedback,
-                }
-
-                try:
-                    # Fetch the latest data each time to avoid overwriting
-                    existing_data = conn_gsheet.read(ttl=0)
-
-                    # Add new row
-                    new_row_df = pd.DataFrame([row])
-                    updated_data = pd.concat([existing_data, new_row_df], ignore_index=True)
-
-                    # Push update
-                    conn_gsheet.update(data=updated_data)
-                    
-                    # Clear any cached data so the next read fetches fresh rows
-                    st.toast("✅ Your decision and feedback have been submitted successfully!")
+                submit = st.form_submit_button("Submit to Google Sheets")
+
+                if submit:
+                    row = {
+                        "Timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                        "User": st.user.name,
+                        "Provider": provider["SUBJECT"],
+                        "Provider Email": provider["PROVIDER_EMAIL"],
+                        "Provider Data": orjson.dumps(st.session_state.get("provider_data", {}), default=str),
+                        "AI Model": st.session_state.get("model_params", {}).get("model", ""),
+                        "Model Params": orjson.dumps(st.session_state.get("model_params", {})),
+                        "Raw Results": st.session_state.get("raw_results", ""),
+                        "Query Sent At": st.session_state.get("query_start", ""),
+                        "Request Duration (s)": st.session_state.get("query_duration", ""),
+                        "Selected MD(s)": (
+                            orjson.dumps(selected_match_names)
+                            if selected_match_names
+                            else "None"
+                        ),
+                        "Feedback": feedback,
+                    }
 
-                    time.sleep(2)
-                    
-                    # Set flag and rerun to clear form on next cycle
-                    st.session_state["clear_form"] = True
-                    st.rerun()
+                    try:
+                        # Queue the row locally; it is appended to the sheet in the background
+                        feedback_sink.submit(row)
+                        st.toast("✅ Your decision and feedback have been submitted successfully!")
+
+                        # Set flag and rerun the form to clear it on the next cycle
+                        st.session_state["clear_form"] = True
+                        st.rerun(scope="fragment")
                     
-                except Exception as e:
-                    st.error(f"❌ Failed to write to Google Sheet: {e}")    # Clear session state
-                    
\ No newline at end of file
+                    except sqlite3.Error as e:
+                        st.error(f"❌ Failed to save feedback: {e}")
+
+        feedback_form(provider, matches)
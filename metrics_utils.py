@@ -0,0 +1,280 @@
+import contextlib
+import functools
+import logging
+import orjson
+import os
+import sys
+import threading
+import time
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("md_matching.metrics")
+
+# Durations (seconds) kept per stage and label set for the p50/p95 estimates
+DEFAULT_WINDOW = 1000
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _label_value(value):
+    return str(value).lower() if isinstance(value, bool) else str(value)
+
+def _label_key(labels):
+    return tuple(sorted((key, _label_value(value)) for key, value in labels.items() if value is not None))
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key, **extra):
+    pairs = [*key, *((k, str(v)) for k, v in extra.items())]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def quantile(sorted_values, q):
+    """
+    Nearest-rank quantile of an already sorted list.
+    """
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))]
+
+
+class MetricsRegistry:
+    """
+    In-process latency and token metrics for the matching hot path.
+
+    Stage durations are kept in a sliding window per (stage, labels) for p50/p95/p99,
+    alongside all-time sums and counts; counters accumulate totals such as prompt and
+    completion tokens. Every observation is also logged as one JSON line on the
+    "md_matching.metrics" logger. to_prometheus() renders everything in the Prometheus
+    text exposition format.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, prefix="md_matching"):
+        self.window = window
+        self.prefix = prefix
+        self.durations = {}
+        self.sums = {}
+        self.counts = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, **labels):
+        """
+        Records one duration for a stage.
+        """
+        key = (stage, _label_key(labels))
+        with self._lock:
+            self.durations.setdefault(key, deque(maxlen=self.window)).append(seconds)
+            self.sums[key] = self.sums.get(key, 0.0) + seconds
+            self.counts[key] = self.counts.get(key, 0) + 1
+        logger.info(orjson.dumps({"event": "stage", "stage": stage, "seconds": round(seconds, 4), **labels},
+                                 default=str).decode())
+
+    def increment(self, name, value=1, **labels):
+        """
+        Adds value to a counter.
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        logger.info(orjson.dumps({"event": "counter", "name": name, "value": value, **labels}, default=str).decode())
+
+    @contextlib.contextmanager
+    def timer(self, stage, **labels):
+        """
+        Times the enclosed block as stage. The yielded dict can be used to add labels
+        known only at the end (e.g. the model that answered); an exception adds error=<type>.
+        """
+        extra = {}
+        start = time.perf_counter()
+        try:
+            yield extra
+        except BaseException as e:
+            extra.setdefault("error", type(e).__name__)
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, **{**labels, **extra})
+
+    def timed(self, stage, **labels):
+        """
+        Decorator that times every call of a function as stage.
+        """
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """
+        Returns {stage: {labels: {"count", "p50", "p95", "p99", "mean"}}} over the current window.
+        """
+        with self._lock:
+            snapshot = {key: sorted(values) for key, values in self.durations.items()}
+            sums, counts = dict(self.sums), dict(self.counts)
+        result = {}
+        for (stage, labels), values in sorted(snapshot.items()):
+            result.setdefault(stage, {})[_format_labels(labels) or "{}"] = {
+                "count": counts[(stage, labels)],
+                **{f"p{int(q * 100)}": round(quantile(values, q), 4) for q in QUANTILES},
+                "mean": round(sums[(stage, labels)] / counts[(stage, labels)], 4),
+            }
+        return result
+
+    def to_prometheus(self):
+        """
+        Renders stage durations as summaries and counters in the Prometheus text format.
+        """
+        with self._lock:
+            snapshot = {key: sorted(values) for key, values in self.durations.items()}
+            sums, counts, counters = dict(self.sums), dict(self.counts), dict(self.counters)
+
+        name = f"{self.prefix}_stage_duration_seconds"
+        lines = [f"# HELP {name} Duration of each matching stage.", f"# TYPE {name} summary"]
+        for (stage, labels), values in sorted(snapshot.items()):
+            key = (("stage", stage), *labels)
+            for q in QUANTILES:
+                lines.append(f"{name}{_format_labels(key, quantile=q)} {quantile(values, q):.6f}")
+            lines.append(f"{name}_sum{_format_labels(key)} {sums[(stage, labels)]:.6f}")
+            lines.append(f"{name}_count{_format_labels(key)} {counts[(stage, labels)]}")
+
+        for counter in sorted({counter for counter, _ in counters}):
+            metric = f"{self.prefix}_{counter}_total"
+            lines += [f"# HELP {metric} Total {counter.replace('_', ' ')}.", f"# TYPE {metric} counter"]
+            for (other, labels), value in sorted(counters.items()):
+                if other == counter:
+                    lines.append(f"{metric}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Atomically writes the Prometheus text to path (e.g. for the node_exporter textfile collector).
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def reset(self):
+        with self._lock:
+            self.durations.clear()
+            self.sums.clear()
+            self.counts.clear()
+            self.counters.clear()
+
+
+METRICS = MetricsRegistry()
+
+# Optional SDKs the app should only import once a feature needs them
+HEAVY_MODULES = ("openai", "gspread", "snowflake.connector")
+
+# Cold start phase durations for this process: the first recording of each phase wins,
+# so later reruns hitting warm caches don't overwrite them
+_startup = {}
+_startup_lock = threading.Lock()
+_startup_logged = False
+
+
+def record_startup(phase, seconds, registry=METRICS):
+    with _startup_lock:
+        if phase in _startup:
+            return
+        _startup[phase] = round(seconds, 4)
+    registry.observe("startup", seconds, phase=phase)
+
+@contextlib.contextmanager
+def startup_phase(phase, registry=METRICS):
+    """
+    Times a block as one cold start phase.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup(phase, time.perf_counter() - start, registry)
+
+def startup_profile():
+    """
+    Returns the recorded startup phases and which heavy SDK modules are imported so far.
+    """
+    with _startup_lock:
+        phases = dict(_startup)
+    return {
+        "phases": phases,
+        "total_seconds": round(sum(phases.values()), 4),
+        "heavy_modules_loaded": [name for name in HEAVY_MODULES if name in sys.modules],
+    }
+
+def log_startup_profile():
+    """
+    Logs the startup profile as one JSON line, once per process.
+    """
+    global _startup_logged
+    with _startup_lock:
+        if _startup_logged:
+            return
+        _startup_logged = True
+    logger.info(orjson.dumps({"event": "startup", **startup_profile()}).decode())
+
+
+def configure_logging(level=logging.INFO, path=None):
+    """
+    Sends the JSON metric lines to stderr (or to path) without touching other loggers.
+    """
+    handler = logging.FileHandler(path) if path else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    return handler
+
+def start_metrics_server(port, host="0.0.0.0", registry=METRICS):
+    """
+    Serves the registry at http://host:port/metrics from a daemon thread. Returns the server.
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def start_metrics_file_writer(path, interval=15.0, registry=METRICS):
+    """
+    Rewrites the Prometheus text file every interval seconds from a daemon thread.
+    """
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                registry.write_prometheus(path)
+            except OSError as e:
+                logger.warning("Failed to write metrics file %s: %s", path, e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,189 @@
+import json
+import re
+
+from metrics_utils import METRICS
+
+REQUIRED_MATCH_FIELDS = ("name", "email", "match_score", "reasoning")
+
+
+class MatchStreamParser:
+    """
+    Incrementally parses the "matches" array out of a streamed JSON response.
+
+    Feed it text chunks as they arrive; every match object that has been fully
+    received is returned by feed() exactly once, so cards can be rendered before
+    the rest of the completion is generated. Objects that fail to parse are
+    recorded in self.dropped instead of raising.
+    """
+
+    def __init__(self, key="matches"):
+        self.key = key
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_string = None
+        self.last_string_end = None
+        self.array_depth = None
+        self.array_closed = False
+        self.object_start = None
+        self.matches = []
+        self.dropped = []
+
+    def feed(self, chunk):
+        """
+        Adds a chunk of text and returns the list of match objects completed by it.
+        """
+        self.buffer += chunk
+        completed = []
+        buffer = self.buffer
+
+        for i in range(self.pos, len(buffer)):
+            char = buffer[i]
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    self.last_string = buffer[self.string_start + 1:i]
+                    self.last_string_end = i
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self.string_start = i
+            elif char in "{[":
+                self.depth += 1
+                if (
+                    char == "["
+                    and self.array_depth is None
+                    and self.last_string == self.key
+                    and buffer[self.last_string_end + 1:i].strip() == ":"
+                ):
+                    self.array_depth = self.depth
+                elif char == "{" and self.array_depth is not None and self.depth == self.array_depth + 1 \
+                        and not self.array_closed:
+                    self.object_start = i
+            elif char in "}]":
+                if char == "}" and self.object_start is not None and self.depth == self.array_depth + 1:
+                    text = buffer[self.object_start:i + 1]
+                    match = self._load(text)
+                    if match is not None:
+                        completed.append(match)
+                    else:
+                        self.dropped.append({"reason": "invalid JSON object", "text": text})
+                    self.object_start = None
+                elif char == "]" and self.array_depth is not None and self.depth == self.array_depth:
+                    self.array_closed = True
+                self.depth -= 1
+
+        self.pos = len(buffer)
+        self.matches.extend(completed)
+        return completed
+
+    def _load(self, text):
+        try:
+            match = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+        return match if isinstance(match, dict) else None
+
+    @property
+    def found_array(self):
+        return self.array_depth is not None
+
+    @property
+    def pending_text(self):
+        """
+        The start of a match object that has not been closed yet (e.g. cut off at max_tokens).
+        """
+        if self.object_start is None:
+            return ""
+        return self.buffer[self.object_start:]
+
+
+def validate_match(match):
+    """
+    Checks a match object has a name, email, numeric match_score and reasoning.
+    Returns (match, None) with match_score converted to a float, or (None, reason).
+    """
+    missing = [field for field in REQUIRED_MATCH_FIELDS if match.get(field) in (None, "")]
+    if missing:
+        return None, f"missing {', '.join(missing)}"
+
+    score = match["match_score"]
+    if isinstance(score, str):
+        # Accept scores like "8.5" or "8.5/10"
+        found = re.match(r"\s*(\d+(?:\.\d+)?)", score)
+        score = found.group(1) if found else score
+    try:
+        score = float(score)
+    except (TypeError, ValueError):
+        return None, f"non-numeric match_score {match['match_score']!r}"
+
+    return {**match, "name": str(match["name"]).strip(), "email": str(match["email"]).strip(),
+            "match_score": score, "reasoning": str(match["reasoning"]).strip()}, None
+
+@METRICS.timed("parse")
+def parse_matches(response):
+    """
+    Extracts every complete, valid match object from a possibly truncated or noisy
+    response (code fences, trailing prose, cut off at max_tokens).
+
+    Returns a dict with:
+    - matches: the valid match objects, in response order
+    - dropped: [{"reason", "text"}] for objects that were invalid or cut off
+    - complete: True if the "matches" array was closed
+    - error: an error message if no matches array was found
+    """
+    if isinstance(response, bytes):
+        response = response.decode()
+
+    parser = MatchStreamParser()
+    parser.feed(response or "")
+
+    matches = []
+    dropped = list(parser.dropped)
+    for match in parser.matches:
+        valid, reason = validate_match(match)
+        if valid is None:
+            dropped.append({"reason": reason, "text": json.dumps(match)})
+        else:
+            matches.append(valid)
+    if parser.pending_text:
+        dropped.append({"reason": "truncated", "text": parser.pending_text})
+
+    error = None
+    if not parser.found_array:
+        error = "No matches found in the response"
+        start = (response or "").find("{")
+        try:
+            payload = json.loads(response[start:]) if start >= 0 else None
+            if isinstance(payload, dict) and payload.get("error"):
+                error = str(payload["error"])
+        except json.JSONDecodeError:
+            pass
+
+    return {
+        "matches": matches,
+        "dropped": dropped,
+        "complete": parser.array_closed,
+        "error": error,
+    }
+
+def merge_matches(matches, more_matches):
+    """
+    Appends matches that aren't already present (by email) and keeps them in response order.
+    """
+    seen = {m["email"].lower() for m in matches}
+    merged = list(matches)
+    for match in more_matches:
+        if match["email"].lower() not in seen:
+            seen.add(match["email"].lower())
+            merged.append(match)
+    return merged
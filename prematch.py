@@ -0,0 +1,319 @@
+"""
+Background pre-matching worker.
+
+Watches TICKETS_QUERY for pending "MD Matching" tickets that don't have a stored match
+for the current ticket fields and MD roster, and matches them ahead of time, most
+urgent first (TICKET_PRIORITY, then KICK_OFF_DATE). Results go into the shared match
+store, so opening the ticket in the app shows the matches immediately.
+
+Work is tracked in a SQLite job table next to the match store: a ticket version is
+queued once, jobs interrupted by a restart are picked up again, failed jobs are
+retried with backoff, and a daily token budget caps what the worker spends.
+
+Usage:
+    python prematch.py --once
+    python prematch.py --loop --interval 120 --daily-token-budget 2000000
+    MARTS_SQLITE_PATH=marts.sqlite3 python prematch.py --loop --interval 5 --base-url http://localhost:8765/v1
+"""
+import argparse
+import asyncio
+import openai
+import os
+import sqlite3
+import threading
+import time
+
+from batch_match import match_ticket
+from cache_utils import DEFAULT_CACHE_DIR, ResponseCache
+from data_utils import MartLoader, SnowflakeSource, SqliteSource, priority_rank
+from filter_utils import MDIndex
+from llm_utils import DEFAULT_PARAMS, PRIMARY_MODEL, TokenRateLimiter
+from metrics_utils import METRICS
+from retrieval_utils import BioRetriever
+from scoring_utils import MatchScorer
+from store_utils import DEFAULT_STORE_PATH, MatchStore, provider_version, ticket_key
+
+# Lower rank is matched first; unknown priorities go last
+PREMATCH_USER = "pre-matcher"
+
+
+class PrematchQueue:
+    """
+    Durable job table for pre-matching, keyed like the match store entries it fills.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH, max_attempts=3, retry_after=300.0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_attempts = max_attempts
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS prematch_jobs (
+                ticket_key TEXT NOT NULL,
+                provider_version TEXT NOT NULL,
+                roster_version TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                kick_off TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                error TEXT,
+                updated REAL NOT NULL,
+                PRIMARY KEY (ticket_key, provider_version, roster_version)
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS prematch_spend (
+                day TEXT PRIMARY KEY,
+                tokens INTEGER NOT NULL
+            )
+        """)
+        # Jobs that were running when the worker stopped are picked up again
+        self._db.execute("UPDATE prematch_jobs SET status = 'pending' WHERE status = 'running'")
+
+    def enqueue(self, key, priority, kick_off):
+        """
+        Queues a ticket version unless it is already queued, running or done.
+        Returns True if a new job was added.
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO prematch_jobs (ticket_key, provider_version, roster_version, priority, kick_off, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, priority, kick_off, time.time()),
+            )
+        return cursor.rowcount == 1
+
+    def claim(self, limit, keys):
+        """
+        Marks up to limit due pending jobs among keys (the tickets still pending) as running
+        and returns their keys, most urgent first.
+        """
+        keys = set(keys)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT ticket_key, provider_version, roster_version FROM prematch_jobs "
+                "WHERE status = 'pending' AND next_attempt <= ? ORDER BY priority, kick_off, updated",
+                (time.time(),),
+            ).fetchall()
+            claimed = [tuple(row) for row in rows if tuple(row) in keys][:limit]
+            self._db.executemany(
+                "UPDATE prematch_jobs SET status = 'running', updated = ? "
+                "WHERE ticket_key = ? AND provider_version = ? AND roster_version = ?",
+                [(time.time(), *key) for key in claimed],
+            )
+        return claimed
+
+    def finish(self, key, error=None):
+        """
+        Marks a job done, or schedules a retry (failed after max_attempts) if error is set.
+        """
+        with self._lock:
+            if error is None:
+                self._db.execute(
+                    "UPDATE prematch_jobs SET status = 'done', error = NULL, updated = ? "
+                    "WHERE ticket_key = ? AND provider_version = ? AND roster_version = ?",
+                    (time.time(), *key),
+                )
+                return
+            attempts = self._db.execute(
+                "SELECT attempts FROM prematch_jobs WHERE ticket_key = ? AND provider_version = ? AND roster_version = ?",
+                key,
+            ).fetchone()[0] + 1
+            status = "failed" if attempts >= self.max_attempts else "pending"
+            self._db.execute(
+                "UPDATE prematch_jobs SET status = ?, attempts = ?, next_attempt = ?, error = ?, updated = ? "
+                "WHERE ticket_key = ? AND provider_version = ? AND roster_version = ?",
+                (status, attempts, time.time() + self.retry_after * 2 ** (attempts - 1), str(error), time.time(), *key),
+            )
+
+    def spent_today(self):
+        with self._lock:
+            row = self._db.execute("SELECT tokens FROM prematch_spend WHERE day = ?", (time.strftime("%Y-%m-%d"),)).fetchone()
+        return row[0] if row else 0
+
+    def add_spend(self, tokens):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO prematch_spend VALUES (?, ?) ON CONFLICT(day) DO UPDATE SET tokens = tokens + excluded.tokens",
+                (time.strftime("%Y-%m-%d"), tokens),
+            )
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM prematch_jobs GROUP BY status").fetchall())
+        return {**counts, "tokens_today": self.spent_today()}
+
+
+def match_payload(provider, record):
+    """
+    Builds the match store payload the app restores into session state (see MATCH_SESSION_FIELDS).
+    """
+    return {
+        "last_matches": {"matches": record["matches"]},
+        "prompt_text": None,
+        "model_params": record["params"],
+        "raw_results": record["raw_results"],
+        "provider_data": {
+            column: value for column, value in provider.to_dict().items()
+            if not column.endswith(("_LIST", "_MASK"))
+        },
+        "query_start": record["matched_at"],
+        "query_duration": record["duration"],
+    }
+
+class PreMatcher:
+    """
+    One pre-matching pass per run_once() call: refresh the marts, queue ticket versions
+    without a stored match, then match the most urgent ones within the per-pass and
+    daily token budgets.
+    """
+
+    def __init__(self, loader, store, queue, api_key, base_url=None, model=PRIMARY_MODEL, cache=None,
+                 concurrency=4, tokens_per_minute=150_000, daily_token_budget=None, max_per_pass=50):
+        self.loader = loader
+        self.store = store
+        self.queue = queue
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.cache = cache
+        self.concurrency = concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.daily_token_budget = daily_token_budget
+        self.max_per_pass = max_per_pass
+        self._roster = (None, None, None, None)
+
+    def _roster_indexes(self, doctors_df, roster_version):
+        if self._roster[0] != roster_version:
+            self._roster = (roster_version, MDIndex(doctors_df), MatchScorer(doctors_df), BioRetriever(doctors_df))
+        return self._roster
+
+    def pending_tickets(self, providers_df, roster_version):
+        """
+        Returns {key: provider} for every pending ticket without a stored match against the
+        given roster version, queuing new ones.
+        """
+        pending = {}
+        for _, provider in providers_df.iterrows():
+            key = (ticket_key(provider), provider_version(provider), roster_version)
+            if self.store.has(*key):
+                continue
+            self.queue.enqueue(key, priority_rank(provider.get("TICKET_PRIORITY")), str(provider.get("KICK_OFF_DATE")))
+            pending[key] = provider
+        return pending
+
+    async def _match(self, jobs, doctors_df, roster_version):
+        _, md_index, scorer, retriever = self._roster_indexes(doctors_df, roster_version)
+        client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = TokenRateLimiter(self.tokens_per_minute)
+
+        async def run(key, provider):
+            record = await match_ticket(
+                client, provider, doctors_df, md_index, semaphore, limiter, cache=self.cache, model=self.model,
+                scorer=scorer, retriever=retriever,
+            )
+            return key, provider, record
+
+        results = []
+        for task in asyncio.as_completed([run(key, provider) for key, provider in jobs]):
+            results.append(await task)
+        await client.close()
+        return results
+
+    def run_once(self):
+        """
+        Runs one pass. Returns {"pending", "matched", "failed", "skipped_budget"}.
+        """
+        self.loader.refresh()
+        # One roster snapshot for the whole pass: store keys, prompts and indexes all match it
+        providers_df, _ = self.loader.current("tickets")
+        doctors_df, roster_version = self.loader.current("mds")
+        if providers_df is None or doctors_df is None:
+            return {"pending": 0, "matched": 0, "failed": 0, "skipped_budget": 0}
+        pending = self.pending_tickets(providers_df, roster_version)
+        summary = {"pending": len(pending), "matched": 0, "failed": 0, "skipped_budget": 0}
+        if not pending:
+            return summary
+
+        limit = self.max_per_pass
+        if self.daily_token_budget is not None:
+            # Leave room for a full response per ticket so the budget isn't overshot
+            per_ticket = DEFAULT_PARAMS["max_tokens"] * 2
+            remaining = self.daily_token_budget - self.queue.spent_today()
+            limit = min(limit, max(0, remaining // per_ticket))
+        jobs = [(key, pending[key]) for key in self.queue.claim(limit, pending)]
+        summary["skipped_budget"] = len(pending) - len(jobs) if limit < self.max_per_pass else 0
+        if not jobs:
+            return summary
+
+        for key, provider, record in asyncio.run(self._match(jobs, doctors_df, roster_version)):
+            record["matched_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            if not record["cached"]:
+                self.queue.add_spend((record["prompt_tokens"] or 0) + record["completion_tokens"])
+            if record["error"] or not record["matches"]:
+                self.queue.finish(key, error=record["error"] or "No matches returned")
+                summary["failed"] += 1
+                METRICS.increment("prematch_jobs", status="failed")
+                continue
+            self.store.put(*key, match_payload(provider, record), created_by=PREMATCH_USER, model=record["model"])
+            self.queue.finish(key)
+            summary["matched"] += 1
+            METRICS.increment("prematch_jobs", status="matched")
+        return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-match pending MD Matching tickets in the background.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--once", action="store_true", help="Run a single pass and exit (default)")
+    mode.add_argument("--loop", action="store_true", help="Keep running a pass every --interval seconds")
+    parser.add_argument("--interval", type=float, default=120.0, help="Seconds between passes in --loop mode")
+    parser.add_argument("--model", default=PRIMARY_MODEL)
+    parser.add_argument("--base-url", default=None, help="OpenAI-compatible endpoint, e.g. a local fake server")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--tokens-per-minute", type=int, default=150_000)
+    parser.add_argument("--daily-token-budget", type=int, default=None, help="Stop matching once this many tokens were spent today")
+    parser.add_argument("--max-per-pass", type=int, default=50, help="Maximum tickets matched per pass")
+    parser.add_argument("--no-cache", action="store_true", help="Skip the on-disk response cache")
+    args = parser.parse_args(argv)
+
+    if os.getenv("MARTS_SQLITE_PATH"):
+        source = SqliteSource(os.environ["MARTS_SQLITE_PATH"])
+    else:
+        import streamlit as st
+
+        source = SnowflakeSource(st.connection("snowflake"))
+
+    store_path = os.getenv("MATCH_STORE_PATH", DEFAULT_STORE_PATH)
+    prematcher = PreMatcher(
+        MartLoader(source, start=False),
+        MatchStore(store_path),
+        PrematchQueue(store_path),
+        api_key=os.getenv("OPENAI_API_KEY", "not-needed"),
+        base_url=args.base_url,
+        model=args.model,
+        cache=None if args.no_cache else ResponseCache(os.getenv("LLM_CACHE_DIR", DEFAULT_CACHE_DIR)),
+        concurrency=args.concurrency,
+        tokens_per_minute=args.tokens_per_minute,
+        daily_token_budget=args.daily_token_budget,
+        max_per_pass=args.max_per_pass,
+    )
+
+    while True:
+        start = time.time()
+        summary = prematcher.run_once()
+        print(f"{time.strftime('%H:%M:%S')} {summary} in {time.time() - start:.1f}s; jobs: {prematcher.queue.stats()}",
+              flush=True)
+        if not args.loop:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
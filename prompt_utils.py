@@ -1,4 +1,32 @@
+import numpy as np
 import pandas as pd
+import re
+import textwrap
+
+from filter_utils import MDIndex
+from llm_utils import DEFAULT_PARAMS, MATCH_COUNT, PRIMARY_MODEL, count_tokens, prompt_budget, truncate_tokens
+from metrics_utils import METRICS
+from service_utils import split_list_field
+
+# Roster table columns sent to the model: (header label, MD column, is a list field)
+ROSTER_COLUMNS = [
+    ("Name", "FULL_NAME", False),
+    ("Email", "EMAIL", False),
+    ("Residing State", "RESIDING_STATE", False),
+    ("Licensed States", "LICENSED_STATES", True),
+    ("Experience", "EXPERIENCE_LEVEL", False),
+    ("Accepting Status", "ACCEPTING_STATUS", False),
+    ("Accepted Services", "ACCEPTED_SERVICES", True),
+    ("Traits", "MD_TRAITS", True),
+    ("Bio", "MD_BIO", False),
+]
+ROSTER_DELIMITER = " | "
+
+# Tokens each MD bio is cut down to before the roster is fitted to the context window
+DEFAULT_BIO_TOKENS = 80
+
+# With a bio retriever, only this many best-aligned MDs have their bio sent
+DEFAULT_BIO_COUNT = 15
 
 def get_clean_value(value, default="Unknown"):
     """
@@ -8,45 +36,156 @@ def get_clean_value(value, default="Unknown"):
         return default
     return str(value).strip()
 
-def create_prompt(doctors_df, provider, filters=None):
+def get_eligible_mds(doctors_df, provider, md_index=None):
+    """
+    Enforces the hard constraints (state licensing, accepting status, services)
+    before anything is added to a prompt. Returns (eligible_df, error).
+    """
+    if md_index is None:
+        md_index = MDIndex(doctors_df)
+    eligible_df = md_index.eligible_mds(provider)
+    if eligible_df.empty:
+        return None, "No available medical directors meet the state licensing, accepting status and service requirements for this provider."
+    return eligible_df, None
+
+@METRICS.timed("create_prompt")
+def create_prompt(doctors_df, provider, filters=None, md_index=None, match_count=MATCH_COUNT,
+                  scorer=None, candidate_limit=None, model=PRIMARY_MODEL, max_tokens=DEFAULT_PARAMS["max_tokens"],
+                  bio_tokens=DEFAULT_BIO_TOKENS, retriever=None, bio_count=DEFAULT_BIO_COUNT, report=None):
+    """
+    Builds the matching prompt for a provider from the MDs that pass the hard constraints.
+    When a scorer is given, MDs are sent in score order (and only the top candidate_limit
+    if set), so the lowest-scored MDs are the first dropped if the roster doesn't fit the
+    model's context. With a retriever (see BioRetriever), only the bios of the bio_count MDs
+    best aligned with the ticket notes and the requirements filter are sent. Returns
+    (prompt, error); if report is a dict it is filled with the token count of each prompt section.
+    """
+    if filters is None:
+        filters = {}
+
+    doctors_df, error = get_eligible_mds(doctors_df, provider, md_index)
+    if error:
+        return None, error
+
+    if scorer is not None:
+        # Order by local score, and only send the best candidates for the LLM to re-rank and explain
+        ranked_emails = scorer.doctors_df.iloc[scorer.top_positions(provider, len(scorer.doctors_df))]['EMAIL']
+        rank = {email: i for i, email in enumerate(ranked_emails)}
+        order = doctors_df['EMAIL'].map(rank).fillna(len(rank)).to_numpy()
+        doctors_df = doctors_df.iloc[np.argsort(order, kind="stable")]
+        if candidate_limit:
+            doctors_df = doctors_df.head(candidate_limit)
+
+    requirements = filters.get("service_requirements", "")
+    bio_emails = None
+    if retriever is not None:
+        bio_emails = retriever.top_emails(provider, doctors_df['EMAIL'], requirements, k=bio_count)
+
+    prompt, prompt_report = build_prompt(
+        doctors_df, provider, min(match_count, len(doctors_df)), model=model, max_tokens=max_tokens, bio_tokens=bio_tokens,
+        requirements=requirements, bio_emails=bio_emails,
+    )
+    if report is not None:
+        report.update(prompt_report)
+    if prompt is None:
+        return None, prompt_report["error"]
+    return prompt, None
+
+@METRICS.timed("create_shard_prompts")
+def create_shard_prompts(doctors_df, provider, filters=None, md_index=None, shard_size=25, shortlist_size=5,
+                         model=PRIMARY_MODEL, max_tokens=DEFAULT_PARAMS["max_tokens"], bio_tokens=DEFAULT_BIO_TOKENS):
+    """
+    Splits the eligible MDs into shards of shard_size and builds one prompt per shard
+    asking for that shard's top shortlist_size matches. Returns (prompts, error).
+    """
     if filters is None:
         filters = {}
-    
+    requirements = filters.get("service_requirements", "")
+
+    doctors_df, error = get_eligible_mds(doctors_df, provider, md_index)
+    if error:
+        return None, error
+
+    doctors_df = doctors_df.sort_values(by="RESIDING_STATE")
+    prompts = []
+    for start in range(0, len(doctors_df), shard_size):
+        shard_df = doctors_df.iloc[start:start + shard_size]
+        prompt, report = build_prompt(
+            shard_df, provider, min(shortlist_size, len(shard_df)), model=model, max_tokens=max_tokens, bio_tokens=bio_tokens,
+            requirements=requirements,
+        )
+        if prompt is None:
+            return None, report["error"]
+        prompts.append(prompt)
+    return prompts, None
+
+def create_reduce_prompt(provider, candidates, match_count=MATCH_COUNT, requirements=""):
+    """
+    Builds the prompt that re-ranks the combined shard shortlists into the final matches.
+    """
+    rows = [
+        [candidate['name'], candidate['email'], candidate.get('capacity_status', ''),
+         candidate['match_score'], candidate['reasoning']]
+        for candidate in candidates
+    ]
+    return (
+        provider_section(provider, requirements)
+        + textwrap.dedent(f"""
+        The medical directors below were shortlisted from separate groups of the roster, each with a match
+        score and reasoning. Re-rank them against each other and select the top {match_count} best matches,
+        keeping or refining the reasoning for each.
+
+        Shortlisted Medical Directors (one per line, fields separated by "|"):
+        """)
+        + format_table(["Name", "Email", "Capacity", "Shortlist Score", "Shortlist Reasoning"], rows)
+        + response_format_section(match_count)
+    )
+
+def provider_section(provider, requirements=""):
+    """
+    Builds the opening of the prompt with the provider information, the coordinator's
+    additional requirements (if any) and location restrictions.
+    """
     # Extract provider information
     ticket_name = str(provider['SUBJECT'])
     provider_email = str(provider['PROVIDER_EMAIL'])
-    provider_license_type = str(provider['PROVIDER_LICENSE_TYPE']) 
+    provider_license_type = str(provider['PROVIDER_LICENSE_TYPE'])
     provider_experience_level = str(provider['PROVIDER_EXPERIENCE_LEVEL'])
-    provider_state = str(provider['PROVIDER_STATE']) 
+    provider_state = str(provider['PROVIDER_STATE'])
     provider_md_location_preference = get_clean_value(provider['PROVIDER_MD_LOCATION_PREFERENCE'], "")
-    provider_services = get_clean_value(provider['PROVIDER_SERVICES'], "None Specified") 
+    provider_services = get_clean_value(provider['PROVIDER_SERVICES'], "None Specified")
     provider_future_services = get_clean_value(provider['PROVIDER_FUTURE_SERVICES'], "")
     provider_additional_services = get_clean_value(provider["PROVIDER_ADDITIONAL_SERVICES"], "")
-    
+    requirements = get_clean_value(requirements, "")
+    requirements_line = f"\n    - Coordinator Requirements: {_cell(requirements)}" if requirements else ""
+
     # Create base prompt
-    prompt = f"""
+    return textwrap.dedent(f"""
     You are an Operations Manager at Moxie tasked with matching providers with the right medical directors. Providers
     are opening up a new medspa and need a medical director to oversee the practice.
-    
+
     Provider Information:
     - Ticket Name: {ticket_name}
     - Email: {provider_email}
     - License Type: {provider_license_type}
     - Experience Level: {provider_experience_level}
-    - State: {provider_state}  
+    - State: {provider_state}
     - MD Location Preference: {provider_md_location_preference}
     - Current Services: {provider_services}
     - Future Services: {provider_future_services}
-    - Additional Notes: {provider_additional_services}
-    
+    - Additional Notes: {provider_additional_services}{requirements_line}
+
     Location Restrictions:
     - California: Providers from California can ONLY be matched with medical directors in California due to strict state licensing requirements.
     - For other states, prioritize same state matches, especially if the provider wrote down an MD Location Preference.
-    """
-    
+    """)
 
-    prompt += """    
-    Using the nurse information above, analyze the following medical directors and identify the top 10 best matches based on:
+def instructions_section(match_count=MATCH_COUNT):
+    """
+    Builds the matching criteria and the per-match instructions.
+    """
+    return textwrap.dedent(f"""
+    Using the nurse information above, analyze the following medical directors and identify the top {match_count} best matches based on:
     1. State licensing requirements (STRICT requirement for California)
     2. MD Location Preference
     3. Services provided. The doctor should have experience with the services the nurse is offering.
@@ -54,70 +193,141 @@ def create_prompt(doctors_df, provider, filters=None):
     5. Personality compatibility
     6. Doctor's preferences and requirements
     7. Any specific notes or requirements mentioned
-    
+
     For each match, provide:
     1. The doctor's name
     2. Contact information
     3. Capacity status
     4. A detailed explanation of why they're a good match, making specific connections between:
-        - How they meet state licensing requirements 
+        - How they meet state licensing requirements
         - How the doctor's personality traits and working style benefit this nurse
         - Specific geographic advantages of their locations
         - How their experience levels complement each other
     5. A match score out of 10
-    
+
     Be specific and detailed in your reasoning, drawing direct connections between their profiles.
-    
+
+    The medical directors below have already been checked against the state licensing, accepting status and
+    service requirements. They are listed one per line with fields separated by "|", in the order of the header row.
+
     Available Medical Directors:
+    """)
 
+def response_format_section(match_count=MATCH_COUNT):
     """
-
-    doctors_df = doctors_df.sort_values(by="RESIDING_STATE")
-    # Add doctor information to the prompt
-    for _, doctor in doctors_df.iterrows():
-        # Extract provider information
-        doctor_name = str(doctor['FULL_NAME'])
-        doctor_email = str(doctor['EMAIL'])
-        doctor_residing_state = str(doctor['RESIDING_STATE'])
-        doctor_licensed_states = str(doctor['LICENSED_STATES'])
-        doctor_experience_level = str(doctor['EXPERIENCE_LEVEL'])
-        doctor_accepting_status = str(doctor['ACCEPTING_STATUS'])
-        doctor_accepted_services = str(doctor['ACCEPTED_SERVICES'])
-        doctor_traits = str(doctor['MD_TRAITS'])
-        doctor_bio = str(doctor['MD_BIO'])
-        
-        doctor_info = f"""
-        Doctor:
-        - Name: {doctor_name}
-        - Email: {doctor_email}
-        - Residing State: {doctor_residing_state}
-        - Licensed States: {doctor_licensed_states}
-        - Experience Level: {doctor_experience_level}
-        - Accepting Status: {doctor_accepting_status}
-        - Accepted Services: {doctor_accepted_services}
-        - Personality Traits: {doctor_traits}
-        - Personal Bio: {doctor_bio}
-        """
-        
-        prompt += doctor_info + "\n"
-    
-    # Add response format instructions
-    prompt += """
+    Builds the JSON response format instructions at the end of the prompt.
+    """
+    return textwrap.dedent(f"""
     Format your response as JSON with the following structure:
-    {
+    {{
         "matches": [
-            {
+            {{
                 "name": "Dr. Name",
                 "email": "doctor@email.com",
                 "capacity_status": "Has capacity for X more of this license type" (include only if matching with a doctor),
-                "match_score": 8.5, 
+                "match_score": 8.5,
                 "reasoning": "Detailed explanation of why this is a good match that specifically references capacity, state requirements, and personality fit"
-            },
+            }},
             ...
         ]
-    }
-    
-    Only include the JSON in your response, nothing else. Make sure to include at least 10 matches. 
+    }}
+
+    Only include the JSON in your response, nothing else. Make sure to include at least {match_count} matches.
+    """)
+
+def _cell(value):
+    """
+    Flattens a value onto one table cell (no newlines or delimiters).
     """
-    
-    return prompt, None
\ No newline at end of file
+    text = get_clean_value(value, "")
+    return re.sub(r"\s+", " ", text.replace("|", "/"))
+
+def format_table(header, rows):
+    """
+    Encodes rows as a header line plus one delimited line per row.
+    """
+    lines = [ROSTER_DELIMITER.join(header)]
+    lines += [ROSTER_DELIMITER.join(_cell(value) for value in row) for row in rows]
+    return "\n".join(lines) + "\n"
+
+def roster_rows(doctors_df, bio_tokens=DEFAULT_BIO_TOKENS, model=PRIMARY_MODEL, bio_emails=None):
+    """
+    Encodes each MD as one table row, with list fields flattened and the bio cut to bio_tokens.
+    If bio_emails is set, only those MDs' bios are included.
+    """
+    rows = []
+    for doctor in doctors_df.to_dict("records"):
+        row = []
+        for _, column, is_list in ROSTER_COLUMNS:
+            value = doctor.get(column)
+            if is_list:
+                value = ", ".join(split_list_field(value))
+            elif column == "MD_BIO":
+                if bio_emails is not None and str(doctor.get('EMAIL')).lower() not in bio_emails:
+                    value = ""
+                value = truncate_tokens(get_clean_value(value, ""), bio_tokens, model)
+            row.append(value)
+        rows.append(row)
+    return rows
+
+def build_prompt(doctors_df, provider, match_count=MATCH_COUNT, model=PRIMARY_MODEL,
+                 max_tokens=DEFAULT_PARAMS["max_tokens"], bio_tokens=DEFAULT_BIO_TOKENS, requirements="",
+                 bio_emails=None):
+    """
+    Builds the matching prompt for a provider against the given (already filtered) MDs,
+    listed in priority order, and fits it to the model's context window with max_tokens
+    reserved for the response. If the roster doesn't fit, bios are shortened first and
+    then the MDs at the end of the list are left out. If bio_emails is set, only those
+    MDs' bios are sent.
+
+    Returns (prompt, report), where report holds the token count of each section; prompt
+    is None (and report["error"] is set) if even the prompt without MDs doesn't fit.
+    """
+    header = [label for label, _, _ in ROSTER_COLUMNS]
+    fixed = {
+        "provider": provider_section(provider, requirements),
+        "instructions": instructions_section(match_count),
+        "response_format": response_format_section(match_count),
+    }
+    report = {name: count_tokens(text, model) for name, text in fixed.items()}
+    report.update({
+        "model": model,
+        "budget": prompt_budget(model, max_tokens),
+        "max_output_tokens": max_tokens,
+        "mds_dropped": 0,
+    })
+    roster_budget = report["budget"] - sum(report[name] for name in fixed) - count_tokens(format_table(header, []), model)
+    if roster_budget < 0:
+        report["error"] = f"The prompt is {-roster_budget} tokens over the {model} context budget before any MDs are added."
+        return None, report
+
+    # Shrink the bios until the roster fits, then drop MDs from the end of the list
+    rows = roster_rows(doctors_df, bio_tokens, model, bio_emails)
+    lines = [count_tokens(format_table([], [row]), model) for row in rows]
+    while sum(lines) > roster_budget and bio_tokens > 0:
+        bio_tokens //= 2
+        rows = roster_rows(doctors_df, bio_tokens, model, bio_emails)
+        lines = [count_tokens(format_table([], [row]), model) for row in rows]
+    keep = len(rows)
+    while keep and sum(lines[:keep]) > roster_budget:
+        keep -= 1
+
+    # Present the roster grouped by state
+    def assemble(rows):
+        state_order = pd.Series([row[2] for row in rows], dtype=object).fillna("").astype(str)
+        roster = format_table(header, [rows[i] for i in state_order.sort_values(kind="stable").index])
+        return roster, fixed["provider"] + fixed["instructions"] + roster + fixed["response_format"]
+
+    roster, prompt = assemble(rows[:keep])
+    # Per-line counts can be off by a token at the joins; trim until the whole prompt fits
+    while keep and count_tokens(prompt, model) > report["budget"]:
+        keep -= 1
+        roster, prompt = assemble(rows[:keep])
+
+    report["roster"] = count_tokens(roster, model)
+    report["mds_included"] = keep
+    report["mds_dropped"] = len(rows) - keep
+    report["bio_tokens"] = bio_tokens
+    report["bios_included"] = sum(1 for row in rows[:keep] if row[-1])
+    report["total"] = count_tokens(prompt, model)
+    return prompt, report
@@ -0,0 +1,105 @@
+import functools
+
+from prompt_utils import get_clean_value
+from service_utils import generate_service_badges
+
+# HTML builders for the app's cards and panels. They live outside main.py because Streamlit
+# re-executes the script on every rerun, which would define them (and their caches) anew.
+
+
+@functools.lru_cache(maxsize=2048)
+def match_card_html(name, match_score, email, capacity_status, residing_state, md_traits, md_bio, reasoning):
+    """
+    Builds the HTML for one MD match card. Memoized on the card's content, so a result set
+    is only formatted once however often the page reruns.
+    """
+    # Determine score color class
+    score = float(match_score)
+    score_class = "high-score" if score >= 8.0 else "medium-score" if score >= 6.0 else "low-score"
+
+    # Build the match card with traits, bio, and fixed location included
+    return f"""<div class="match-card">
+        <div style="display: flex; justify-content: space-between; align-items: center;">
+            <h4>{name}</h4>
+            <div class="compatibility-score {score_class}">{match_score}</div>
+        </div>
+        <p><strong>Email:</strong> {email}</p>
+        <p><strong>Capacity:</strong> {capacity_status}</p>
+        <p><strong>Residing State:</strong> <span class="trait-tag state-tag">{residing_state}</span></p>
+        <p><strong>Personality Traits:</strong> {md_traits}</p>
+        <div class="match-details">
+            <p><strong>Personal Bio:</strong> {md_bio}</p>
+        </div>
+        <div class="match-reason">
+            <p><strong>Why this match works:</strong> {reasoning}</p>
+        </div>
+        </div>"""
+
+def match_card(match, md_row):
+    """
+    Returns the HTML card for a match with the MD's traits, state and bio from their roster row.
+    md_row is None when the match couldn't be resolved to an MD in the roster.
+    """
+    if md_row is None:
+        email = match.get('email', '')
+        residing_state = "Unknown"
+        md_traits = ""
+        md_bio = "⚠️ This MD could not be found in the current roster. Verify them before assigning."
+    else:
+        email = md_row['EMAIL']
+        residing_state = md_row['RESIDING_STATE']
+        md_traits = get_clean_value(md_row.get('MD_TRAITS', ''), '')
+        md_bio = get_clean_value(md_row.get('MD_BIO', ''), 'No bio provided')
+    return match_card_html(
+        str(match['name']), match['match_score'], str(email), str(match.get('capacity_status', 'Available')),
+        str(residing_state), md_traits, md_bio, str(match['reasoning']),
+    )
+
+@functools.lru_cache(maxsize=512)
+def provider_details_html(subject, provider_email, ticket_status, ticket_priority, kick_off_date, provider_license_type,
+                          provider_experience_level, provider_state, provider_md_location_preference, services,
+                          future_services, provider_additional_services):
+    """
+    Builds the provider details panel. Memoized on the ticket's field values.
+    """
+    # Create service tags
+    services_html = generate_service_badges(services)
+    future_services_html = generate_service_badges(future_services)
+    
+    # Display state info with special style for California
+    state_html = f'<span class="trait-tag state-tag">{provider_state}</span>'
+    
+    # Add California restriction warning if applicable
+    ca_restriction = ""
+    if provider_state == "California":
+        ca_restriction = """
+        <div class="state-restrictions">
+            <strong>California Restriction:</strong> This nurse can only be matched with medical directors in California due to state licensing requirements.
+        </div>
+        """
+
+    return f"""
+        <div class="nurse-info">
+            <div class="nurse-detail">
+                <h4>{subject}</h4>
+                <p><strong>Ticket Status:</strong> {ticket_status}</p>
+                <p><strong>Ticket Priority:</strong> {ticket_priority}</p>
+                <p><strong>Kick-Off Date:</strong> {kick_off_date}</p>
+                <p><strong>Email:</strong> {provider_email}</p>
+                <p><strong>License:</strong> {provider_license_type}</p>
+                <p><strong>Experience:</strong> {provider_experience_level}</p>
+                <p><strong>State:</strong> {state_html} {ca_restriction or ''}</p>
+                <p><strong>MD Location Preference:</strong> {provider_md_location_preference}</p>
+                <P><p><strong>Services:</strong> {services_html}</P>
+                <p><strong>Future Services:</strong> {future_services_html}</p>
+                <p><strong>Additional Notes:</strong> {provider_additional_services}</p>
+            </div>
+        </div>
+        """
+
+def services_value(provider, column, default):
+    """
+    The services parsed at data load (a hashable tuple), or the raw field if it wasn't parsed.
+    """
+    parsed = provider.get(f"{column}_LIST")
+    return tuple(parsed) if isinstance(parsed, (list, tuple)) else get_clean_value(provider[column], default)
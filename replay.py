@@ -0,0 +1,468 @@
+"""
+Offline replay and evaluation of logged matching runs.
+
+Reads an export of the feedback sheet (CSV, or JSONL with one row per line, using the
+FEEDBACK_COLUMNS headers), rebuilds every logged ticket's prompt with create_prompt under
+one or more prompt variants and replays it against a backend:
+
+- recorded: serves each row's logged "Raw Results" with its logged "Request Duration (s)",
+  without any API calls. Only prompt-side numbers change between variants, and each
+  variant's ranking is the logged response limited to the MDs its prompt still contains.
+- fake: the local fake OpenAI server, with --latency / --first-token-latency.
+- live: an OpenAI-compatible endpoint (OPENAI_API_KEY, --base-url). Responses go through
+  the on-disk response cache, so replaying the same prompts again costs nothing.
+
+For each variant it reports prompt/completion tokens, latency, estimated cost and how
+often the coordinator's "Selected MD(s)" are still in the prompt and in the top k
+matches. The first variant is the reference: with --max-recall-drop, any variant whose
+recall at some k falls further below it exits with status 1.
+
+Prompts are built against the current MD roster (CSV export, MARTS_SQLITE_PATH or
+Snowflake), not the roster at the time of the logged run, and the coordinator's
+"additional requirements" text isn't logged, so it is left empty.
+
+Usage:
+    python replay.py --log feedback.csv --mds-csv mds.csv
+    python replay.py --log feedback.csv --mds-csv mds.csv --variants app,prefilter,compact,app@gpt-3.5-turbo
+    python replay.py --log feedback.jsonl --variants app,sharded --backend fake --latency 0.5 --output results/replay.json
+"""
+import argparse
+import csv
+import orjson
+import os
+import pandas as pd
+import statistics
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from cache_utils import DEFAULT_CACHE_DIR, ResponseCache
+from client_utils import LLMClient, cached_complete
+from data_utils import MDS_TABLE, MartLoader, SnowflakeSource, SqliteSource
+from fake_openai import MD_PATTERN, start_fake_server
+from filter_utils import MDIndex
+from llm_utils import MATCH_COUNT, PRIMARY_MODEL, SYSTEM_PROMPT, clean_json_response, count_tokens
+from metrics_utils import quantile
+from parse_utils import parse_matches
+from prompt_utils import DEFAULT_BIO_TOKENS, create_prompt, create_shard_prompts
+from retrieval_utils import BioRetriever
+from scoring_utils import MatchScorer
+from service_utils import normalize_services
+from shard_utils import merge_shortlists
+
+# USD per million (prompt, completion) tokens; override or add models with --price
+MODEL_PRICES = {
+    "gpt-4-turbo-preview": (10.0, 30.0),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-3.5-turbo": (0.5, 1.5),
+}
+
+DEFAULT_TOP_K = (1, 3, 5, 10)
+
+
+class Variant:
+    """
+    One prompt-building configuration to replay: which MDs are sent (all eligible, or
+    the top candidate_limit by local score), how bios are encoded (bio_tokens each,
+    optionally only for the best-aligned MDs) and whether the roster is split into
+    shards of shard_size whose shortlists are merged, as in match_sharded.
+    """
+
+    def __init__(self, name, model=PRIMARY_MODEL, candidate_limit=None, retrieve_bios=False,
+                 bio_tokens=DEFAULT_BIO_TOKENS, shard_size=None, shortlist_size=5):
+        self.name = name
+        self.model = model
+        self.candidate_limit = candidate_limit
+        self.retrieve_bios = retrieve_bios
+        self.bio_tokens = bio_tokens
+        self.shard_size = shard_size
+        self.shortlist_size = shortlist_size
+
+    def with_model(self, model):
+        variant = Variant(self.name, model, self.candidate_limit, self.retrieve_bios, self.bio_tokens,
+                          self.shard_size, self.shortlist_size)
+        variant.name = f"{self.name}@{model}"
+        return variant
+
+    def prompts(self, doctors_df, provider, md_index, scorer, retriever):
+        """
+        Returns (prompts, error): one prompt, or one per shard.
+        """
+        if self.shard_size:
+            prompts, error = create_shard_prompts(
+                doctors_df, provider, md_index=md_index, shard_size=self.shard_size,
+                shortlist_size=self.shortlist_size, model=self.model, bio_tokens=self.bio_tokens,
+            )
+            # A roster that fits in one shard is matched with a single prompt
+            if error or len(prompts) > 1:
+                return prompts, error
+        prompt, error = create_prompt(
+            doctors_df, provider, md_index=md_index, model=self.model, bio_tokens=self.bio_tokens,
+            scorer=scorer if self.candidate_limit else None, candidate_limit=self.candidate_limit,
+            retriever=retriever if self.retrieve_bios else None,
+        )
+        return ([prompt] if prompt is not None else None), error
+
+
+# Built-in variants; pass "name@model" to run one against another model
+VARIANTS = {
+    "full": Variant("full"),
+    "app": Variant("app", retrieve_bios=True),
+    "prefilter": Variant("prefilter", candidate_limit=50, retrieve_bios=True),
+    "compact": Variant("compact", candidate_limit=50, bio_tokens=0),
+    "sharded": Variant("sharded", shard_size=25),
+}
+
+def parse_variant(spec, variants=VARIANTS):
+    name, _, model = spec.strip().partition("@")
+    if name not in variants:
+        raise ValueError(f"Unknown variant {name!r}; choose from {', '.join(variants)}")
+    return variants[name].with_model(model) if model else variants[name]
+
+
+def _json_field(value, default=None):
+    if isinstance(value, (dict, list)):
+        return value
+    if value is None or not str(value).strip():
+        return default
+    return orjson.loads(value)
+
+def parse_selected(value):
+    """
+    Returns the MD names from a "Selected MD(s)" cell (a JSON list, or "None").
+    """
+    if isinstance(value, list):
+        return [str(name) for name in value]
+    text = str(value or "").strip()
+    if not text or text == "None":
+        return []
+    try:
+        names = orjson.loads(text)
+    except orjson.JSONDecodeError:
+        names = text.split(",")
+    return [str(name).strip() for name in names if str(name).strip()]
+
+def parse_log_row(row):
+    """
+    Turns one logged feedback row into a replay entry. Returns (entry, error).
+    """
+    try:
+        provider_data = _json_field(row.get("Provider Data"))
+        model_params = _json_field(row.get("Model Params"), {})
+    except orjson.JSONDecodeError as e:
+        return None, f"Unreadable JSON field: {e}"
+    if not provider_data:
+        return None, "No provider data"
+    try:
+        duration = float(row.get("Request Duration (s)"))
+    except (TypeError, ValueError):
+        duration = None
+    raw_results = row.get("Raw Results") or ""
+    return {
+        "ticket": row.get("Provider") or provider_data.get("SUBJECT", ""),
+        "provider": normalize_services(pd.DataFrame([provider_data])).iloc[0],
+        "model": model_params.get("model") or row.get("AI Model") or PRIMARY_MODEL,
+        "raw_results": raw_results if isinstance(raw_results, str) else orjson.dumps(raw_results).decode(),
+        "duration": duration,
+        "selected": parse_selected(row.get("Selected MD(s)")),
+    }, None
+
+def load_log(path):
+    """
+    Reads a feedback log export (.jsonl/.ndjson or CSV). Returns (entries, skipped), where
+    skipped lists (row number, reason) for rows that can't be replayed.
+    """
+    if path.endswith((".jsonl", ".ndjson")):
+        with open(path, "rb") as f:
+            rows = [orjson.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    entries, skipped = [], []
+    for number, row in enumerate(rows, start=1):
+        entry, error = parse_log_row(row)
+        if error:
+            skipped.append((number, error))
+            continue
+        entry["row"] = number
+        entries.append(entry)
+    return entries, skipped
+
+def load_roster(mds_csv=None):
+    """
+    Loads the available MDs from a CSV export, the SQLite mart stand-in (MARTS_SQLITE_PATH)
+    or Snowflake.
+    """
+    if mds_csv:
+        doctors_df = pd.read_csv(mds_csv)
+        doctors_df.columns = doctors_df.columns.str.upper()
+        return normalize_services(doctors_df)
+
+    if os.getenv("MARTS_SQLITE_PATH"):
+        source = SqliteSource(os.environ["MARTS_SQLITE_PATH"])
+    else:
+        import streamlit as st
+
+        source = SnowflakeSource(st.connection("snowflake"))
+    loader = MartLoader(source, tables=(MDS_TABLE,), start=False)
+    if loader.warm():
+        raise RuntimeError(f"Failed to load the MD roster: {loader.errors}")
+    return loader.get("mds")
+
+
+class RecordedBackend:
+    """
+    Answers every prompt of an entry with the entry's logged response, taking the logged
+    request duration. Makes no calls.
+    """
+
+    name = "recorded"
+
+    def run(self, entry, prompts, model):
+        return [entry["raw_results"]], entry["duration"], False
+
+
+class LLMBackend:
+    """
+    Sends prompts through LLMClient to an OpenAI-compatible endpoint (the fake server or
+    the real API), one client per model with no fallback to another model. Shard prompts
+    are sent in parallel, as the app does.
+    """
+
+    def __init__(self, name, api_key, base_url=None, cache=None, max_workers=8):
+        self.name = name
+        self.api_key = api_key
+        self.base_url = base_url
+        self.cache = cache
+        self.max_workers = max_workers
+        self.clients = {}
+
+    def _client(self, model):
+        if model not in self.clients:
+            self.clients[model] = LLMClient(self.api_key, self.base_url, primary_model=model, fallback_model=model)
+        return self.clients[model]
+
+    def run(self, entry, prompts, model):
+        client = self._client(model)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(prompts))) as pool:
+            results = list(pool.map(lambda prompt: cached_complete(client, prompt, cache=self.cache), prompts))
+        return [content for content, _, _ in results], time.perf_counter() - start, all(c for _, _, c in results)
+
+
+def _normalize_name(name):
+    return " ".join(str(name).lower().split())
+
+def estimate_cost(model, prompt_tokens, completion_tokens, prices=MODEL_PRICES):
+    """
+    Returns the USD cost of a request, or None for a model without a known price.
+    """
+    if model not in prices:
+        return None
+    prompt_price, completion_price = prices[model]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+def replay_entry(entry, variant, backend, doctors_df, md_index, scorer, retriever, top_k=DEFAULT_TOP_K,
+                 prices=MODEL_PRICES):
+    """
+    Rebuilds one logged ticket's prompt(s) under a variant, replays them and returns a
+    record with tokens, latency, cost and where the selected MDs ended up.
+    """
+    record = {"row": entry["row"], "ticket": entry["ticket"], "variant": variant.name, "model": variant.model,
+              "selected": len(entry["selected"]), "error": None}
+    prompts, error = variant.prompts(doctors_df, entry["provider"], md_index, scorer, retriever)
+    if error:
+        record["error"] = error
+        return record
+
+    # MDs in the prompt(s), by email and by name
+    in_prompt = {}
+    for prompt in prompts:
+        for found in MD_PATTERN.finditer(prompt):
+            in_prompt[found.group("email").strip().lower()] = _normalize_name(found.group("name"))
+    prompt_names = set(in_prompt.values())
+
+    model = entry["model"] if isinstance(backend, RecordedBackend) else variant.model
+    try:
+        contents, seconds, cached = backend.run(entry, prompts, model)
+    except Exception as e:
+        record["error"] = str(e)
+        return record
+
+    shortlists = [parse_matches(clean_json_response(content))["matches"] for content in contents]
+    matches = shortlists[0] if len(shortlists) == 1 else merge_shortlists(shortlists, MATCH_COUNT)
+    # Only MDs the prompt actually offered count (for recorded responses, the ones this variant kept)
+    ranked = [
+        _normalize_name(match["name"]) for match in matches if str(match["email"]).lower() in in_prompt
+    ]
+    selected = {_normalize_name(name) for name in entry["selected"]}
+
+    record["prompts"] = len(prompts)
+    record["mds_in_prompt"] = len(in_prompt)
+    record["prompt_tokens"] = sum(count_tokens(SYSTEM_PROMPT, variant.model) + count_tokens(prompt, variant.model)
+                                  for prompt in prompts)
+    record["completion_tokens"] = sum(count_tokens(content, variant.model) for content in contents)
+    record["seconds"] = seconds
+    record["cached"] = cached
+    record["cost"] = estimate_cost(variant.model, record["prompt_tokens"], record["completion_tokens"], prices)
+    record["selected_in_prompt"] = len(selected & prompt_names)
+    record["found"] = {k: len(selected & set(ranked[:k])) for k in top_k}
+    return record
+
+def summarize(records, top_k=DEFAULT_TOP_K):
+    """
+    Aggregates replay records per variant: token, latency and cost totals and percentiles,
+    plus recall of the selected MDs (selected MDs found / all selected MDs) in the prompt
+    and in the top k.
+    """
+    summary = {}
+    for name in dict.fromkeys(record["variant"] for record in records):
+        done = [r for r in records if r["variant"] == name and not r["error"]]
+        selected = sum(r["selected"] for r in done)
+        seconds = sorted(r["seconds"] for r in done if r["seconds"] is not None)
+        costs = [r["cost"] for r in done]
+        summary[name] = {
+            "entries": sum(1 for r in records if r["variant"] == name),
+            "errors": sum(1 for r in records if r["variant"] == name and r["error"]),
+            "calls": sum(r["prompts"] for r in done),
+            "cached": sum(1 for r in done if r["cached"]),
+            "mean_prompt_tokens": statistics.mean(r["prompt_tokens"] for r in done) if done else 0,
+            "prompt_tokens": sum(r["prompt_tokens"] for r in done),
+            "completion_tokens": sum(r["completion_tokens"] for r in done),
+            "p50_seconds": quantile(seconds, 0.5),
+            "p95_seconds": quantile(seconds, 0.95),
+            "cost": sum(costs) if done and None not in costs else None,
+            "selected": selected,
+            "selected_in_prompt": sum(r["selected_in_prompt"] for r in done) / selected if selected else None,
+            "recall": {k: sum(r["found"][k] for r in done) / selected if selected else None for k in top_k},
+        }
+    return summary
+
+def replay(entries, variants, backend, doctors_df, top_k=DEFAULT_TOP_K, prices=MODEL_PRICES, concurrency=8):
+    """
+    Replays every entry under every variant. Returns (records, summary).
+    """
+    md_index, scorer, retriever = MDIndex(doctors_df), MatchScorer(doctors_df), BioRetriever(doctors_df)
+    records = []
+    for variant in variants:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            records += pool.map(
+                lambda entry: replay_entry(entry, variant, backend, doctors_df, md_index, scorer, retriever,
+                                           top_k, prices),
+                entries,
+            )
+    return records, summarize(records, top_k)
+
+def format_summary(summary, top_k=DEFAULT_TOP_K):
+    percent = lambda value: f"{value * 100:.0f}%" if value is not None else "-"
+    lines = [
+        f"{'variant':<28}{'ok':>6}{'calls':>7}{'prompt tok':>12}{'p50 s':>8}{'p95 s':>8}{'cost $':>10}{'in prompt':>11}"
+        + "".join(f"{f'top-{k}':>8}" for k in top_k)
+    ]
+    for name, stats in summary.items():
+        cost = f"{stats['cost']:.2f}" if stats["cost"] is not None else "n/a"
+        lines.append(
+            f"{name:<28}{stats['entries'] - stats['errors']:>6}{stats['calls']:>7}{stats['mean_prompt_tokens']:>12,.0f}"
+            f"{stats['p50_seconds']:>8.2f}{stats['p95_seconds']:>8.2f}{cost:>10}{percent(stats['selected_in_prompt']):>11}"
+            + "".join(f"{percent(stats['recall'][k]):>8}" for k in top_k)
+        )
+    return "\n".join(lines)
+
+def compare(summary, max_drop):
+    """
+    Returns a list of regressions: variants whose recall of the selected MDs at some k is
+    more than max_drop below the first (reference) variant's.
+    """
+    names = list(summary)
+    if not names:
+        return []
+    reference = summary[names[0]]["recall"]
+    regressions = []
+    for name in names[1:]:
+        for k, recall in summary[name]["recall"].items():
+            if reference[k] is not None and recall is not None and reference[k] - recall > max_drop:
+                regressions.append(f"{name} top-{k}: {recall * 100:.0f}% vs {reference[k] * 100:.0f}% for {names[0]}")
+    return regressions
+
+def _parse_prices(items):
+    prices = dict(MODEL_PRICES)
+    for item in items:
+        model, values = item.rsplit("=", 1)
+        prompt_price, completion_price = values.split(",")
+        prices[model] = (float(prompt_price), float(completion_price))
+    return prices
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay logged matching runs under prompt variants and compare them.")
+    parser.add_argument("--log", required=True, help="Feedback sheet export (CSV, or JSONL with one row per line)")
+    parser.add_argument("--mds-csv", default=None, help="Read MDs from a CSV export instead of the marts")
+    parser.add_argument("--variants", default="app",
+                        help=f"Comma-separated variants ({', '.join(VARIANTS)}), each optionally as name@model; "
+                             "the first is the reference")
+    parser.add_argument("--backend", choices=("recorded", "fake", "live"), default="recorded")
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake server response latency in seconds")
+    parser.add_argument("--first-token-latency", type=float, default=0.0, help="Fake server time to first token")
+    parser.add_argument("--base-url", default=None, help="OpenAI-compatible endpoint for the live backend")
+    parser.add_argument("--no-cache", action="store_true", help="Skip the on-disk response cache (live backend)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Tickets replayed at once")
+    parser.add_argument("--top-k", default=",".join(map(str, DEFAULT_TOP_K)), help="Comma-separated k values")
+    parser.add_argument("--price", action="append", default=[], metavar="MODEL=PROMPT,COMPLETION",
+                        help="USD per million prompt and completion tokens for a model")
+    parser.add_argument("--limit", type=int, default=None, help="Only replay the first N logged rows")
+    parser.add_argument("--output", default=None, help="Write the summary and per-ticket records as JSON")
+    parser.add_argument("--max-recall-drop", type=float, default=None,
+                        help="Exit with status 1 if a variant's top-k recall is this far below the reference (0-1)")
+    args = parser.parse_args(argv)
+
+    top_k = tuple(int(k) for k in args.top_k.split(","))
+    variants = [parse_variant(spec) for spec in args.variants.split(",")]
+    entries, skipped = load_log(args.log)
+    entries = entries[:args.limit]
+    print(f"Replaying {len(entries)} logged runs ({len(skipped)} rows skipped) under "
+          f"{len(variants)} variant(s) with the {args.backend} backend", file=sys.stderr)
+    for number, reason in skipped:
+        print(f"  row {number}: {reason}", file=sys.stderr)
+    doctors_df = load_roster(args.mds_csv)
+
+    server = None
+    if args.backend == "recorded":
+        backend = RecordedBackend()
+    elif args.backend == "fake":
+        server, url = start_fake_server(latency=args.latency, first_token_latency=args.first_token_latency)
+        backend = LLMBackend("fake", "not-needed", url)
+    else:
+        cache = None if args.no_cache else ResponseCache(os.getenv("LLM_CACHE_DIR", DEFAULT_CACHE_DIR))
+        backend = LLMBackend("live", os.getenv("OPENAI_API_KEY", "not-needed"), args.base_url, cache=cache)
+
+    try:
+        records, summary = replay(entries, variants, backend, doctors_df, top_k, _parse_prices(args.price),
+                                  args.concurrency)
+    finally:
+        if server is not None:
+            server.shutdown()
+    print(format_summary(summary, top_k))
+    for record in records:
+        if record["error"]:
+            print(f"  {record['variant']} / {record['ticket']}: {record['error']}")
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "wb") as f:
+            f.write(orjson.dumps({"summary": summary, "records": records},
+                                 option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+
+    if args.max_recall_drop is not None:
+        regressions = compare(summary, args.max_recall_drop)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
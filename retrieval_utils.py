@@ -0,0 +1,112 @@
+import numpy as np
+import re
+import zlib
+
+from prompt_utils import DEFAULT_BIO_COUNT, get_clean_value
+from service_utils import split_list_field
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "in", "is", "it", "of",
+    "on", "or", "someone", "that", "the", "their", "to", "who", "with", "would", "etc", "eg", "prefer",
+    "looking", "want", "wants", "needs", "need",
+}
+
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(str(text).lower()) if token not in STOP_WORDS]
+
+class HashingEmbedder:
+    """
+    Local TF-IDF embedder over hashed word unigrams and bigrams; needs no model download
+    or API call. fit() learns the inverse document frequencies from the roster so common
+    bio boilerplate counts for little.
+
+    Any object with an embed(texts) method returning one row per text can be used
+    instead (an optional fit(texts) is called with the roster texts first).
+    """
+
+    def __init__(self, dimensions=2 ** 10, ngrams=2):
+        self.dimensions = dimensions
+        self.ngrams = ngrams
+        self.idf = np.ones(dimensions, dtype=np.float32)
+
+    def _features(self, text):
+        tokens = tokenize(text)
+        grams = [
+            " ".join(tokens[i:i + n]) for n in range(1, self.ngrams + 1) for i in range(len(tokens) - n + 1)
+        ]
+        # crc32 instead of hash() so vectors don't change between processes
+        return [zlib.crc32(gram.encode()) % self.dimensions for gram in grams]
+
+    def fit(self, texts):
+        frequency = np.zeros(self.dimensions, dtype=np.float32)
+        for text in texts:
+            frequency[list(set(self._features(text)))] += 1
+        self.idf = (np.log((1 + len(texts)) / (1 + frequency)) + 1).astype(np.float32)
+        return self
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            features = self._features(text)
+            if features:
+                np.add.at(matrix[row], features, 1.0)
+        # Sublinear term frequency, then IDF weighting and unit length
+        matrix = np.log1p(matrix) * self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def md_document(doctor):
+    """
+    The text an MD is retrieved by: traits and bio.
+    """
+    traits = ", ".join(split_list_field(doctor.get('MD_TRAITS')))
+    return f"{traits}. {get_clean_value(doctor.get('MD_BIO'), '')}"
+
+def provider_query(provider, requirements=""):
+    """
+    The text a provider retrieves MDs with: the ticket notes and the coordinator's requirements.
+    """
+    notes = get_clean_value(provider.get('PROVIDER_ADDITIONAL_SERVICES'), "")
+    return " ".join(part for part in (notes, get_clean_value(requirements, "")) if part)
+
+class BioRetriever:
+    """
+    Ranks MDs by how well their bio and traits align with a provider's notes and free-text
+    requirements (cosine similarity). The roster is embedded once per snapshot into an
+    in-memory matrix; each query is a single matrix-vector product.
+    """
+
+    def __init__(self, doctors_df, embedder=None):
+        self.embedder = embedder or HashingEmbedder()
+        documents = [md_document(doctor) for doctor in doctors_df.to_dict("records")]
+        if hasattr(self.embedder, "fit"):
+            self.embedder.fit(documents)
+        self.matrix = np.asarray(self.embedder.embed(documents), dtype=np.float32)
+        self.positions = {str(email).lower(): i for i, email in enumerate(doctors_df['EMAIL'])}
+
+    def similarities(self, query, emails):
+        """
+        Returns the cosine similarity of each MD in emails to the query text (0 for unknown MDs).
+        """
+        vector = np.asarray(self.embedder.embed([query]), dtype=np.float32)[0]
+        rows = np.array([self.positions.get(str(email).lower(), -1) for email in emails], dtype=np.int64)
+        similarities = np.zeros(len(rows), dtype=np.float32)
+        known = rows >= 0
+        similarities[known] = self.matrix[rows[known]] @ vector
+        return similarities
+
+    def top_emails(self, provider, emails, requirements="", k=DEFAULT_BIO_COUNT):
+        """
+        Returns the emails (from emails) of the k MDs best aligned with the provider's notes
+        and requirements, or None if there is no free text to retrieve with.
+        """
+        query = provider_query(provider, requirements)
+        if not tokenize(query):
+            return None
+        emails = list(emails)
+        similarities = self.similarities(query, emails)
+        order = np.argsort(-similarities, kind="stable")[:k]
+        return {str(emails[i]).lower() for i in order if similarities[i] > 0}
@@ -0,0 +1,220 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from filter_utils import MID_LEVEL_ONLY_STATUS, US_STATES, is_mid_level_license, normalize_state
+from llm_utils import MATCH_COUNT
+from service_utils import SERVICE_VOCABULARY, popcount, service_masks, split_list_field
+
+STATE_NAMES = sorted(US_STATES.values())
+STATE_INDEX = {state: i for i, state in enumerate(STATE_NAMES)}
+
+# Keywords mapped to an experience rank: 0 = new, 1 = intermediate, 2 = experienced
+EXPERIENCE_KEYWORDS = [
+    (0, ("new", "beginner", "entry", "novice", "inexperienced", "less than", "<1", "0-1", "0 -")),
+    (1, ("intermediate", "some", "mid", "moderate", "1-3", "1 -", "2-")),
+    (2, ("experienced", "advanced", "expert", "senior", "3+", "5+", "10+", "3-", "5-")),
+]
+
+
+def _keyword_pattern(keywords):
+    """
+    Matches any of the keywords as a whole word, so "inexperienced" isn't read as "experienced"
+    and "new" doesn't match inside "renewal". Keywords ending in a symbol ("3-", "5+") still
+    match the start of a range such as "3-5 years".
+    """
+    return re.compile("|".join(
+        rf"(?<![a-z0-9]){re.escape(keyword)}" + (r"(?![a-z0-9])" if keyword[-1].isalnum() else "")
+        for keyword in keywords
+    ))
+
+
+EXPERIENCE_PATTERNS = [(rank, _keyword_pattern(keywords)) for rank, keywords in EXPERIENCE_KEYWORDS]
+
+# Points per component; they add up to a score out of 10
+WEIGHTS = {
+    "same_state": 3.0,
+    "location_preference": 2.0,
+    "services": 3.0,
+    "future_services": 1.0,
+    "experience": 1.0,
+}
+
+
+def experience_rank(value):
+    """
+    Maps a free-text experience level to 0 (new), 1 (intermediate), 2 (experienced) or -1 if unknown.
+    """
+    if value is None or pd.isna(value):
+        return -1
+    text = str(value).strip().lower()
+    for rank, pattern in reversed(EXPERIENCE_PATTERNS):
+        if pattern.search(text):
+            return rank
+    return -1
+
+def _state_index(value):
+    return STATE_INDEX.get(normalize_state(value), -1)
+
+class MatchScorer:
+    """
+    Scores every provider against every MD without the LLM.
+
+    The MD roster is encoded once into NumPy arrays (residing state index, licensed-state
+    matrix, accepted services expanded from the canonical service bitmasks, experience rank,
+    Mid Level Only flag). Tickets
+    are encoded the same way and the provider x MD compatibility matrix is computed in one
+    vectorized pass. Pairs that break the hard constraints (see MDIndex) are not eligible.
+    """
+
+    def __init__(self, doctors_df):
+        self.doctors_df = doctors_df
+        md_masks = service_masks(doctors_df, 'ACCEPTED_SERVICES')
+        self.service_width = len(SERVICE_VOCABULARY.names)
+
+        self.md_state = np.array([_state_index(v) for v in doctors_df['RESIDING_STATE']], dtype=np.int16)
+        self.md_licensed = np.zeros((len(doctors_df), len(STATE_NAMES)), dtype=bool)
+        for row, value in enumerate(doctors_df['LICENSED_STATES']):
+            for state in split_list_field(value):
+                column = _state_index(state)
+                if column >= 0:
+                    self.md_licensed[row, column] = True
+        has_state = self.md_state >= 0
+        self.md_licensed[np.flatnonzero(has_state), self.md_state[has_state]] = True
+
+        self.md_services = SERVICE_VOCABULARY.mask_matrix(md_masks, self.service_width)
+        self.md_any_service = ~self.md_services.any(axis=1)
+        self.md_experience = np.array([experience_rank(v) for v in doctors_df['EXPERIENCE_LEVEL']], dtype=np.int8)
+        self.md_mid_level_only = (doctors_df['ACCEPTING_STATUS'].astype(str).str.strip() == MID_LEVEL_ONLY_STATUS).to_numpy()
+
+    def _encode_providers(self, providers_df):
+        current = service_masks(providers_df, 'PROVIDER_SERVICES')
+        future = service_masks(providers_df, 'PROVIDER_FUTURE_SERVICES')
+        return {
+            "state": np.array([_state_index(v) for v in providers_df['PROVIDER_STATE']], dtype=np.int16),
+            "preference": np.array([_state_index(v) for v in providers_df['PROVIDER_MD_LOCATION_PREFERENCE']], dtype=np.int16),
+            # Services the roster doesn't know about still count towards the provider's total
+            "services": SERVICE_VOCABULARY.mask_matrix(current, self.service_width),
+            "service_count": popcount(current),
+            "future_services": SERVICE_VOCABULARY.mask_matrix(future, self.service_width),
+            "future_service_count": popcount(future),
+            "experience": np.array([experience_rank(v) for v in providers_df['PROVIDER_EXPERIENCE_LEVEL']], dtype=np.int8),
+            "mid_level": np.array([is_mid_level_license(v) for v in providers_df['PROVIDER_LICENSE_TYPE']], dtype=bool),
+        }
+
+    def _coverage(self, provider_matrix, provider_count):
+        """
+        Fraction of each provider's services each MD accepts; MDs without a service list count as 0.5.
+        """
+        overlap = provider_matrix.astype(np.float32) @ self.md_services.T.astype(np.float32)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            coverage = np.where(provider_count[:, None] > 0, overlap / provider_count[:, None], 0.0)
+        coverage = np.where(self.md_any_service[None, :] & (provider_count[:, None] > 0), 0.5, coverage)
+        return coverage, overlap
+
+    def score(self, providers_df):
+        """
+        Returns (scores, eligible, components) for every provider x MD pair. scores is a
+        float32 (providers x MDs) matrix out of 10, eligible is a boolean matrix of pairs
+        that meet the hard constraints and components holds each weighted component.
+        """
+        p = self._encode_providers(providers_df)
+        provider_state = p["state"][:, None]
+        known_state = provider_state >= 0
+
+        same_state = (provider_state == self.md_state[None, :]) & known_state
+        licensed = np.where(known_state, self.md_licensed[:, np.maximum(p["state"], 0)].T, True)
+        california = provider_state == STATE_INDEX["California"]
+
+        services, overlap = self._coverage(p["services"], p["service_count"])
+        future_services, _ = self._coverage(p["future_services"], p["future_service_count"])
+
+        eligible = (
+            licensed
+            & (~california | same_state)
+            & (p["mid_level"][:, None] | ~self.md_mid_level_only[None, :])
+            & ((p["service_count"][:, None] == 0) | self.md_any_service[None, :] | (overlap > 0))
+        )
+
+        preference = p["preference"][:, None]
+        location_preference = np.where(preference >= 0, preference == self.md_state[None, :], same_state)
+
+        provider_experience = p["experience"][:, None]
+        md_experience = self.md_experience[None, :]
+        experience = np.where(
+            (provider_experience < 0) | (md_experience < 0),
+            0.5,
+            np.where(md_experience > provider_experience, 1.0,
+                     np.where(md_experience == provider_experience, 0.5, 0.0)),
+        )
+
+        components = {
+            "same_state": WEIGHTS["same_state"] * same_state,
+            "location_preference": WEIGHTS["location_preference"] * location_preference,
+            "services": WEIGHTS["services"] * services,
+            "future_services": WEIGHTS["future_services"] * np.where(p["future_service_count"][:, None] > 0, future_services, 0.5),
+            "experience": WEIGHTS["experience"] * experience,
+        }
+        scores = sum(components.values()).astype(np.float32)
+        return scores, eligible, components
+
+    def shortlists(self, providers_df, k=MATCH_COUNT, chunk_size=512):
+        """
+        Returns, per provider row, the roster positions of its top k eligible MDs and their
+        scores. Providers are scored in chunks so memory stays bounded for large queues.
+        """
+        positions, top_scores = [], []
+        for start in range(0, len(providers_df), chunk_size):
+            scores, eligible, _ = self.score(providers_df.iloc[start:start + chunk_size])
+            scores = np.where(eligible, scores, -np.inf)
+            kth = min(k, scores.shape[1])
+            if kth == 0:
+                positions.extend([np.array([], dtype=int)] * len(scores))
+                top_scores.extend([np.array([], dtype=np.float32)] * len(scores))
+                continue
+            top = np.argpartition(-scores, kth - 1, axis=1)[:, :kth]
+            for row, columns in enumerate(top):
+                # Highest score first, ties in roster order
+                columns = columns[np.lexsort((columns, -scores[row, columns]))]
+                columns = columns[np.isfinite(scores[row, columns])]
+                positions.append(columns)
+                top_scores.append(scores[row, columns])
+        return positions, top_scores
+
+    def _score_one(self, provider):
+        providers_df = provider.to_frame().T if isinstance(provider, pd.Series) else provider
+        scores, eligible, components = self.score(providers_df)
+        scores = np.where(eligible, scores, -np.inf)[0]
+        order = np.argsort(-scores, kind="stable")
+        return scores, order[np.isfinite(scores[order])], components
+
+    def top_positions(self, provider, k=MATCH_COUNT):
+        """
+        Returns the roster positions of the top k eligible MDs for one provider.
+        """
+        _, order, _ = self._score_one(provider)
+        return order[:k]
+
+    def top_matches(self, provider, k=MATCH_COUNT):
+        """
+        Returns the top k eligible MDs for one provider in the same shape as the LLM
+        response ({"name", "email", "capacity_status", "match_score", "reasoning"}).
+        """
+        scores, order, components = self._score_one(provider)
+
+        matches = []
+        for column in order[:k]:
+            doctor = self.doctors_df.iloc[column]
+            reasons = [
+                f"{name.replace('_', ' ')} {components[name][0, column]:.1f}/{WEIGHTS[name]:.0f}"
+                for name in WEIGHTS
+            ]
+            matches.append({
+                "name": str(doctor['FULL_NAME']),
+                "email": str(doctor['EMAIL']),
+                "capacity_status": str(doctor['ACCEPTING_STATUS']),
+                "match_score": round(float(scores[column]), 1),
+                "reasoning": f"Local score for {doctor['RESIDING_STATE']}-based MD: " + ", ".join(reasons) + ".",
+            })
+        return matches
@@ -0,0 +1,193 @@
+import ast
+import numpy as np
+import pandas as pd
+import re
+import threading
+
+# Canonical service names and the spellings/brands that map to them
+SERVICE_SYNONYMS = {
+    "Neurotoxin": ["botox", "neurotoxin", "neurotoxins", "neuromodulator", "neuromodulators", "tox", "dysport",
+                   "xeomin", "jeuveau", "daxxify", "wrinkle relaxer", "wrinkle relaxers", "botulinum toxin"],
+    "Dermal Filler": ["filler", "fillers", "dermal filler", "dermal fillers", "lip filler", "lip fillers",
+                      "juvederm", "restylane", "rha", "versa"],
+    "Biostimulator": ["biostimulator", "biostimulators", "sculptra", "radiesse"],
+    "Laser": ["laser", "lasers", "laser hair removal", "ipl", "bbl", "laser resurfacing", "co2 laser"],
+    "Microneedling": ["microneedling", "micro needling", "rf microneedling", "morpheus8"],
+    "Chemical Peel": ["chemical peel", "chemical peels", "peel", "peels"],
+    "Facial": ["facial", "facials", "hydrafacial", "dermaplaning", "skin care", "skincare"],
+    "IV Therapy": ["iv", "iv therapy", "iv hydration", "iv drips", "vitamin injections", "vitamin shots", "b12"],
+    "Weight Loss": ["weight loss", "medical weight loss", "semaglutide", "tirzepatide", "glp-1", "glp1"],
+    "Hormone Therapy": ["hormone therapy", "hormones", "hrt", "bhrt", "testosterone"],
+    "PRP": ["prp", "prf", "platelet rich plasma", "vampire facial"],
+    "Kybella": ["kybella", "deoxycholic acid"],
+    "Sclerotherapy": ["sclerotherapy", "spider veins"],
+    "Threads": ["threads", "pdo threads", "thread lift", "thread lifts"],
+    "Body Contouring": ["body contouring", "coolsculpting", "emsculpt", "cryolipolysis"],
+}
+
+SERVICE_COLUMNS = ["PROVIDER_SERVICES", "PROVIDER_FUTURE_SERVICES", "ACCEPTED_SERVICES"]
+
+
+def split_list_field(value):
+    """
+    Splits a list-like string ('["Botox", "Filler"]') or a comma/semicolon-separated
+    string into a list of stripped, non-empty values.
+    """
+    if value is None or (not isinstance(value, (list, tuple)) and pd.isna(value)):
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if v and str(v).strip()]
+
+    value = str(value).strip()
+    if not value or value.lower() in {"n/a", "na", "none", "none specified"}:
+        return []
+
+    try:
+        # Try parsing as a list string (e.g., '["Botox", "Filler"]')
+        parsed = ast.literal_eval(value)
+        if isinstance(parsed, (list, tuple)):
+            return [str(v).strip() for v in parsed if v and str(v).strip()]
+    except (ValueError, SyntaxError):
+        pass
+
+    # Fallback: treat as delimited string
+    delimiter = ';' if ';' in value else ','
+    return [v.strip() for v in value.split(delimiter) if v.strip()]
+
+def _service_key(value):
+    return re.sub(r"\s+", " ", re.sub(r"[^a-z0-9+ ]", " ", value.lower())).strip()
+
+
+class ServiceVocabulary:
+    """
+    Interned vocabulary of canonical services. Each canonical service owns one bit;
+    services not in SERVICE_SYNONYMS are interned on first sight and get the next bit,
+    so masks built earlier in the process stay valid.
+    """
+
+    def __init__(self, synonyms=SERVICE_SYNONYMS):
+        self.names = []
+        self.bits = {}
+        self.aliases = {}
+        self._lock = threading.Lock()
+        for name, spellings in synonyms.items():
+            self._intern(name)
+            for spelling in [name, *spellings]:
+                self.aliases[_service_key(spelling)] = name
+
+    def _intern(self, name):
+        if name not in self.bits:
+            self.bits[name] = len(self.names)
+            self.names.append(name)
+        return self.bits[name]
+
+    def canonicalize(self, service):
+        """
+        Returns the canonical name for a raw service string, interning unknown services.
+        """
+        key = _service_key(service)
+        if not key:
+            return None
+        with self._lock:
+            if key not in self.aliases:
+                self.aliases[key] = service.strip().title()
+                self._intern(self.aliases[key])
+            return self.aliases[key]
+
+    def mask(self, value):
+        """
+        Returns the integer bitmask for a raw service field (list string or delimited string).
+        """
+        mask = 0
+        for service in split_list_field(value):
+            name = self.canonicalize(service)
+            if name is not None:
+                mask |= 1 << self.bits[name]
+        return mask
+
+    def decode(self, mask):
+        """
+        Returns the canonical names set in a bitmask.
+        """
+        return [name for bit, name in enumerate(self.names) if mask >> bit & 1]
+
+    def mask_matrix(self, masks, width=None):
+        """
+        Expands an array of bitmasks into a boolean (rows x width) matrix, one column per bit.
+        """
+        width = len(self.names) if width is None else width
+        masks = np.asarray(masks)
+        if masks.dtype != object and width <= 63:
+            return ((masks.astype(np.int64)[:, None] >> np.arange(width)) & 1).astype(bool)
+        return np.array([[bool(int(m) >> bit & 1) for bit in range(width)] for m in masks],
+                        dtype=bool).reshape(len(masks), width)
+
+
+SERVICE_VOCABULARY = ServiceVocabulary()
+
+
+def normalize_services(df, vocabulary=SERVICE_VOCABULARY):
+    """
+    Adds, for every service column present in df, a parsed <COLUMN>_LIST column (for badges)
+    and a <COLUMN>_MASK integer bitmask column over the canonical vocabulary. Run once at
+    data load; returns a new DataFrame.
+    """
+    df = df.copy()
+    for column in SERVICE_COLUMNS:
+        if column not in df.columns:
+            continue
+        df[f"{column}_LIST"] = [tuple(split_list_field(value)) for value in df[column]]
+        masks = [vocabulary.mask(value) for value in df[column]]
+        # Python ints once the vocabulary outgrows int64
+        dtype = "int64" if len(vocabulary.names) < 63 else object
+        df[f"{column}_MASK"] = np.array(masks, dtype=dtype)
+    return df
+
+def service_masks(df, column, vocabulary=SERVICE_VOCABULARY):
+    """
+    Returns the precomputed bitmask column for a service column, computing it if
+    normalize_services hasn't been run on df.
+    """
+    if f"{column}_MASK" in df.columns:
+        return df[f"{column}_MASK"].to_numpy()
+    return np.array([vocabulary.mask(value) for value in df[column]], dtype=object)
+
+def popcount(masks):
+    """
+    Number of services set in each bitmask.
+    """
+    return np.array([bin(int(m)).count("1") for m in masks], dtype=np.int32)
+
+def service_mask(record, column, vocabulary=SERVICE_VOCABULARY):
+    """
+    Returns the bitmask for a single ticket or MD row.
+    """
+    mask = record.get(f"{column}_MASK")
+    if mask is not None:
+        return int(mask)
+    return vocabulary.mask(record.get(column))
+
+def generate_service_badges(service_string):
+    """
+    Converts a list-like string or delimited string of services into HTML badge spans.
+    Handles cases where services are passed in as a list string like '["Botox", "Filler"]'
+    or as a comma/semicolon-separated string, or already parsed at data load (tuple).
+    """
+    if isinstance(service_string, (list, tuple)):
+        return ' '.join(f'<span class="service-badge">{s}</span>' for s in service_string if s)
+
+    if not service_string or service_string == "None specified":
+        return ""
+
+    try:
+        # Try parsing as a list string (e.g., '["Botox", "Filler"]')
+        services = ast.literal_eval(service_string)
+        if isinstance(services, list):
+            return ' '.join(f'<span class="service-badge">{s.strip()}</span>' for s in services if s)
+    except (ValueError, SyntaxError):
+        pass
+
+    # Fallback: treat as delimited string
+    delimiter = ';' if ';' in service_string else ','
+    services = [s.strip() for s in service_string.split(delimiter)]
+    return ' '.join(f'<span class="service-badge">{s}</span>' for s in services if s)
@@ -0,0 +1,102 @@
+import json
+
+from concurrent.futures import ThreadPoolExecutor
+
+from client_utils import LLMError, cached_complete
+from llm_utils import DEFAULT_PARAMS, MATCH_COUNT, clean_json_response
+from parse_utils import parse_matches
+from prompt_utils import create_prompt, create_reduce_prompt, create_shard_prompts
+
+
+def merge_shortlists(shortlists, match_count=MATCH_COUNT):
+    """
+    Deterministic reduce step: combines shard shortlists, keeps the highest-scoring entry
+    per MD email and returns the top match_count by match_score.
+    """
+    best = {}
+    for shortlist in shortlists:
+        for match in shortlist:
+            key = match["email"].lower()
+            if key not in best or match["match_score"] > best[key]["match_score"]:
+                best[key] = match
+    ranked = sorted(best.values(), key=lambda m: m["match_score"], reverse=True)
+    return ranked[:match_count]
+
+def match_sharded(llm_client, doctors_df, provider, filters=None, md_index=None, cache=None, shard_size=25,
+                  shortlist_size=5, match_count=MATCH_COUNT, reduce="merge", max_workers=8, prompts_sent=None):
+    """
+    Map-reduce matching for large rosters. The eligible MDs are split into shards of
+    shard_size, each shard is sent as a parallel call returning its top shortlist_size,
+    and the shortlists are reduced to the final top match_count, either by merging on
+    match_score (reduce="merge") or with a small re-ranking call (reduce="llm").
+
+    Returns (content, params, error), where content has the same {"matches": [...]}
+    shape as a single-prompt response. If prompts_sent is a list, every prompt sent
+    (the shards, then the re-ranking prompt if any) is appended to it.
+    """
+    if filters is None:
+        filters = {}
+    if prompts_sent is None:
+        prompts_sent = []
+
+    prompts, error = create_shard_prompts(
+        doctors_df, provider, filters=filters, md_index=md_index, shard_size=shard_size, shortlist_size=shortlist_size
+    )
+    if error:
+        return None, None, error
+
+    if len(prompts) == 1:
+        # Small enough for a single call
+        prompt, error = create_prompt(doctors_df, provider, filters=filters, md_index=md_index, match_count=match_count)
+        if error:
+            return None, None, error
+        prompts_sent.append(prompt)
+        try:
+            content, params, _ = cached_complete(
+                llm_client, prompt, cache=cache,
+                prompt_for=lambda model: create_prompt(
+                    doctors_df, provider, filters=filters, md_index=md_index, match_count=match_count, model=model
+                )[0],
+            )
+        except LLMError as e:
+            return None, None, str(e)
+        return content, {**params, "shards": 1}, None
+
+    prompts_sent.extend(prompts)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(prompts))) as pool:
+        futures = [pool.submit(cached_complete, llm_client, prompt, cache=cache) for prompt in prompts]
+
+    shortlists, errors, models = [], [], []
+    for future in futures:
+        try:
+            content, params, _ = future.result()
+        except Exception as e:
+            errors.append(str(e))
+            continue
+        shortlists.append(parse_matches(clean_json_response(content))["matches"])
+        models.append(params["model"])
+
+    if not any(shortlists):
+        return None, None, f"All {len(prompts)} shards failed: {'; '.join(errors) or 'no matches returned'}"
+
+    candidates = merge_shortlists(shortlists, match_count=sum(len(s) for s in shortlists))
+    params = {
+        "model": max(set(models), key=models.count),
+        **DEFAULT_PARAMS,
+        "shards": len(prompts),
+        "failed_shards": len(errors),
+        "shard_size": shard_size,
+        "shortlist_size": shortlist_size,
+        "reduce": reduce,
+    }
+
+    if reduce == "llm" and len(candidates) > match_count:
+        reduce_prompt = create_reduce_prompt(provider, candidates, match_count, filters.get("service_requirements", ""))
+        prompts_sent.append(reduce_prompt)
+        try:
+            content, reduce_params, _ = cached_complete(llm_client, reduce_prompt, cache=cache)
+        except LLMError as e:
+            return None, None, f"Re-ranking the {len(candidates)} shortlisted MDs failed: {e}"
+        return content, {**reduce_params, **{k: v for k, v in params.items() if k != "model"}}, None
+
+    return json.dumps({"matches": candidates[:match_count]}), params, None
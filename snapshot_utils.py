@@ -0,0 +1,92 @@
+from types import MappingProxyType
+
+from store_utils import ticket_key
+
+# Low-cardinality columns stored as categoricals (one small integer code per row)
+TICKET_CATEGORY_COLUMNS = [
+    "TICKET_STATUS",
+    "TICKET_PRIORITY",
+    "PROVIDER_LICENSE_TYPE",
+    "PROVIDER_EXPERIENCE_LEVEL",
+    "PROVIDER_STATE",
+    "PROVIDER_MD_LOCATION_PREFERENCE",
+]
+MD_CATEGORY_COLUMNS = [
+    "RESIDING_STATE",
+    "EXPERIENCE_LEVEL",
+    "ACCEPTING_STATUS",
+]
+
+
+def compact_frame(df, columns):
+    """
+    Returns a copy of df with the given columns (where present) stored as categoricals.
+    """
+    return df.astype({column: "category" for column in columns if column in df.columns})
+
+
+class TicketSnapshot:
+    """
+    Compact view of the tickets mart built once per data load and never modified after.
+
+    Low-cardinality columns are categoricals, the "Subject - Status" display labels and
+    their selectbox order (by TICKET_STATUS, descending) are precomputed, and tickets can
+    be looked up by label or ticket key in constant time. version is the loader's content
+    fingerprint, so anything derived from the snapshot can be cached on it. The mart frame
+    passed in is copied, not changed.
+    """
+
+    def __init__(self, providers_df, version):
+        df = compact_frame(providers_df, TICKET_CATEGORY_COLUMNS).reset_index(drop=True)
+        df["DISPLAY"] = df["SUBJECT"].astype(str) + " - " + df["TICKET_STATUS"].astype(str)
+        self.df = df
+        self.version = version
+
+        order = df["TICKET_STATUS"].astype(str).sort_values(ascending=False, kind="stable").index
+        self.labels = tuple(df["DISPLAY"].iloc[order])
+        rows = {}
+        for position, label in enumerate(df["DISPLAY"]):
+            # Duplicate labels resolve to the first ticket, as the selectbox filter did
+            rows.setdefault(label, position)
+        self.rows = MappingProxyType(rows)
+        self.keys = MappingProxyType({
+            ticket_key(provider): position for position, provider in enumerate(df.to_dict("records"))
+        })
+
+    def __len__(self):
+        return len(self.df)
+
+    def provider(self, label):
+        """
+        Returns the ticket row for a display label, or None if it's not in this snapshot.
+        """
+        position = self.rows.get(label)
+        return self.df.iloc[position] if position is not None else None
+
+    def provider_by_key(self, key):
+        position = self.keys.get(key)
+        return self.df.iloc[position] if position is not None else None
+
+    def memory_usage(self):
+        return int(self.df.memory_usage(deep=True).sum())
+
+
+class RosterSnapshot:
+    """
+    Compact view of the MD roster built once per data load and never modified after, with
+    categorical state/experience/status columns and version set to the loader's content
+    fingerprint. The frame is pre-sorted by RESIDING_STATE, the order MDs are listed in
+    prompts, so per-prompt sorts find it already in order.
+    """
+
+    def __init__(self, doctors_df, version):
+        df = compact_frame(doctors_df, MD_CATEGORY_COLUMNS)
+        order = df["RESIDING_STATE"].astype(str).reset_index(drop=True).sort_values(kind="stable").index
+        self.df = df.iloc[order].reset_index(drop=True)
+        self.version = version
+
+    def __len__(self):
+        return len(self.df)
+
+    def memory_usage(self):
+        return int(self.df.memory_usage(deep=True).sum())
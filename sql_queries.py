@@ -32,4 +32,42 @@ AVAILABLE_MDS_QUERY = """
     MD_BIO
   FROM analytics.dbt.hubspot_md_contacts_mart
   WHERE ACCEPTING_STATUS IN ('Open', 'Open - Mid Level Only')
-"""
\ No newline at end of file
+"""
+
+# Tickets changed since the last load (any status, so tickets that left
+# Pending (MD Matching) can be dropped from the cached snapshot)
+TICKETS_DELTA_QUERY = """
+SELECT 
+  subject,
+  bird_eats_bug_email AS provider_email,
+  ticket_status,
+  ticket_priority,
+  kick_off_date,
+  license_type AS provider_license_type,
+  experience_level AS provider_experience_level,
+  state_medspa_premise AS provider_state,
+  md_location_preference_state AS provider_md_location_preference,
+  services_provided AS provider_services,
+  future_services AS provider_future_services,
+  additional_service_notes AS provider_additional_services
+FROM analytics.dbt.hubspot_md_tickets_mart 
+WHERE bird_eats_bug_email IS NOT NULL
+    AND updated_at >= %(since)s
+"""
+
+# MDs changed since the last load (any accepting status, so MDs that closed
+# can be dropped from the cached snapshot)
+AVAILABLE_MDS_DELTA_QUERY = """
+  SELECT
+    FULL_NAME,
+    EMAIL,
+    RESIDING_STATE,
+    LICENSED_STATES,
+    EXPERIENCE_LEVEL,
+    ACCEPTING_STATUS,
+    ACCEPTED_SERVICES,
+    MD_TRAITS,
+    MD_BIO
+  FROM analytics.dbt.hubspot_md_contacts_mart
+  WHERE UPDATED_AT >= %(since)s
+"""
@@ -0,0 +1,113 @@
+import hashlib
+import orjson
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+DEFAULT_STORE_PATH = os.path.join(".cache", "match_store.sqlite3")
+
+
+def ticket_key(provider):
+    """
+    Stable key for a ticket across sessions and reloads.
+    """
+    return f"{provider['SUBJECT']}|{provider['PROVIDER_EMAIL']}".lower()
+
+def provider_version(provider):
+    """
+    Hash of the ticket's query columns; changes whenever any provider field does.
+    """
+    fields = {
+        column: None if not isinstance(value, (list, tuple)) and pd.isna(value) else str(value)
+        for column, value in provider.items()
+        if not column.endswith(("_LIST", "_MASK")) and column != "DISPLAY"
+    }
+    return hashlib.sha256(orjson.dumps(fields, option=orjson.OPT_SORT_KEYS)).hexdigest()[:16]
+
+
+class MatchStore:
+    """
+    Server-side store of match results shared by every session and coordinator.
+
+    Entries are keyed by ticket, the provider row version and the roster snapshot
+    version, so a stored result is only returned while neither the ticket nor the set
+    of open MDs has changed; anything else is a miss and the ticket is matched again.
+    Superseded entries are pruned after max_age_seconds.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH, max_age_seconds=30 * 24 * 3600):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS matches (
+                ticket_key TEXT NOT NULL,
+                provider_version TEXT NOT NULL,
+                roster_version TEXT NOT NULL,
+                created REAL NOT NULL,
+                created_by TEXT,
+                model TEXT,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (ticket_key, provider_version, roster_version)
+            )
+        """)
+
+    def get(self, ticket, provider_version, roster_version):
+        """
+        Returns the stored entry ({"created", "created_by", "model", **payload}) or None.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT created, created_by, model, payload FROM matches "
+                "WHERE ticket_key = ? AND provider_version = ? AND roster_version = ?",
+                (ticket, provider_version, roster_version),
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        created, created_by, model, payload = row
+        return {"created": created, "created_by": created_by, "model": model, **orjson.loads(payload)}
+
+    def has(self, ticket, provider_version, roster_version):
+        """
+        True if a result is stored for the ticket and versions (doesn't count as a hit).
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM matches WHERE ticket_key = ? AND provider_version = ? AND roster_version = ?",
+                (ticket, provider_version, roster_version),
+            ).fetchone() is not None
+
+    def put(self, ticket, provider_version, roster_version, payload, created_by=None, model=None):
+        """
+        Stores a match result, replacing any entry for the same ticket and versions.
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (ticket, provider_version, roster_version, time.time(), created_by, model,
+                 orjson.dumps(payload, default=str).decode()),
+            )
+            self._db.execute("DELETE FROM matches WHERE created < ?", (time.time() - self.max_age_seconds,))
+
+    def invalidate(self, ticket):
+        """
+        Drops every stored result for a ticket.
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM matches WHERE ticket_key = ?", (ticket,))
+
+    def stats(self):
+        with self._lock:
+            entries, tickets = self._db.execute("SELECT COUNT(*), COUNT(DISTINCT ticket_key) FROM matches").fetchone()
+        return {"entries": entries, "tickets": tickets, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,113 @@
+import pandas as pd
+import random
+
+from datetime import date, timedelta
+
+from filter_utils import MID_LEVEL_ONLY_STATUS, US_STATES
+
+FIRST_NAMES = ["Olivia", "Liam", "Emma", "Noah", "Ava", "Elijah", "Sophia", "James", "Isabella", "Lucas",
+               "Mia", "Mateo", "Amelia", "Ethan", "Harper", "Priya", "Wei", "Fatima", "Diego", "Aisha"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez",
+              "Martinez", "Nguyen", "Patel", "Kim", "Chen", "Lopez", "Wilson", "Anderson", "Thomas", "Lee", "Shah"]
+
+# Share of MDs and providers per state, skewed towards the big medspa markets
+STATE_WEIGHTS = {"CA": 0.22, "TX": 0.14, "FL": 0.13, "NY": 0.09, "AZ": 0.05, "NV": 0.04, "GA": 0.04,
+                 "IL": 0.04, "CO": 0.03, "WA": 0.03, "NJ": 0.03, "NC": 0.03}
+
+# Raw spellings as they show up in HubSpot, including synonyms, brands and services outside the taxonomy
+SERVICE_SPELLINGS = ["Botox", "botox", "Neurotoxins", "Dysport", "Fillers", "Dermal Filler", "lip filler",
+                     "Sculptra", "Laser Hair Removal", "IPL", "Microneedling", "Morpheus8", "Chemical Peels",
+                     "HydraFacial", "IV Therapy", "B12", "Semaglutide", "Weight Loss", "HRT", "PRP",
+                     "Kybella", "Sclerotherapy", "PDO Threads", "CoolSculpting", "Hair Restoration", "Tattoo Removal"]
+TRAITS = ["Mentor", "Hands-off", "Detail oriented", "Responsive", "Collaborative", "Calm", "Direct",
+          "Flexible schedule", "Business minded", "Patient", "Clinical focus", "Entrepreneurial"]
+EXPERIENCE_LEVELS = ["New (less than 1 year)", "Intermediate (1-3 years)", "Experienced (3+ years)", "Expert (10+ years)"]
+LICENSE_TYPES = ["RN", "NP", "PA-C", "Nurse Practitioner", "Physician Assistant", "LVN", "DO"]
+BIO_SENTENCES = [
+    "Board certified in {specialty} with {years} years of clinical practice.",
+    "Has supervised {count} medspas across {state}.",
+    "Passionate about mentoring injectors who are new to aesthetics.",
+    "Prefers providers who follow written protocols and hold monthly chart reviews.",
+    "Available for virtual consults most weekdays and responds within a day.",
+    "Previously served as medical director for a multi-location aesthetics group.",
+    "Focuses on patient safety, complication management and continuing education.",
+    "Enjoys working with entrepreneurial owners building their first practice.",
+]
+SPECIALTIES = ["dermatology", "family medicine", "plastic surgery", "emergency medicine", "internal medicine"]
+
+_STATE_ABBREVIATIONS = list(STATE_WEIGHTS) + [s for s in US_STATES if s not in STATE_WEIGHTS]
+_STATE_WEIGHTS = list(STATE_WEIGHTS.values()) + [0.01] * (len(US_STATES) - len(STATE_WEIGHTS))
+
+
+def _states(rng, size):
+    return rng.choices(_STATE_ABBREVIATIONS, weights=_STATE_WEIGHTS, k=size)
+
+def _services(rng, low, high):
+    """
+    A random service list, written in one of the formats HubSpot exports use.
+    """
+    services = rng.sample(SERVICE_SPELLINGS, rng.randint(low, high))
+    style = rng.randrange(3)
+    if style == 0:
+        return str(services)
+    return (", " if style == 1 else "; ").join(services)
+
+def _bio(rng, state):
+    sentences = rng.sample(BIO_SENTENCES, rng.randint(2, 6))
+    return " ".join(sentence.format(
+        specialty=rng.choice(SPECIALTIES), years=rng.randint(3, 29), count=rng.randint(1, 24), state=state,
+    ) for sentence in sentences)
+
+def generate_mds(count, seed=0):
+    """
+    Returns a frame shaped like AVAILABLE_MDS_QUERY results with count accepting MDs.
+    """
+    rng = random.Random(seed)
+    residing = _states(rng, count)
+    rows = []
+    for i in range(count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        state = US_STATES[residing[i]]
+        licensed = {state, *(US_STATES[s] for s in _states(rng, rng.randint(0, 5)))}
+        rows.append({
+            "FULL_NAME": f"Dr. {first} {last}",
+            "EMAIL": f"{first}.{last}.{i}@md.example.com".lower(),
+            "RESIDING_STATE": state,
+            "LICENSED_STATES": str(sorted(licensed)),
+            "EXPERIENCE_LEVEL": rng.choice(EXPERIENCE_LEVELS[1:]),
+            "ACCEPTING_STATUS": MID_LEVEL_ONLY_STATUS if rng.random() < 0.2 else "Open",
+            "ACCEPTED_SERVICES": _services(rng, 0, 8),
+            "MD_TRAITS": str(rng.sample(TRAITS, rng.randint(1, 4))),
+            "MD_BIO": _bio(rng, state),
+        })
+    return pd.DataFrame(rows)
+
+def generate_tickets(count, seed=0):
+    """
+    Returns a frame shaped like TICKETS_QUERY results with count pending MD Matching tickets.
+    """
+    rng = random.Random(seed + 1)
+    states = _states(rng, count)
+    kick_off = date(2026, 1, 1)
+    rows = []
+    for i in range(count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        # Tickets mix abbreviations and full state names
+        state = states[i] if rng.random() < 0.5 else US_STATES[states[i]]
+        preference = rng.choice(["", "", state, US_STATES[_states(rng, 1)[0]]])
+        rows.append({
+            "SUBJECT": f"{first} {last} Aesthetics {i} - MD Matching",
+            "PROVIDER_EMAIL": f"{first}.{last}.{i}@provider.example.com".lower(),
+            "TICKET_STATUS": "Pending (MD Matching)",
+            "TICKET_PRIORITY": rng.choice(["High", "Medium", "Low"]),
+            "KICK_OFF_DATE": str(kick_off + timedelta(days=rng.randrange(120))),
+            "PROVIDER_LICENSE_TYPE": rng.choice(LICENSE_TYPES),
+            "PROVIDER_EXPERIENCE_LEVEL": rng.choice(EXPERIENCE_LEVELS),
+            "PROVIDER_STATE": state,
+            "PROVIDER_MD_LOCATION_PREFERENCE": preference or None,
+            "PROVIDER_SERVICES": _services(rng, 1, 5),
+            "PROVIDER_FUTURE_SERVICES": _services(rng, 0, 3) or None,
+            "PROVIDER_ADDITIONAL_SERVICES": rng.choice(["", "Opening in a shared suite", "Needs an MD who speaks Spanish",
+                                                        "Wants monthly chart reviews"]) or None,
+        })
+    return pd.DataFrame(rows)
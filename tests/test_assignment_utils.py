@@ -0,0 +1,107 @@
+import itertools
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from assignment_utils import COST_SCALE, assign, license_group, md_capacities
+from data_utils import PRIORITY_RANK, priority_rank
+
+PRIORITIES = ["Urgent", "High", "Medium", "Low", ""]
+
+
+class StubScorer:
+    """
+    Stands in for MatchScorer with a fixed score matrix (-inf = ineligible).
+    """
+
+    def __init__(self, doctors_df, scores):
+        self.doctors_df = doctors_df
+        self.scores = scores
+
+    def shortlists(self, providers_df, k=10):
+        positions, top_scores = [], []
+        for row in self.scores:
+            columns = [md for md in np.argsort(-row, kind="stable")[:k] if np.isfinite(row[md])]
+            positions.append(np.array(columns, dtype=int))
+            top_scores.append(row[columns])
+        return positions, top_scores
+
+
+def random_case(seed):
+    rng = random.Random(seed)
+    n_mds, n_tickets = rng.randint(1, 3), rng.randint(1, 6)
+    doctors_df = pd.DataFrame({
+        "EMAIL": [f"md{i}@example.com" for i in range(n_mds)],
+        "ACCEPTING_STATUS": [rng.choice(["Open", "Open - Mid Level Only"]) for _ in range(n_mds)],
+    })
+    providers_df = pd.DataFrame({
+        "PROVIDER_LICENSE_TYPE": [rng.choice(["NP", "RN"]) for _ in range(n_tickets)],
+        "TICKET_PRIORITY": [rng.choice(PRIORITIES) for _ in range(n_tickets)],
+    })
+    scores = np.array([
+        [round(rng.uniform(0, 10), 1) if rng.random() < 0.8 else -np.inf for _ in range(n_mds)]
+        for _ in range(n_tickets)
+    ])
+    capacity = {"mid_level": rng.randint(0, 2), "other": rng.randint(0, 2)}
+    return doctors_df, providers_df, scores, capacity
+
+
+def objective(providers_df, scores, choice, spread_penalty, priority_weight):
+    """
+    (tickets assigned, score in COST_SCALE units) for one assignment, as assign() ranks them.
+    """
+    value, per_md = 0, {}
+    for row, md in enumerate(choice):
+        if md is None:
+            urgency = len(PRIORITY_RANK) - priority_rank(providers_df['TICKET_PRIORITY'][row])
+            value -= int(round(urgency * priority_weight * COST_SCALE))
+            continue
+        value += int(round(float(scores[row, md]) * COST_SCALE))
+        value -= int(round(per_md.get(md, 0) * spread_penalty * COST_SCALE))
+        per_md[md] = per_md.get(md, 0) + 1
+    return sum(md is not None for md in choice), value
+
+
+def brute_force(doctors_df, providers_df, scores, capacity, spread_penalty, priority_weight):
+    capacities = md_capacities(doctors_df, capacity)
+    groups = [license_group(value) for value in providers_df['PROVIDER_LICENSE_TYPE']]
+    options = [
+        [None] + [md for md in range(len(doctors_df)) if np.isfinite(scores[row, md]) and capacities[groups[row]][md] > 0]
+        for row in range(len(providers_df))
+    ]
+    best = None
+    for choice in itertools.product(*options):
+        used = {}
+        for row, md in enumerate(choice):
+            if md is not None:
+                used[(md, groups[row])] = used.get((md, groups[row]), 0) + 1
+        if any(count > capacities[group][md] for (md, group), count in used.items()):
+            continue
+        value = objective(providers_df, scores, choice, spread_penalty, priority_weight)
+        best = value if best is None else max(best, value)
+    return best
+
+
+@pytest.mark.parametrize("spread_penalty,priority_weight", [(0.0, 0.0), (0.5, 1.0)])
+def test_assign_matches_brute_force(spread_penalty, priority_weight):
+    for seed in range(300):
+        doctors_df, providers_df, scores, capacity = random_case(seed)
+        assignments, _ = assign(
+            StubScorer(doctors_df, scores), providers_df, capacity=capacity,
+            spread_penalty=spread_penalty, priority_weight=priority_weight,
+        )
+        choice = [assigned[0] if assigned else None for assigned in assignments]
+        assert objective(providers_df, scores, choice, spread_penalty, priority_weight) == brute_force(
+            doctors_df, providers_df, scores, capacity, spread_penalty, priority_weight
+        ), f"seed {seed}"
+
+
+def test_later_tickets_can_displace_earlier_ones():
+    doctors_df = pd.DataFrame({"EMAIL": ["a@example.com", "b@example.com"], "ACCEPTING_STATUS": ["Open", "Open"]})
+    providers_df = pd.DataFrame({"PROVIDER_LICENSE_TYPE": ["NP"] * 4, "TICKET_PRIORITY": [""] * 4})
+    scores = np.array([[3.0, 2.0], [0.9, 0.5], [9.4, 1.0], [1.0, 8.2]])
+    assignments, remaining = assign(StubScorer(doctors_df, scores), providers_df, capacity={"mid_level": 1})
+    assert [assigned[0] if assigned else None for assigned in assignments] == [None, None, 0, 1]
+    assert remaining["mid_level"].tolist() == [0, 0]